@@ -1,47 +1,23 @@
+"""Точка входа для локальной разработки.
+Для production используйте `gunicorn -c gunicorn.conf.py` (см. `vpncon/app.py`)
+"""
 import logging
-from flask import Flask
-from swagger_ui import api_doc
 
-
-# ===============================================
-# Setup logging
-# ===============================================
-from vpncon.config import setup_logging
+from vpncon.config import Config, setup_logging
+from vpncon.app import create_app
 
 setup_logging()
 logger = logging.getLogger(__name__)
 logger.info("Logging is set up")
 
 
-
-# ===============================================
-# Initialize DB
-# ===============================================
-from vpncon.db import validate_connection
-from vpncon.db.db_migrations import DbMigrator, PostgresMigrationExecutor
-
-logger.debug("Initializing the DB module")
-validate_connection()
-logger.debug("Connection validated")
-
-
-logger.info("Applying DB migrations if needed")
-DbMigrator(PostgresMigrationExecutor).apply_migrations()
-logger.info("DB module is initialized")
-
-
-
-# ===============================================
-# Initialize API
-# ===============================================
-from vpncon.users import users_bp
-
-app = Flask(__name__)
-app.register_blueprint(users_bp)
-
-api_doc(app, config_path='openapi.yml', url_prefix='/api/doc', title='API doc')
+class DevConfig(Config):
+    """Dev сервер сам проверяет БД и применяет миграции."""
+    APP_VALIDATE_DB = True
+    APP_RUN_MIGRATIONS = True
 
 
+app = create_app(DevConfig)
 
 
 if __name__ == "__main__":
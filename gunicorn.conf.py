@@ -0,0 +1,89 @@
+"""Конфигурация production сервера gunicorn.
+
+Запуск:
+```sh
+gunicorn -c gunicorn.conf.py
+```
+
+- воркеры стартуют сразу, не дожидаясь БД: проверка соединения, миграции и прогрев пула
+  идут в фоне с повторами (см. `vpncon/bootstrap.py`), до готовности `/readyz` отвечает `503`
+- миграции применяются под advisory lock, поэтому одновременно стартующие воркеры не мешают друг другу
+- количество воркеров, потоков и размер пула настраиваются вместе через `Config`
+- по SIGTERM воркер перестаёт принимать запросы, дожидается начатых, затем останавливает фоновые
+  компоненты, дожидается транзакций и закрывает пул (см. `vpncon/shutdown.py`)
+"""
+import logging
+import os
+import signal
+
+# До импорта Config: production значения по умолчанию, переменные окружения их перекрывают
+os.environ.setdefault("APP_BACKGROUND_BOOTSTRAP", "true")
+os.environ.setdefault("APP_RUN_MIGRATIONS", "true")
+
+from vpncon.config import Config, setup_logging
+
+
+wsgi_app = "vpncon.app:create_app()"
+bind = Config.WEB_BIND
+workers = Config.WEB_WORKERS
+# gthread или кооперативные gevent/eventlet: `DBExecutor` берётся на время транзакции
+# из общего пула экзекьютеров, все потоки и гринлеты воркера делят один пул соединений
+worker_class = Config.WEB_WORKER_CLASS
+threads = Config.WEB_THREADS
+# Одновременных запросов на воркер для gevent/eventlet
+worker_connections = Config.WEB_WORKER_CONNECTIONS
+# Приложение создаётся в воркере, после fork. Ничего из мастера не разделяется
+preload_app = False
+# Запросы дорабатывают, затем транзакции получают остаток `SHUTDOWN_TIMEOUT` и время на отмену
+graceful_timeout = Config.SHUTDOWN_TIMEOUT + Config.SHUTDOWN_CANCEL_GRACE + 1
+
+
+def on_starting(server):
+    setup_logging()
+    logger = logging.getLogger("gunicorn.conf")
+    if Config.WEB_WORKER_CLASS == "gthread" and Config.WEB_THREADS > Config.DB_POOL_MAX_SIZE:
+        logger.warning(
+            "WEB_THREADS=%d is greater than DB_POOL_MAX_SIZE=%d:"
+            " request threads will wait for connections",
+            Config.WEB_THREADS, Config.DB_POOL_MAX_SIZE
+        )
+
+
+def post_fork(server, worker):
+    # os.register_at_fork уже сбросил пул, но делаем это явно на случай preload_app
+    from vpncon.db.postgres_db import reset_pool
+    reset_pool()
+
+
+def post_worker_init(worker):
+    # Вызывается после загрузки приложения, но до того, как воркер начнёт принимать запросы.
+    # Пул прогревается в фоне, см. `create_app()`
+    if Config.EXPIRY_SCHEDULER_ENABLED:
+        # Безопасно в каждом воркере: пачки разбираются через SKIP LOCKED
+        from vpncon.users.expiry import ExpiryScheduler
+        ExpiryScheduler().start()
+    if Config.USERS_STATS_JOB_ENABLED:
+        # Безопасно в каждом воркере: проход по шарду выполняет один, под advisory lock
+        from vpncon.users.stats import UserStatsJob
+        UserStatsJob().start()
+    if Config.IDEMPOTENCY_PURGE_ENABLED:
+        from vpncon.idempotency import IdempotencyKeyPurger
+        IdempotencyKeyPurger().start()
+
+    # Обработчик SIGTERM воркера gunicorn уже установлен: сначала переводим приложение
+    # в режим остановки, затем отдаём сигнал gunicorn
+    from vpncon.shutdown import get_coordinator
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def handle_term(signum, frame):
+        get_coordinator().begin_drain()
+        if callable(previous):
+            previous(signum, frame)
+
+    signal.signal(signal.SIGTERM, handle_term)
+
+
+def worker_exit(server, worker):
+    # Вызывается в воркере после того, как он перестал обслуживать запросы
+    from vpncon.shutdown import get_coordinator
+    get_coordinator().shutdown()
@@ -1,11 +1,29 @@
 import pytest
-from tests.db_test_env import setup_test_db
-from vpncon.config import setup_logging
+from tests.db_test_env import setup_test_db, teardown_test_db
+from vpncon.config import Config, setup_logging
 
 setup_logging()
 
 @pytest.fixture(scope="session", autouse=True)
 def setup_and_teardown_db():
-    """Создаёт и уничтожает тестовую базу один раз за сессию pytest."""
-    setup_test_db()
-    yield
\ No newline at end of file
+    """Клонирует базу воркера из шаблона один раз за сессию pytest и удаляет её в конце.
+    С `DB_BACKEND=memory` postgres не нужен
+    """
+    if Config.DB_BACKEND == "memory":
+        yield None
+        return
+    base_uri = Config.DB_URI
+    dbname = setup_test_db()
+    yield dbname
+    teardown_test_db(dbname, base_uri)
+
+
+@pytest.fixture
+def db_transaction():
+    """Транзакция на весь тест, которая откатывается после него.
+    Функции с `auto_transaction` внутри теста работают в ней и ничего не коммитят
+    """
+    from vpncon.db import rollback_only_transaction
+
+    with rollback_only_transaction() as executor:
+        yield executor
@@ -0,0 +1,63 @@
+import threading
+import pytest
+from vpncon.db import PoolExhaustedError, Priority
+from vpncon.db.admission import AdmissionGate
+
+
+def test_acquire_within_capacity():
+    gate = AdmissionGate(capacity=2, max_waiting=0, reserved_high=0, timeout=0.1)
+    gate.acquire()
+    gate.acquire()
+    assert gate.in_use == 2
+    gate.release()
+    gate.release()
+    assert gate.in_use == 0
+
+
+def test_rejects_immediately_when_queue_is_full():
+    gate = AdmissionGate(capacity=1, max_waiting=0, reserved_high=0, timeout=10)
+    gate.acquire()
+    with pytest.raises(PoolExhaustedError):
+        gate.acquire()
+
+
+def test_times_out_when_no_slot_released():
+    gate = AdmissionGate(capacity=1, max_waiting=1, reserved_high=0, timeout=0.05)
+    gate.acquire()
+    with pytest.raises(PoolExhaustedError):
+        gate.acquire()
+    assert gate.in_use == 1
+
+
+def test_reserved_slot_only_for_high_priority():
+    gate = AdmissionGate(capacity=2, max_waiting=0, reserved_high=1, timeout=0.05)
+    gate.acquire(Priority.NORMAL)
+    with pytest.raises(PoolExhaustedError):
+        gate.acquire(Priority.NORMAL)
+    gate.acquire(Priority.HIGH)
+    assert gate.in_use == 2
+
+
+def test_waiter_gets_released_slot():
+    gate = AdmissionGate(capacity=1, max_waiting=1, reserved_high=0, timeout=5)
+    gate.acquire()
+    acquired = threading.Event()
+
+    def waiter():
+        gate.acquire()
+        acquired.set()
+
+    t = threading.Thread(target=waiter)
+    t.start()
+    gate.release()
+    t.join()
+    assert acquired.is_set()
+    assert gate.in_use == 1
+
+
+def test_acquire_without_wait_does_not_queue():
+    gate = AdmissionGate(capacity=1, max_waiting=1, reserved_high=0, timeout=10)
+    gate.acquire()
+    with pytest.raises(PoolExhaustedError):
+        gate.acquire(wait=False)
+    assert gate.in_use == 1
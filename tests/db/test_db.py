@@ -1,5 +1,7 @@
 import pytest
+from tests.fakes import FakeExecutor
 from vpncon.db import get_db_executor, DBExecutor, auto_transaction
+import contextvars
 import threading
 
 def test_get_db_executor_returns_executor():
@@ -116,3 +118,244 @@ def test_auto_transaction_depth_multi_thread(monkeypatch):
 
     assert results.count('commit') == number_of_threads
     assert len([r for r in results if isinstance(r, int)]) == number_of_threads
+
+
+def test_auto_transaction_retries_transient_error(monkeypatch):
+    from vpncon.config import Config
+    from vpncon.db import TransientTransactionError
+    monkeypatch.setattr(Config, 'DB_RETRY_BACKOFF_BASE', 0)
+    calls = []
+    patch_executor(monkeypatch, calls=calls)
+    attempts = []
+
+    @auto_transaction(retries=2)
+    def func():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise TransientTransactionError('serialization failure')
+        return 'ok'
+
+    assert func() == 'ok'
+    assert calls == ['open', 'rollback', 'open', 'commit']
+
+
+def test_auto_transaction_does_not_retry_nested_call(monkeypatch):
+    from vpncon.config import Config
+    from vpncon.db import TransientTransactionError
+    monkeypatch.setattr(Config, 'DB_RETRY_BACKOFF_BASE', 0)
+    calls = []
+    patch_executor(monkeypatch, calls=calls)
+
+    @auto_transaction(retries=2)
+    def inner():
+        raise TransientTransactionError('deadlock detected')
+
+    @auto_transaction
+    def outer():
+        inner()
+
+    with pytest.raises(TransientTransactionError):
+        outer()
+    assert calls == ['open', 'rollback']
+
+
+def test_rollback_only_transaction_joins_auto_transaction(monkeypatch):
+    from vpncon.db import rollback_only_transaction
+    calls = []
+    patch_executor(monkeypatch, calls=calls)
+
+    @auto_transaction
+    def func():
+        return 'ok'
+
+    with rollback_only_transaction():
+        assert func() == 'ok'
+        assert func() == 'ok'
+    # Вложенные вызовы ничего не коммитят, всё откатывается на выходе
+    assert calls == ['open', 'rollback']
+    # После выхода auto_transaction снова управляет транзакцией сам
+    func()
+    assert calls == ['open', 'rollback', 'open', 'commit']
+
+
+@pytest.fixture
+def executor_pool(monkeypatch):
+    import vpncon.db as db
+    pool = db.ExecutorPool(max_idle=4)
+    monkeypatch.setattr(db, "_executor_pool", pool)
+    monkeypatch.setattr(db, "_create_executor", FakeExecutor)
+    return pool
+
+
+def test_auto_transaction_recycles_executors(executor_pool):
+    seen = []
+
+    @auto_transaction
+    def func():
+        seen.append(get_db_executor())
+
+    def worker():
+        func()
+        func()
+
+    # Новый поток - новый контекст без закреплённого экзекьютера
+    t = threading.Thread(target=worker)
+    t.start()
+    t.join()
+    assert seen[0] is seen[1]
+    assert executor_pool._idle == [seen[0]]
+
+
+def test_asyncio_tasks_get_separate_executors(executor_pool):
+    import asyncio
+
+    @auto_transaction
+    def func():
+        return get_db_executor()
+
+    async def task():
+        await asyncio.sleep(0)
+        return func(), get_db_executor()
+
+    async def main():
+        return await asyncio.gather(*(task() for _ in range(3)))
+
+    results = []
+    t = threading.Thread(target=lambda: results.extend(asyncio.run(main())))
+    t.start()
+    t.join()
+    # Транзакции задач идут по очереди и переиспользуют один экзекьютер из пула,
+    # а экзекьютеры, закреплённые вне транзакции, у каждой задачи свои
+    assert len({id(in_tx) for in_tx, _ in results}) == 1
+    assert len({id(pinned) for _, pinned in results}) == 3
+
+
+def test_contexts_sharing_pinned_executor_do_not_share_transaction(executor_pool):
+    import contextvars
+    barrier = threading.Barrier(2, timeout=5)
+    seen = []
+
+    @auto_transaction
+    def func():
+        seen.append(get_db_executor())
+        # Обе транзакции открыты одновременно
+        barrier.wait()
+
+    def spawn():
+        # Потоки наследуют контекст с закреплённым экзекьютером, как задачи asyncio.to_thread
+        pinned = get_db_executor()
+        threads = [
+            threading.Thread(target=contextvars.copy_context().run, args=(func,))
+            for _ in range(2)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return pinned
+
+    pinned = contextvars.Context().run(spawn)
+    assert len(seen) == 2 and seen[0] is not seen[1]
+    assert pinned in seen
+
+
+class SnapshotExecutor(FakeExecutor):
+    """Экзекьютер без БД, запоминающий режимы транзакций и снимки."""
+    log = []
+    def __init__(self):
+        super().__init__()
+        self.snapshot = None
+    def configure_transaction(self, isolation_level, read_only=False, deferrable=False):
+        super().configure_transaction(isolation_level, read_only, deferrable)
+        self.log.append(('configure', isolation_level, read_only, deferrable))
+    def commit_and_close(self):
+        self.log.append(('commit', self.snapshot))
+        super().commit_and_close()
+    def export_snapshot(self):
+        self.snapshot = 'exported'
+        return self.snapshot
+    def import_snapshot(self, snapshot):
+        self.log.append(('import', snapshot))
+        self.snapshot = snapshot
+
+
+@pytest.fixture
+def snapshot_executors(executor_pool, monkeypatch):
+    import vpncon.db as db
+    SnapshotExecutor.log = []
+    monkeypatch.setattr(db, "_create_executor", SnapshotExecutor)
+    return SnapshotExecutor.log
+
+
+def test_read_in_snapshot_shares_exported_snapshot(snapshot_executors):
+    from vpncon.db import IsolationLevel, read_in_snapshot
+    seen = []
+    lock = threading.Lock()
+
+    def task(n):
+        def run():
+            with lock:
+                seen.append(get_db_executor().snapshot)
+            return n
+        return run
+
+    # Чистый контекст: без экзекьютера, закреплённого другими тестами
+    result = contextvars.Context().run(
+        read_in_snapshot, [task(n) for n in range(5)], workers=3, deferrable=True
+    )
+    assert result == [0, 1, 2, 3, 4]
+    assert seen == ['exported'] * 5
+    # Импортирующие транзакции не DEFERRABLE, экспортирующая закрывается последней
+    configure = [entry for entry in snapshot_executors if entry[0] == 'configure']
+    assert configure.count(('configure', IsolationLevel.SERIALIZABLE, True, True)) == 1
+    assert configure.count(('configure', IsolationLevel.SERIALIZABLE, True, False)) == 2
+    assert snapshot_executors.count(('import', 'exported')) == 2
+    assert snapshot_executors[-1] == ('commit', 'exported')
+
+
+def test_read_in_snapshot_propagates_errors(snapshot_executors):
+    from vpncon.db import read_in_snapshot
+
+    def fail():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        contextvars.Context().run(read_in_snapshot, [fail, lambda: 1, lambda: 2], workers=2)
+
+
+def test_concurrent_read_in_snapshot_does_not_deadlock(snapshot_executors, monkeypatch):
+    import time
+    from vpncon.db import admission, read_in_snapshot
+    # Как по умолчанию: пул 5, один слот только для HIGH
+    gate = admission.AdmissionGate(capacity=5, max_waiting=8, reserved_high=1, timeout=0.2)
+    monkeypatch.setattr(admission, "_gates", {0: gate})
+    barrier = threading.Barrier(2, timeout=5)
+    results, errors = [], []
+
+    def slow():
+        time.sleep(0.1)
+        return 1
+
+    def call():
+        try:
+            barrier.wait()
+            results.append(read_in_snapshot([slow] * 8, workers=4))
+        except Exception as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=contextvars.Context().run, args=(call,)) for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    assert results == [[1] * 8, [1] * 8]
+    assert gate.in_use == 0
+
+
+def test_deferrable_requires_read_only_serializable():
+    from vpncon.db import IsolationLevel
+    with pytest.raises(ValueError):
+        auto_transaction(deferrable=True)
+    with pytest.raises(ValueError):
+        auto_transaction(read_only=True, deferrable=True, isolation_level=IsolationLevel.REPEATABLE_READ)
@@ -0,0 +1,98 @@
+import pytest
+from vpncon.db import auto_transaction, bind_executor, get_db_executor, UniqueConstraintError
+from vpncon.db.memory_db import MemoryDatabase, MemoryExecutor, _translate_query
+
+
+@pytest.fixture
+def executor():
+    return MemoryExecutor(MemoryDatabase())
+
+
+INSERT_USER = """
+    INSERT INTO users (telegram_id, telegram_nick, role)
+    VALUES (%(telegram_id)s, %(telegram_nick)s, %(role)s)
+"""
+COUNT_USERS = "SELECT count(*) FROM users"
+
+
+def test_translate_query():
+    assert _translate_query("a = %(a)s AND b LIKE 'x%%'") == "a = :a AND b LIKE 'x%'"
+
+
+def test_translate_trigram_operators():
+    query = "SELECT lower(nick) <-> %(n)s FROM users WHERE lower(nick) %% %(n)s"
+    assert _translate_query(query) == (
+        "SELECT (1 - similarity(lower(nick), :n)) FROM users"
+        " WHERE (similarity(lower(nick), :n) >= 0.3)"
+    )
+
+
+def test_commit(executor):
+    executor.open()
+    executor.execute(INSERT_USER, telegram_id=1, telegram_nick='nick', role='ADMIN')
+    executor.commit_and_close()
+    executor.open()
+    assert executor.execute(COUNT_USERS) == [(1,)]
+    executor.close()
+
+
+def test_rollback(executor):
+    executor.open()
+    executor.execute(INSERT_USER, telegram_id=1, telegram_nick='nick', role='ADMIN')
+    executor.rollback_and_close()
+    executor.open()
+    assert executor.execute(COUNT_USERS) == [(0,)]
+    executor.close()
+
+
+def test_unique_constraint(executor):
+    executor.open()
+    executor.execute(INSERT_USER, telegram_id=1, telegram_nick='nick', role='ADMIN')
+    with pytest.raises(UniqueConstraintError):
+        executor.execute(INSERT_USER, telegram_id=1, telegram_nick='other', role='ADMIN')
+    executor.rollback_and_close()
+
+
+def test_repeated_open_and_closed_execute(executor):
+    executor.open()
+    with pytest.raises(RuntimeError):
+        executor.open()
+    executor.close()
+    with pytest.raises(RuntimeError):
+        executor.execute(COUNT_USERS)
+
+
+def test_auto_transaction_rolls_back_on_error(executor):
+    @auto_transaction
+    def create_and_fail():
+        get_db_executor().execute(INSERT_USER, telegram_id=1, telegram_nick='nick', role='ADMIN')
+        raise ValueError("boom")
+
+    @auto_transaction
+    def count():
+        return get_db_executor().execute(COUNT_USERS)[0][0]
+
+    with bind_executor(executor):
+        with pytest.raises(ValueError):
+            create_and_fail()
+        assert count() == 0
+
+
+def test_read_only_transaction(executor):
+    from vpncon.db import ReadOnlyTransactionError
+    executor.open()
+    executor.configure_transaction(None, read_only=True)
+    with pytest.raises(ReadOnlyTransactionError):
+        executor.execute(INSERT_USER, telegram_id=1, telegram_nick='nick', role='ADMIN')
+    executor.rollback_and_close()
+    # Режим действует только до конца транзакции
+    executor.open()
+    executor.execute(INSERT_USER, telegram_id=1, telegram_nick='nick', role='ADMIN')
+    executor.commit_and_close()
+
+
+def test_read_in_snapshot_runs_in_one_transaction(executor):
+    from vpncon.db import read_in_snapshot
+    with bind_executor(executor):
+        result = read_in_snapshot([lambda: get_db_executor().execute(COUNT_USERS)] * 3, workers=3)
+    assert result == [[(0,)]] * 3
@@ -0,0 +1,18 @@
+from vpncon.db import postgres_db
+
+
+def test_reset_pool_keeps_reference_to_inherited_pool(monkeypatch):
+    pool = object()
+    monkeypatch.setattr(postgres_db, "_pools", {0: pool})
+    monkeypatch.setattr(postgres_db, "_inherited_pools", [])
+
+    postgres_db.reset_pool()
+
+    assert postgres_db._pools == {}
+    # Пул родителя не должен быть собран сборщиком мусора
+    assert postgres_db._inherited_pools == [pool]
+
+
+def test_reset_pool_without_pool():
+    postgres_db.reset_pool()
+    assert postgres_db._pools == {}
@@ -21,7 +21,7 @@ class DummyCursor:
         self.description = ('desc',)
         self.query = None
         self.kwargs = None
-    def execute(self, query, kwargs):
+    def execute(self, query, kwargs=None):
         self.query = query
         self.kwargs = kwargs
     def fetchall(self):
@@ -82,6 +82,20 @@ def test_rollback_and_close(executor, pool):
     assert executor.conn is None
     assert executor.cur is None
 
+def test_rollback_failure_still_returns_connection(executor, pool):
+    from vpncon.db import postgres_db
+    executor.open()
+    conn = executor.conn
+    def broken_rollback():
+        raise RuntimeError("connection lost")
+    conn.rollback = broken_rollback
+    with pytest.raises(RuntimeError):
+        executor.rollback_and_close()
+    assert pool.last_conn is conn
+    assert executor.conn is None
+    assert executor.cur is None
+    assert executor not in postgres_db._active
+
 def test_execute_returns_data(executor):
     executor.open()
     result = executor.execute("SELECT 1")
@@ -97,3 +111,25 @@ def test_open_twice_raises(executor):
     with pytest.raises(RuntimeError):
         executor.open()
     executor.close()
+
+def test_configure_transaction_modes(executor):
+    from vpncon.db import IsolationLevel
+    executor.open()
+    executor.configure_transaction(IsolationLevel.SERIALIZABLE, read_only=True, deferrable=True)
+    assert executor.cur.query == "SET TRANSACTION ISOLATION LEVEL SERIALIZABLE, READ ONLY, DEFERRABLE"
+    executor.close()
+
+def test_import_snapshot(executor):
+    executor.open()
+    executor.import_snapshot("00000003-0000001B-1")
+    assert executor.cur.query == "SET TRANSACTION SNAPSHOT '00000003-0000001B-1'"
+    with pytest.raises(ValueError):
+        executor.import_snapshot("1'; DROP TABLE users; --")
+    executor.close()
+
+def test_read_only_error_is_translated():
+    from vpncon.db import ReadOnlyTransactionError
+    from vpncon.db.postgres_db import _translate_error
+    exc = Exception("cannot execute INSERT in a read-only transaction")
+    exc.sqlstate = "25006"
+    assert isinstance(_translate_error(exc), ReadOnlyTransactionError)
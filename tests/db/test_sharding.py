@@ -0,0 +1,190 @@
+from collections import Counter
+
+import pytest
+from vpncon.db import (
+    CrossShardTransactionError, IsolationLevel, PoolExhaustedError, auto_transaction, bind_executor
+)
+from vpncon.db import admission
+from vpncon.db.admission import AdmissionGate
+from vpncon.db.sharded_db import ShardedExecutor
+from vpncon.db.sharding import jump_hash
+
+
+def test_jump_hash_is_stable():
+    assert [jump_hash(key, 10) for key in range(10)] == [jump_hash(key, 10) for key in range(10)]
+    assert all(jump_hash(key, 1) == 0 for key in range(1000))
+
+
+def test_jump_hash_moves_keys_only_to_new_bucket():
+    for key in range(2000):
+        before, after = jump_hash(key, 4), jump_hash(key, 5)
+        assert after == before or after == 4
+
+
+def test_jump_hash_distribution():
+    counts = Counter(jump_hash(key, 4) for key in range(1_000_000, 1_040_000))
+    assert set(counts) == {0, 1, 2, 3}
+    assert all(9000 < count < 11000 for count in counts.values())
+
+
+def test_jump_hash_handles_negative_keys():
+    assert 0 <= jump_hash(-1, 3) < 3
+
+
+class DummyCursor:
+    def __init__(self, shard, log):
+        self.shard = shard
+        self.log = log
+        self.description = ('desc',)
+    def execute(self, query, kwargs=None):
+        self.log.append((self.shard, query))
+    def fetchall(self):
+        return [(self.shard,)]
+    def close(self):
+        pass
+
+class DummyConn:
+    def __init__(self, shard, log):
+        self.shard = shard
+        self.log = log
+    def cursor(self):
+        return DummyCursor(self.shard, self.log)
+    def commit(self):
+        self.log.append((self.shard, 'commit'))
+    def rollback(self):
+        self.log.append((self.shard, 'rollback'))
+
+class DummyPool:
+    def __init__(self, shard, log):
+        self.shard = shard
+        self.log = log
+    def getconn(self):
+        return DummyConn(self.shard, self.log)
+    def putconn(self, conn):
+        pass
+
+
+@pytest.fixture
+def log():
+    return []
+
+@pytest.fixture(autouse=True)
+def gates(monkeypatch):
+    """Гейты шардов по одному слоту без очереди, свои на каждый тест."""
+    gates = {
+        shard: AdmissionGate(capacity=1, max_waiting=0, reserved_high=0, timeout=0.1)
+        for shard in range(3)
+    }
+    monkeypatch.setattr(admission, "_gates", gates)
+    return gates
+
+@pytest.fixture
+def executor(log):
+    pools = {}
+    def pool_factory(shard):
+        return pools.setdefault(shard, DummyPool(shard, log))
+    return ShardedExecutor(3, pool_factory)
+
+
+def test_connection_is_taken_on_first_route(executor, log):
+    executor.open()
+    assert executor.active is None
+    executor.route_shard(2)
+    executor.route_shard(2)
+    assert executor.execute("SELECT 1") == [(2,)]
+    executor.commit_and_close()
+    assert log == [(2, "SELECT 1"), (2, 'commit')]
+    assert executor.shard is None
+
+
+def test_cross_shard_transaction_raises(executor):
+    executor.open()
+    executor.route_shard(0)
+    with pytest.raises(CrossShardTransactionError):
+        executor.route_shard(1)
+    executor.rollback_and_close()
+
+
+def test_execute_without_route_raises(executor):
+    executor.open()
+    with pytest.raises(RuntimeError):
+        executor.execute("SELECT 1")
+    executor.close()
+
+
+def test_isolation_level_is_applied_on_route(executor, log):
+    executor.open()
+    executor.configure_transaction(IsolationLevel.SERIALIZABLE)
+    executor.route_shard(1)
+    executor.commit_and_close()
+    assert log[0] == (1, "SET TRANSACTION ISOLATION LEVEL SERIALIZABLE")
+
+
+def test_read_only_mode_is_applied_on_route(executor, log):
+    executor.open()
+    executor.configure_transaction(IsolationLevel.REPEATABLE_READ, read_only=True)
+    executor.route_shard(2)
+    executor.commit_and_close()
+    assert log[0] == (2, "SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+
+
+def test_scatter_reads_all_shards(executor, log):
+    executor.open()
+    executor.route_shard(1)
+    result = executor.scatter("SELECT 1")
+    executor.commit_and_close()
+    assert result == [(0,), (1,), (2,)]
+    # Остальные шарды читаются в своих коротких транзакциях
+    assert (0, 'commit') in log and (2, 'commit') in log
+
+
+def test_auto_transaction_routes_by_argument(monkeypatch, executor):
+    routed = []
+    monkeypatch.setattr(executor, "route", routed.append)
+
+    @auto_transaction(shard_by="user.telegram_id")
+    def update(user):
+        return user.telegram_id
+
+    class User:
+        telegram_id = 42
+
+    with bind_executor(executor):
+        assert update(User()) == 42
+    assert routed == [42]
+
+
+def test_auto_transaction_rejects_unknown_shard_argument():
+    with pytest.raises(TypeError):
+        @auto_transaction(shard_by="telegram_id")
+        def func(user_id):
+            pass
+
+
+def test_slot_is_taken_per_shard(executor, gates):
+    other = ShardedExecutor(3, executor.pool_factory)
+    executor.open()
+    executor.route_shard(0)
+    assert [gates[shard].in_use for shard in range(3)] == [1, 0, 0]
+    # Занятый шард не мешает транзакциям других шардов
+    other.open()
+    other.route_shard(1)
+    other.commit_and_close()
+    other.open()
+    with pytest.raises(PoolExhaustedError):
+        other.route_shard(0)
+    other.close()
+    executor.commit_and_close()
+    assert [gates[shard].in_use for shard in range(3)] == [0, 0, 0]
+
+
+def test_scatter_takes_slots_of_other_shards(executor, gates):
+    executor.open()
+    executor.route_shard(1)
+    gates[2].acquire()
+    with pytest.raises(PoolExhaustedError):
+        executor.scatter("SELECT 1")
+    gates[2].release()
+    assert executor.scatter("SELECT 1") == [(0,), (1,), (2,)]
+    executor.commit_and_close()
+    assert [gates[shard].in_use for shard in range(3)] == [0, 0, 0]
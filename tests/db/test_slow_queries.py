@@ -0,0 +1,69 @@
+import threading
+from datetime import datetime, timezone
+
+import pytest
+from vpncon.db import slow_queries
+from vpncon.db.slow_queries import (
+    SlowQuery, SlowQueryLog, is_read_only, params_shape, query_fingerprint
+)
+
+
+def test_fingerprint_ignores_whitespace():
+    assert query_fingerprint("SELECT 1\n  FROM users") == query_fingerprint("SELECT 1 FROM users")
+    assert query_fingerprint("SELECT 1") != query_fingerprint("SELECT 2")
+
+
+def test_params_shape_has_no_values():
+    assert params_shape({'id': 1, 'nick': 'secret', 'ids': [1, 2]}) == {
+        'id': 'int', 'nick': 'str', 'ids': 'list[2]'
+    }
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("SELECT * FROM users", True),
+    ("  with t AS (SELECT 1) SELECT * FROM t", True),
+    ("SELECT * FROM users FOR UPDATE SKIP LOCKED", False),
+    ("WITH d AS (DELETE FROM users RETURNING 1) SELECT * FROM d", False),
+    ("UPDATE users SET role = 'ADMIN'", False),
+])
+def test_is_read_only(query, expected):
+    assert is_read_only(query) is expected
+
+
+@pytest.fixture
+def log(monkeypatch):
+    log = SlowQueryLog(buffer_size=2, sample_rate=1.0, explain_interval=60)
+    done = threading.Semaphore(0)
+
+    def explain(task):
+        return SlowQuery(
+            slow_queries.query_fingerprint(task.query), task.query,
+            params_shape(task.params), task.duration * 1000,
+            datetime.now(timezone.utc), True, [{'Plan': {}}],
+        )
+
+    def append(entry):
+        SlowQueryLog._append(log, entry)
+        done.release()
+
+    monkeypatch.setattr(log, "_explain", explain)
+    monkeypatch.setattr(log, "_append", append)
+    log.wait = lambda: done.acquire(timeout=5)
+    return log
+
+
+def test_report_captures_plan_once_per_interval(log):
+    log.report("SELECT 1", {'id': 1}, 0.7, "dbname=x")
+    assert log.wait()
+    log.report("SELECT 1", {'id': 2}, 0.9, "dbname=x")
+    [entry] = log.entries()
+    assert entry.params_shape == {'id': 'int'}
+    assert entry.duration_ms == pytest.approx(700)
+
+
+def test_ring_buffer_keeps_newest(log):
+    for n in range(3):
+        log.report(f"SELECT {n}", {}, 1.0, "dbname=x")
+        assert log.wait()
+    assert [entry.query for entry in log.entries()] == ["SELECT 2", "SELECT 1"]
+    assert [e.query for e in log.entries(query_fingerprint("SELECT 1"))] == ["SELECT 1"]
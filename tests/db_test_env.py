@@ -1,35 +1,151 @@
+"""Тестовые базы данных.
+
+Миграции применяются один раз к шаблонной базе `vpncon_test_template`.
+Шаблон пересоздаётся, только если изменились файлы миграций: отпечаток миграций
+хранится в комментарии к базе. Каждый воркер pytest-xdist (или единственный процесс pytest)
+получает свою копию шаблона через `CREATE DATABASE ... TEMPLATE`, поэтому тесты
+можно запускать параллельно:
+```sh
+pytest -n auto
+```
+С `TEST_DB_SHARDS=N` воркер клонирует N баз и включает шардирование (`Config.DB_SHARD_URIS`):
+первый шард - база воркера, остальные - `<база воркера>_shard<i>`.
+Изоляция отдельных тестов - фикстура `db_transaction` (см. `conftest.py`),
+которая откатывает всё, что тест записал в БД.
+"""
+import hashlib
 import logging
+import os
+
+import psycopg
+from psycopg import sql
 
 
 logger = logging.getLogger(__name__)
 
 
 TEST_SCHEMA = "vpncon_test"
-DROP_TEST_DB_SQL = f"DROP DATABASE IF EXISTS {TEST_SCHEMA}"
-CREATE_TEST_DB_SQL = f"CREATE DATABASE {TEST_SCHEMA};"
+TEMPLATE_DB = f"{TEST_SCHEMA}_template"
+# Ключ advisory lock, сериализующего сборку шаблона и клонирование между воркерами
+TEMPLATE_LOCK_KEY = 0x7670_6E63
 
 
-def setup_test_db():
-    """Set up a test database environment."""
-    from vpncon.config import Config
+def _db_uri(base_uri: str, dbname: str) -> str:
+    """Заменяет имя базы в URI подключения, сохраняя параметры."""
+    uri, sep, query = base_uri.partition("?")
+    return uri.rsplit("/", 1)[0] + f"/{dbname}" + sep + query
+
+
+def _worker_db_name() -> str:
+    """Имя базы текущего воркера: `vpncon_test_gw0`, ... или `vpncon_test` без xdist."""
+    worker = os.getenv("PYTEST_XDIST_WORKER")
+    return f"{TEST_SCHEMA}_{worker}" if worker else TEST_SCHEMA
+
+
+def _shard_db_names(dbname: str) -> list[str]:
+    """Имена баз шардов воркера согласно `TEST_DB_SHARDS`. Первый шард - сама база воркера."""
+    shards = int(os.getenv("TEST_DB_SHARDS") or 1)
+    return [dbname] + [f"{dbname}_shard{i}" for i in range(1, shards)]
+
+
+def migrations_fingerprint() -> str:
+    """Отпечаток всех файлов миграций."""
+    # Через `vpncon.db` нельзя: пакет отдаёт только `__all__` и ленивые подмодули
+    from vpncon.db.db_migrations import __file__ as db_migrations_file
+
+    migrations_dir = os.path.join(os.path.dirname(db_migrations_file), "migrations")
+    digest = hashlib.sha256()
+    for fname in sorted(os.listdir(migrations_dir)):
+        if fname.startswith("M_") and fname.endswith(".py"):
+            digest.update(fname.encode())
+            with open(os.path.join(migrations_dir, fname), "rb") as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+def _template_fingerprint(conn: psycopg.Connection) -> str | None:
+    row = conn.execute(
+        "SELECT shobj_description(oid, 'pg_database') FROM pg_database WHERE datname = %s",
+        (TEMPLATE_DB,),
+    ).fetchone()
+    return row[0] if row else None
 
+
+def _build_template(conn: psycopg.Connection, base_uri: str, fingerprint: str) -> None:
+    """Пересоздаёт шаблонную базу и применяет к ней все миграции."""
+    from vpncon.config import Config
     from vpncon.db.db_migrations import DbMigrator, PostgresMigrationExecutor
 
-    # Create test database
-    logger.info("Creating test db")
-    PostgresMigrationExecutor.execute([DROP_TEST_DB_SQL], autocommit=True)
-    PostgresMigrationExecutor.execute([CREATE_TEST_DB_SQL], autocommit=True)
+    logger.info("Building test template db %s", TEMPLATE_DB)
+    conn.execute(sql.SQL("DROP DATABASE IF EXISTS {}").format(sql.Identifier(TEMPLATE_DB)))
+    conn.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(TEMPLATE_DB)))
+
+    # Шаблон - одна база, шарды клонируются из него
+    shard_uris, Config.DB_SHARD_URIS = Config.DB_SHARD_URIS, []
+    Config.DB_URI = _db_uri(base_uri, TEMPLATE_DB)
+    try:
+        DbMigrator(PostgresMigrationExecutor).apply_migrations()
+    finally:
+        Config.DB_URI = base_uri
+        Config.DB_SHARD_URIS = shard_uris
 
-    # Change DB_URI to connect to the test database
-    original_db_uri = Config.DB_URI
-    Config.DB_URI = original_db_uri.rsplit("/", 1)[0] + f"/{TEST_SCHEMA}"
+    # Отпечаток ставится последним: недостроенный шаблон будет пересобран
+    conn.execute(
+        sql.SQL("COMMENT ON DATABASE {} IS {}").format(
+            sql.Identifier(TEMPLATE_DB), sql.Literal(fingerprint)
+        )
+    )
 
-    # Apply migrations to the test database
-    logger.info("Applying DB migrations")
-    DbMigrator(PostgresMigrationExecutor).apply_migrations()
 
+def setup_test_db() -> str:
+    """Готовит базу текущего воркера и переключает на неё `Config.DB_URI`.
 
+    Returns:
+        str: Имя базы воркера.
+    """
+    from vpncon.config import Config
     from vpncon.db import validate_connection
 
+    base_uri = Config.DB_URI
+    dbname = _worker_db_name()
+    fingerprint = migrations_fingerprint()
+
+    with psycopg.connect(base_uri, autocommit=True, connect_timeout=20) as conn:
+        conn.execute("SELECT pg_advisory_lock(%s)", (TEMPLATE_LOCK_KEY,))
+        try:
+            if _template_fingerprint(conn) != fingerprint:
+                _build_template(conn, base_uri, fingerprint)
+            else:
+                logger.info("Test template db is up to date")
+
+            for name in _shard_db_names(dbname):
+                logger.info("Cloning %s into %s", TEMPLATE_DB, name)
+                conn.execute(sql.SQL("DROP DATABASE IF EXISTS {}").format(sql.Identifier(name)))
+                conn.execute(
+                    sql.SQL("CREATE DATABASE {} TEMPLATE {}").format(
+                        sql.Identifier(name), sql.Identifier(TEMPLATE_DB)
+                    )
+                )
+        finally:
+            conn.execute("SELECT pg_advisory_unlock(%s)", (TEMPLATE_LOCK_KEY,))
+
+    Config.DB_URI = _db_uri(base_uri, dbname)
+    shard_names = _shard_db_names(dbname)
+    if len(shard_names) > 1:
+        Config.DB_SHARD_URIS = [_db_uri(base_uri, name) for name in shard_names]
     validate_connection()
     logger.debug("Connection validated")
+    return dbname
+
+
+def teardown_test_db(dbname: str, base_uri: str) -> None:
+    """Закрывает пулы и удаляет базы воркера. Шаблон остаётся для следующих запусков."""
+    from vpncon.config import Config
+    from vpncon.db import close_pool
+
+    close_pool()
+    Config.DB_URI = base_uri
+    Config.DB_SHARD_URIS = []
+    with psycopg.connect(base_uri, autocommit=True, connect_timeout=20) as conn:
+        for name in _shard_db_names(dbname):
+            conn.execute(sql.SQL("DROP DATABASE IF EXISTS {}").format(sql.Identifier(name)))
@@ -0,0 +1,45 @@
+"""Заглушки для тестов без БД."""
+from vpncon.db import DBExecutor
+
+
+class FakeExecutor(DBExecutor):
+    """Экзекьютер без БД. Отвечает заготовленными строками `answers` на запросы
+    и запоминает транзакции, их режимы и выполненные запросы
+    """
+    def __init__(self, answers=None):
+        self.answers = answers or {}
+        self.queries = []
+        self.configured = []
+        self.is_open = False
+        self.opened = 0
+        self.committed = 0
+        self.rolled_back = 0
+        self.shard = None
+
+    def open(self):
+        if self.is_open:
+            raise RuntimeError("already open")
+        self.is_open = True
+        self.opened += 1
+        self.shard = None
+
+    def close(self):
+        self.is_open = False
+
+    def commit_and_close(self):
+        self.committed += 1
+        self.is_open = False
+
+    def rollback_and_close(self):
+        self.rolled_back += 1
+        self.is_open = False
+
+    def configure_transaction(self, isolation_level, read_only=False, deferrable=False):
+        self.configured.append((isolation_level, read_only, deferrable))
+
+    def route_shard(self, shard):
+        self.shard = shard
+
+    def execute(self, query, **kwargs):
+        self.queries.append((query, kwargs))
+        return list(self.answers.get(query, []))
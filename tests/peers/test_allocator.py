@@ -0,0 +1,140 @@
+import pytest
+from ipaddress import ip_network
+from tests.fakes import FakeExecutor
+from vpncon.db import auto_transaction, bind_executor
+from vpncon.peers.allocator import (
+    AddressAllocator, build_chunk_bitmap, find_free_bit, reserved_offsets
+)
+from vpncon.peers.model import AddressPool
+
+
+def test_find_free_bit_lsb_first():
+    # Биты нумеруются как в postgres get_bit/set_bit: байт i // 8, бит i % 8 с младшего
+    assert find_free_bit(bytes([0b00000000, 0])) == 0
+    assert find_free_bit(bytes([0b00000111, 0])) == 3
+    assert find_free_bit(bytes([0xFF, 0b11111101])) == 9
+
+
+def test_find_free_bit_full_chunk():
+    assert find_free_bit(bytes([0xFF] * 128)) is None
+
+
+def test_reserved_offsets_ipv4():
+    assert reserved_offsets(ip_network("10.8.0.0/24")) == {0, 1, 255}
+
+
+def test_reserved_offsets_ipv6():
+    assert reserved_offsets(ip_network("fd00::/64")) == {0, 1}
+
+
+def test_build_first_chunk_marks_reserved():
+    reserved = reserved_offsets(ip_network("10.8.0.0/16"))
+    bitmap, free_count = build_chunk_bitmap(0, 1024, 65536, reserved)
+    assert len(bitmap) == 128
+    assert free_count == 1022
+    assert find_free_bit(bitmap) == 2
+
+
+def test_build_chunk_smaller_than_pool_tail():
+    # /24 меньше куска: всё за пределами подсети помечено занятым
+    reserved = reserved_offsets(ip_network("10.8.0.0/24"))
+    bitmap, free_count = build_chunk_bitmap(0, 1024, 256, reserved)
+    assert free_count == 253
+
+
+def test_build_last_chunk_marks_broadcast():
+    reserved = reserved_offsets(ip_network("10.8.0.0/16"))
+    bitmap, free_count = build_chunk_bitmap(63, 1024, 65536, reserved)
+    assert free_count == 1023
+    assert bitmap[-1] == 0b10000000
+
+
+def test_allocator_rejects_huge_subnet():
+    with pytest.raises(ValueError):
+        AddressAllocator("fd00::/48")
+    # Смещения /64 не влезают в BIGINT
+    with pytest.raises(ValueError):
+        AddressAllocator("fd00::/64")
+    assert AddressAllocator("fd00::/65").network.prefixlen == 65
+
+
+def test_allocator_total_chunks():
+    assert AddressAllocator("10.8.0.0/16").total_chunks == 64
+    assert AddressAllocator("10.8.0.0/30").total_chunks == 1
+
+
+class PoolsExecutor(FakeExecutor):
+    """Экзекьютер без БД с таблицей `address_pools`, изменения которой откатываются."""
+    def __init__(self):
+        super().__init__()
+        self.pools = {}
+        self.pending = {}
+        self.next_id = 1
+    def open(self):
+        super().open()
+        self.pending = dict(self.pools)
+    def commit_and_close(self):
+        super().commit_and_close()
+        self.pools = self.pending
+    def rollback_and_close(self):
+        super().rollback_and_close()
+        self.pending = {}
+    def execute(self, query, **kwargs):
+        if "INSERT INTO address_pools" in query:
+            if kwargs['cidr'] not in self.pending:
+                self.pending[kwargs['cidr']] = (self.next_id, kwargs['cidr'], kwargs['chunk_size'])
+                self.next_id += 1
+            return []
+        row = self.pending.get(kwargs['cidr'])
+        return [row] if row else []
+
+
+def test_pool_created_in_rolled_back_transaction_is_not_reused():
+    allocator = AddressAllocator("10.8.0.0/24")
+    executor = PoolsExecutor()
+
+    @auto_transaction
+    def create_and_fail():
+        allocator.get_pool()
+        raise RuntimeError("duplicate peer")
+
+    with bind_executor(executor):
+        with pytest.raises(RuntimeError):
+            create_and_fail()
+        # Пул создаётся заново, а не берётся из отменённой транзакции
+        pool = allocator.get_pool()
+    assert pool.pool_id == 2
+    assert executor.pools == {"10.8.0.0/24": (2, "10.8.0.0/24", 1024)}
+
+
+class ChunksExecutor(FakeExecutor):
+    """Экзекьютер без БД с кусками пула, блокирующий их как `_lock_free_chunks`."""
+    def __init__(self, chunks):
+        super().__init__()
+        self.chunks = chunks
+        self.locks = []
+    def execute(self, query, **kwargs):
+        super().execute(query, **kwargs)
+        if "FROM address_pool_chunks" in query:
+            free = [
+                (chunk_no, bitmap) for chunk_no, bitmap in sorted(self.chunks.items())
+                if chunk_no > kwargs['after'] and find_free_bit(bitmap) is not None
+            ][:kwargs['limit']]
+            self.locks.append(len(free))
+            return free
+        if "FROM address_pools" in query:
+            raise AssertionError("new chunks must not be reserved")
+        return []
+
+
+def test_allocate_many_from_fragmented_pool(monkeypatch):
+    allocator = AddressAllocator("10.8.0.0/16", chunk_size=64)
+    monkeypatch.setattr(allocator, "get_pool", lambda shard=0: AddressPool(1, "10.8.0.0/16", 64))
+    # В каждом из 20 кусков свободны только последние 4 адреса
+    chunks = {chunk_no: bytes([0xFF] * 7 + [0x0F]) for chunk_no in range(20)}
+    executor = ChunksExecutor(chunks)
+    with bind_executor(executor):
+        addresses = allocator.allocate_many(50)
+    assert len(set(addresses)) == 50
+    # 13 кусков порциями 2, 4, 8
+    assert executor.locks == [2, 4, 8]
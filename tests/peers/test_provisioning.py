@@ -0,0 +1,97 @@
+import base64
+from types import SimpleNamespace
+
+import pytest
+from tests.fakes import FakeExecutor
+from vpncon.config import Config
+from vpncon.db import bind_executor
+from vpncon.exceptions import EntityNotExistsException
+from vpncon.peers import provisioning
+from vpncon.peers.allocator import take_free_bits
+from vpncon.peers.keys import generate_keypair, generate_keypairs
+from vpncon.peers.model import Peer
+from vpncon.peers.render import render_client_config
+
+
+def test_generate_keypair():
+    private, public = generate_keypair()
+    assert len(base64.b64decode(private)) == 32
+    assert len(base64.b64decode(public)) == 32
+
+
+def test_generate_keypairs_in_process_pool(monkeypatch):
+    monkeypatch.setattr(Config, 'KEYGEN_CHUNK_SIZE', 3)
+    monkeypatch.setattr(Config, 'KEYGEN_PROCESSES', 2)
+    keypairs = generate_keypairs(7)
+    assert len(keypairs) == 7
+    assert len({public for _, public in keypairs}) == 7
+
+
+def test_take_free_bits():
+    bitmap, bits = take_free_bits(bytes([0b00000101, 0]), 3)
+    assert bits == [1, 3, 4]
+    assert bitmap == bytes([0b00011111, 0])
+
+
+def test_render_client_config():
+    peer = Peer('pub', 1, '10.8.0.2', 'fd00::2')
+    config = render_client_config(peer, 'priv')
+    assert 'PrivateKey = priv' in config
+    assert 'Address = 10.8.0.2/32, fd00::2/128' in config
+
+
+@pytest.fixture
+def sharded_provisioning(monkeypatch):
+    """Сервис выдачи на двух шардах (чётные и нечётные telegram_id) без адресов и БД."""
+    calls = []
+    monkeypatch.setattr(provisioning, "shard_for", lambda telegram_id: telegram_id % 2)
+    monkeypatch.setattr(
+        provisioning, "generate_keypairs",
+        lambda count: [(f"priv{i}", f"pub{i}") for i in range(count)]
+    )
+    executor = FakeExecutor()
+    monkeypatch.setattr(
+        provisioning, "get_missing_user_ids",
+        lambda ids: [telegram_id for telegram_id in ids if telegram_id > 100]
+    )
+    monkeypatch.setattr(
+        provisioning, "create_peers",
+        lambda peers: calls.append(('create', executor.shard, [p.telegram_id for p in peers]))
+    )
+    monkeypatch.setattr(
+        provisioning, "delete_peers",
+        lambda keys: calls.append(('delete', executor.shard, keys))
+    )
+    service = provisioning.ProvisioningServiceCRUD(
+        SimpleNamespace(allocator_v4=None, allocator_v6=None)
+    )
+    with bind_executor(executor):
+        yield service, calls
+
+
+def test_provision_checks_users_on_every_shard_before_writing(sharded_provisioning):
+    service, calls = sharded_provisioning
+    with pytest.raises(EntityNotExistsException):
+        service.provision_users([2, 4, 101])
+    assert calls == []
+
+
+def test_provision_deletes_peers_of_stored_shards_on_failure(sharded_provisioning, monkeypatch):
+    service, calls = sharded_provisioning
+    create = provisioning.create_peers
+    def create_or_fail(peers):
+        if peers[0].telegram_id % 2:
+            raise RuntimeError("address pool exhausted")
+        create(peers)
+    monkeypatch.setattr(provisioning, "create_peers", create_or_fail)
+    with pytest.raises(RuntimeError):
+        service.provision_users([2, 1, 4])
+    assert calls == [('create', 0, [2, 4]), ('delete', 0, ['pub0', 'pub2'])]
+
+
+def test_provision_users_across_shards(sharded_provisioning):
+    service, calls = sharded_provisioning
+    provisioned = service.provision_users([2, 1, 4])
+    assert [p.peer.telegram_id for p in provisioned] == [2, 1, 4]
+    assert [p.private_key for p in provisioned] == ['priv0', 'priv1', 'priv2']
+    assert calls == [('create', 0, [2, 4]), ('create', 1, [1])]
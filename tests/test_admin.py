@@ -0,0 +1,35 @@
+import pytest
+from flask import Flask
+
+from vpncon.admin import admin_bp
+from vpncon.config import Config
+
+
+@pytest.fixture
+def client():
+    app = Flask(__name__)
+    app.register_blueprint(admin_bp)
+    return app.test_client()
+
+
+def test_admin_disabled_without_token(client, monkeypatch):
+    monkeypatch.setattr(Config, "ADMIN_TOKEN", "")
+    assert client.get('/admin/slow-queries').status_code == 404
+
+
+def test_admin_requires_token(client, monkeypatch):
+    monkeypatch.setattr(Config, "ADMIN_TOKEN", "secret")
+    assert client.get('/admin/slow-queries').status_code == 401
+    headers = {'Authorization': 'Bearer wrong'}
+    assert client.get('/admin/slow-queries', headers=headers).status_code == 401
+    headers = {'Authorization': 'Bearer secret'}
+    response = client.get('/admin/slow-queries', headers=headers)
+    assert response.status_code == 200
+    assert 'slow_queries' in response.json
+
+
+def test_admin_metrics(client, monkeypatch):
+    monkeypatch.setattr(Config, "ADMIN_TOKEN", "secret")
+    response = client.get('/admin/metrics', headers={'Authorization': 'Bearer secret'})
+    assert response.status_code == 200
+    assert set(response.json) == {'counters', 'summaries'}
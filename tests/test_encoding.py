@@ -0,0 +1,67 @@
+import json
+from datetime import datetime, timezone
+
+import pytest
+from flask import Flask
+
+from vpncon import encoding
+from vpncon.users.model import User, Role
+
+
+USERS = [
+    User(1, 'first', Role.ADMIN),
+    User(2, 'второй', Role.ACTIVATED_USER, datetime(2026, 1, 1, tzinfo=timezone.utc)),
+    User(3, 'third', Role.DEACTIVATED_USER),
+]
+
+
+@pytest.fixture(params=["orjson", "json"])
+def json_backend(request, monkeypatch):
+    if request.param == "json":
+        monkeypatch.setattr(encoding, "orjson", None)
+    elif encoding.orjson is None:
+        pytest.skip("orjson is not installed")
+
+
+def test_dumps_json_user(json_backend):
+    data = json.loads(encoding.dumps_json(USERS[1]))
+    assert data == {
+        'telegram_id': 2,
+        'telegram_nick': 'второй',
+        'role': 'ACTIVATED_USER',
+        'expires_at': '2026-01-01T00:00:00+00:00',
+    }
+
+
+@pytest.mark.parametrize("batch_size", [1, 2, 500])
+def test_json_page_is_valid_in_batches(json_backend, batch_size):
+    body = b''.join(encoding.iter_page(
+        encoding.JSON_MIMETYPE, 'users', USERS, batch_size, next_after=3
+    ))
+    data = json.loads(body)
+    assert [u['telegram_id'] for u in data['users']] == [1, 2, 3]
+    assert data['next_after'] == 3
+
+
+def test_json_empty_page(json_backend):
+    body = b''.join(encoding.iter_page(encoding.JSON_MIMETYPE, 'users', [], next_after=None))
+    assert json.loads(body) == {'users': [], 'next_after': None}
+
+
+def test_msgpack_page():
+    if encoding.msgpack is None:
+        pytest.skip("msgpack is not installed")
+    body = b''.join(encoding.iter_page(
+        encoding.MSGPACK_MIMETYPE, 'users', USERS, 2, next_after=None
+    ))
+    data = encoding.msgpack.unpackb(body)
+    assert [u['role'] for u in data['users']] == ['ADMIN', 'ACTIVATED_USER', 'DEACTIVATED_USER']
+    assert data['next_after'] is None
+
+
+def test_negotiation_defaults_to_json():
+    app = Flask(__name__)
+    with app.test_request_context(headers={'Accept': 'text/html'}):
+        assert encoding.negotiate_mimetype() == encoding.JSON_MIMETYPE
+    with app.test_request_context(headers={'Accept': encoding.MSGPACK_MIMETYPE}):
+        assert encoding.negotiate_mimetype() == encoding.available_mimetypes()[-1]
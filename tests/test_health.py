@@ -0,0 +1,91 @@
+import pytest
+from flask import Flask, jsonify
+
+from vpncon import bootstrap, health
+from vpncon.bootstrap import DbBootstrap, reject_until_ready
+from vpncon.config import Config
+
+
+class FlakyBootstrap(DbBootstrap):
+    """Инициализация, которая удаётся с третьей попытки."""
+    def bootstrap_once(self):
+        if self.attempts < 3:
+            raise ConnectionError("db is down")
+
+
+@pytest.fixture
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(Config, "BOOTSTRAP_BACKOFF_BASE", 0.001)
+    monkeypatch.setattr(Config, "BOOTSTRAP_BACKOFF_MAX", 0.002)
+
+
+@pytest.fixture
+def postgres_backend(monkeypatch):
+    """`/readyz` с памятью вместо postgres не проверяет пул и схему"""
+    monkeypatch.setattr(Config, "DB_BACKEND", "postgres")
+
+
+@pytest.fixture
+def client(monkeypatch):
+    app = Flask(__name__)
+    app.before_request(reject_until_ready)
+    app.register_blueprint(health.health_bp)
+
+    @app.route('/users/')
+    def users():
+        return jsonify([])
+
+    return app.test_client()
+
+
+def test_bootstrap_retries_until_ready(fast_backoff):
+    boot = FlakyBootstrap(migrate=False)
+    boot.start()
+    assert boot.ready.wait(5)
+    boot.stop()
+    assert boot.attempts == 3
+    assert boot.status() == {'state': 'ready', 'attempts': 3, 'error': None}
+
+
+def test_not_ready_rejects_traffic(client, monkeypatch):
+    boot = DbBootstrap(migrate=False)
+    boot.last_error = "ConnectionError: db is down"
+    monkeypatch.setattr(bootstrap, "_bootstrap", boot)
+
+    assert client.get('/healthz').status_code == 200
+    response = client.get('/readyz')
+    assert response.status_code == 503
+    assert response.json['error'] == "ConnectionError: db is down"
+    response = client.get('/users/')
+    assert response.status_code == 503
+    assert response.headers['Retry-After']
+
+    boot.ready.set()
+    assert client.get('/users/').status_code == 200
+
+
+def test_readyz_checks_schema_version(client, monkeypatch, postgres_backend):
+    monkeypatch.setattr(bootstrap, "_bootstrap", None)
+    monkeypatch.setattr(health, "_cached", None)
+    monkeypatch.setattr(health, "_current_schema_version", lambda: 3)
+    monkeypatch.setattr(health, "_expected_schema_version", lambda: 4)
+    response = client.get('/readyz')
+    assert response.status_code == 503
+    assert response.json['schema_version'] == 3
+
+    monkeypatch.setattr(health, "_cached", None)
+    monkeypatch.setattr(health, "_expected_schema_version", lambda: 3)
+    assert client.get('/readyz').status_code == 200
+
+
+def test_readyz_pool_down(client, monkeypatch, postgres_backend):
+    def fail():
+        raise ConnectionError("no connection")
+
+    monkeypatch.setattr(bootstrap, "_bootstrap", None)
+    monkeypatch.setattr(health, "_cached", None)
+    monkeypatch.setattr(health, "_current_schema_version", fail)
+    monkeypatch.setattr(health, "_expected_schema_version", lambda: 3)
+    response = client.get('/readyz')
+    assert response.status_code == 503
+    assert response.json['pool'] is False
@@ -0,0 +1,76 @@
+import pytest
+from flask import Flask, jsonify, request
+
+from vpncon.config import Config
+from vpncon.db import auto_transaction, bind_executor
+from vpncon.db.memory_db import MemoryDatabase, MemoryExecutor
+from vpncon.idempotency import idempotent
+
+
+@pytest.fixture
+def calls():
+    return []
+
+
+@pytest.fixture
+def client(calls):
+    app = Flask(__name__)
+
+    @app.route('/users/', methods=['POST'])
+    @auto_transaction
+    @idempotent(shard_by="telegram_id")
+    def create():
+        calls.append(request.json)
+        if request.json.get('fail'):
+            raise RuntimeError("failed")
+        return jsonify({'status': 'created', 'n': len(calls)}), 201
+
+    with bind_executor(MemoryExecutor(MemoryDatabase())):
+        yield app.test_client()
+
+
+def post(client, body, key='key-1'):
+    headers = {'Idempotency-Key': key} if key else {}
+    return client.post('/users/', json=body, headers=headers)
+
+
+def test_without_key_runs_every_time(client, calls):
+    post(client, {'telegram_id': 1}, key=None)
+    post(client, {'telegram_id': 1}, key=None)
+    assert len(calls) == 2
+
+
+def test_repeat_is_replayed(client, calls):
+    first = post(client, {'telegram_id': 1})
+    second = post(client, {'telegram_id': 1})
+    assert len(calls) == 1
+    assert second.status_code == first.status_code == 201
+    assert second.json == first.json == {'status': 'created', 'n': 1}
+    assert second.headers['Idempotent-Replayed'] == 'true'
+    assert 'Idempotent-Replayed' not in first.headers
+
+
+def test_key_reused_with_other_request(client, calls):
+    post(client, {'telegram_id': 1})
+    assert post(client, {'telegram_id': 2}).status_code == 422
+    assert len(calls) == 1
+
+
+def test_failed_attempt_is_not_stored(client, calls):
+    assert post(client, {'telegram_id': 1, 'fail': True}).status_code == 500
+    # Ключ откатился вместе с транзакцией: запрос с тем же ключом выполняется заново
+    assert post(client, {'telegram_id': 1}).status_code == 201
+    assert len(calls) == 2
+
+
+def test_expired_key_is_reused(client, calls, monkeypatch):
+    monkeypatch.setattr(Config, "IDEMPOTENCY_TTL", -1)
+    post(client, {'telegram_id': 1})
+    response = post(client, {'telegram_id': 2})
+    assert response.status_code == 201
+    assert len(calls) == 2
+
+
+def test_invalid_key(client, calls):
+    assert post(client, {'telegram_id': 1}, key='x' * 256).status_code == 400
+    assert calls == []
@@ -0,0 +1,137 @@
+import pytest
+from flask import Flask, jsonify
+
+from vpncon import ratelimit
+from vpncon.config import Config
+from tests.fakes import FakeExecutor
+from vpncon.db import PoolExhaustedError, auto_transaction, bind_executor
+from vpncon.ratelimit import (
+    LocalRateLimiter, PostgresRateLimiter, RateLimit, TokenBucket, parse_rate_limits,
+    rate_limit_request,
+)
+
+
+def test_parse_rate_limits():
+    limits = parse_rate_limits("default=10:20, users_api.api_get_user=5")
+    assert limits["default"] == RateLimit(10, 20)
+    assert limits["users_api.api_get_user"] == RateLimit(5, 5)
+
+
+def test_parse_invalid_rate_limit():
+    with pytest.raises(ValueError):
+        RateLimit.parse("0:10")
+
+
+def test_token_bucket_burst_and_refill():
+    limit = RateLimit(rate=2, burst=2)
+    bucket = TokenBucket(limit.burst, now=0)
+    assert bucket.consume(limit, now=0) == 0
+    assert bucket.consume(limit, now=0) == 0
+    assert bucket.consume(limit, now=0) == pytest.approx(0.5)
+    # Через полсекунды накопился один токен
+    assert bucket.consume(limit, now=0.5) == 0
+
+
+def test_local_rate_limiter_keys_are_independent():
+    limiter = LocalRateLimiter(max_keys=10)
+    limit = RateLimit(rate=1, burst=1)
+    assert limiter.consume(["a"], limit) == 0
+    assert limiter.consume(["a"], limit) > 0
+    assert limiter.consume(["b"], limit) == 0
+
+
+def test_local_rate_limiter_takes_tokens_only_if_all_buckets_allow():
+    limiter = LocalRateLimiter(max_keys=10)
+    limit = RateLimit(rate=0.5, burst=1)
+    assert limiter.consume(["user"], limit) == 0
+    # Бакет пользователя пуст: токен клиента не списывается
+    assert limiter.consume(["client", "user"], limit) > 0
+    assert limiter._buckets["client"].tokens == pytest.approx(1)
+    assert limiter.consume(["client"], limit) == 0
+
+
+def test_local_rate_limiter_evicts_old_keys():
+    limiter = LocalRateLimiter(max_keys=2)
+    limit = RateLimit(rate=1, burst=1)
+    for key in ("a", "b", "c"):
+        limiter.consume([key], limit)
+    assert "a" not in limiter._buckets
+
+
+@pytest.fixture
+def executor():
+    return FakeExecutor()
+
+
+@pytest.fixture
+def client(monkeypatch, executor):
+    monkeypatch.setattr(ratelimit, "_limiter", LocalRateLimiter(max_keys=10))
+    monkeypatch.setattr(ratelimit, "_limits", {"default": RateLimit(rate=0.5, burst=1)})
+    app = Flask(__name__)
+    app.before_request(rate_limit_request)
+
+    @app.route('/ping')
+    @auto_transaction
+    def ping():
+        return jsonify({'status': 'ok'})
+
+    with bind_executor(executor):
+        yield app.test_client()
+
+
+def test_rejected_request_does_not_touch_db(client, executor):
+    assert client.get('/ping').status_code == 200
+    assert executor.opened == 1
+    response = client.get('/ping')
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '2'
+    assert executor.opened == 1
+
+
+def test_client_header_is_ignored_by_default(client):
+    assert client.get('/ping', headers={'X-Client-Id': 'a'}).status_code == 200
+    assert client.get('/ping', headers={'X-Client-Id': 'b'}).status_code == 429
+
+
+def test_trusted_client_header(client, monkeypatch):
+    monkeypatch.setattr(Config, "RATE_LIMIT_CLIENT_HEADER", "X-Client-Id")
+    assert client.get('/ping', headers={'X-Client-Id': 'a'}).status_code == 200
+    assert client.get('/ping', headers={'X-Client-Id': 'b'}).status_code == 200
+    assert client.get('/ping', headers={'X-Client-Id': 'a'}).status_code == 429
+
+
+def test_postgres_limiter_allows_when_pool_exhausted(monkeypatch):
+    def exhausted(key, limit):
+        raise PoolExhaustedError("no slots")
+    monkeypatch.setattr(ratelimit, "_consume_shared", exhausted)
+    assert PostgresRateLimiter(ttl=1).consume(["key"], RateLimit(rate=1, burst=1)) == 0
+
+
+def test_postgres_limiter_purges_stale_buckets_on_interval(monkeypatch):
+    purges = []
+    results = iter([1, 2, 1])
+    monkeypatch.setattr(ratelimit, "_consume_shared", lambda keys, limit: 0.0)
+    monkeypatch.setattr(
+        ratelimit, "_purge_stale", lambda ttl, batch_size: purges.append(ttl) or next(results)
+    )
+    monkeypatch.setattr(Config, "RATE_LIMIT_PURGE_INTERVAL", 3600)
+    monkeypatch.setattr(Config, "RATE_LIMIT_PURGE_BATCH_SIZE", 2)
+    limiter = PostgresRateLimiter(ttl=40)
+    limit = RateLimit(rate=1, burst=1)
+    for _ in range(4):
+        limiter.consume(["key"], limit)
+    # Первая пачка неполная, следующая очистка - через интервал
+    assert purges == [40]
+
+    limiter._next_purge = 0
+    for _ in range(4):
+        limiter.consume(["key"], limit)
+    # Полная пачка: остаток удаляет следующий запрос
+    assert purges == [40, 40, 40]
+
+
+def test_shared_bucket_ttl_is_longest_refill(monkeypatch):
+    monkeypatch.setattr(ratelimit, "_limits", None)
+    monkeypatch.setattr(Config, "RATE_LIMIT_BACKEND", "postgres")
+    monkeypatch.setattr(Config, "RATE_LIMITS", "default=10:20,slow=0.5:10")
+    assert ratelimit.get_rate_limiter().ttl == 20
@@ -0,0 +1,98 @@
+import io
+import time
+
+import pytest
+from flask import Flask, jsonify, request
+
+from vpncon import metrics
+from vpncon.replay import (
+    AppTarget, RecordedRequest, Replayer, RequestRecorder, diff_metrics, load_requests, percentile,
+)
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+
+    @app.route('/users/', methods=['POST'])
+    def create():
+        metrics.observe("db.pool.wait_seconds", 0.01)
+        if request.json.get('fail'):
+            return jsonify({'error': 'failed'}), 500
+        return jsonify({'status': 'created'}), 201
+
+    @app.route('/users/<int:telegram_id>', methods=['GET'])
+    def get(telegram_id):
+        return jsonify({'telegram_id': telegram_id})
+
+    return app
+
+
+def test_recorded_requests_round_trip(app):
+    stream = io.StringIO()
+    app.before_request(RequestRecorder(stream))
+    client = app.test_client()
+    client.post('/users/', json={'telegram_id': 1}, headers={'Authorization': 'Bearer secret'})
+    client.get('/users/1?x=1')
+
+    recorded = list(load_requests(stream.getvalue().splitlines()))
+    assert [(r.method, r.path) for r in recorded] == [('POST', '/users/'), ('GET', '/users/1?x=1')]
+    assert recorded[0].headers == {'Content-Type': 'application/json'}
+    assert recorded[0].body == '{"telegram_id": 1}'
+    assert recorded[1].body is None
+
+
+def test_invalid_line_is_reported():
+    with pytest.raises(ValueError, match="Line 2"):
+        list(load_requests(['{"method": "GET", "path": "/users/1"}', '{"request_id": "x"}']))
+
+
+def test_replay_report(app):
+    recorded = [
+        RecordedRequest(0.0, 'POST', '/users/', {'Content-Type': 'application/json'}, '{"telegram_id": 1}'),
+        RecordedRequest(0.0, 'POST', '/users/', {'Content-Type': 'application/json'}, '{"fail": true}'),
+        RecordedRequest(0.0, 'GET', '/users/1'),
+        RecordedRequest(0.0, 'GET', '/missing'),
+    ]
+    report = Replayer(AppTarget(app), concurrency=2, speed=0).run(recorded)
+    assert report.requests == 4
+    assert report.statuses == {'200': 1, '201': 1, '404': 1, '500': 1}
+    assert report.errors == 1
+    assert report.as_dict()['error_rate'] == 0.25
+    assert report.metrics['summaries']['db.pool.wait_seconds']['count'] == 2
+
+
+def test_replay_keeps_compressed_intervals(app):
+    recorded = [RecordedRequest(t, 'GET', '/users/1') for t in (100.0, 100.5, 101.0)]
+    started = time.perf_counter()
+    Replayer(AppTarget(app), speed=10).run(recorded)
+    assert time.perf_counter() - started >= 0.1
+
+
+def test_replay_rate_limit(app):
+    recorded = [RecordedRequest(0.0, 'GET', '/users/1')] * 5
+    report = Replayer(AppTarget(app), concurrency=4, speed=0, rate=50).run(recorded)
+    assert report.duration >= 4 / 50
+
+
+def test_diff_metrics():
+    before = {
+        "counters": {"db.pool.timeout": 1, "db.admission.rejected": 2},
+        "summaries": {"db.pool.wait_seconds": {"count": 2, "sum": 1.0, "avg": 0.5, "max": 0.9}},
+    }
+    after = {
+        "counters": {"db.pool.timeout": 4, "db.admission.rejected": 2},
+        "summaries": {"db.pool.wait_seconds": {"count": 4, "sum": 1.5, "avg": 0.375, "max": 0.9}},
+    }
+    assert diff_metrics(before, after) == {
+        "counters": {"db.pool.timeout": 3},
+        "summaries": {"db.pool.wait_seconds": {"count": 2, "sum": 0.5, "avg": 0.25, "max": 0.9}},
+    }
+
+
+def test_percentile():
+    values = [float(n) for n in range(1, 101)]
+    assert percentile(values, 50) == 50.0
+    assert percentile(values, 99) == 99.0
+    assert percentile(values, 100) == 100.0
+    assert percentile([], 50) == 0.0
@@ -0,0 +1,92 @@
+import threading
+
+import pytest
+from flask import Flask, jsonify
+
+from vpncon import health, shutdown
+from vpncon.config import Config
+from vpncon.db import admission
+from vpncon.db import postgres_db
+from vpncon.db.admission import AdmissionGate
+from vpncon.shutdown import ShutdownCoordinator, reject_when_draining
+
+
+@pytest.fixture
+def coordinator(monkeypatch):
+    coordinator = ShutdownCoordinator()
+    monkeypatch.setattr(shutdown, "_coordinator", coordinator)
+    monkeypatch.setattr(postgres_db, "close_pool", lambda: None)
+    return coordinator
+
+
+@pytest.fixture
+def gate(monkeypatch):
+    gate = AdmissionGate(capacity=2, max_waiting=2, reserved_high=0, timeout=1)
+    monkeypatch.setattr(admission, "_gates", {0: gate})
+    return gate
+
+
+@pytest.fixture
+def client(coordinator):
+    app = Flask(__name__)
+    app.before_request(reject_when_draining)
+    app.register_blueprint(health.health_bp)
+
+    @app.route('/users/')
+    def users():
+        return jsonify([])
+
+    return app.test_client()
+
+
+def test_draining_rejects_traffic(client, coordinator):
+    assert client.get('/users/').status_code == 200
+
+    coordinator.begin_drain()
+    response = client.get('/users/')
+    assert response.status_code == 503
+    assert response.headers['Retry-After']
+    assert response.headers['Connection'] == 'close'
+
+    assert client.get('/healthz').status_code == 200
+    response = client.get('/readyz')
+    assert response.status_code == 503
+    assert response.json == {'ready': False, 'state': 'draining'}
+
+
+def test_hooks_run_in_reverse_order_once(coordinator, gate):
+    calls = []
+    coordinator.register("first", lambda timeout: calls.append("first"))
+    coordinator.register("second", lambda timeout: calls.append("second"))
+    coordinator.register("broken", lambda timeout: 1 / 0)
+
+    assert coordinator.shutdown(timeout=1)
+    assert coordinator.shutdown(timeout=1)
+    assert calls == ["second", "first"]
+    assert coordinator.draining.is_set()
+
+
+def test_wait_idle(gate):
+    gate.acquire()
+    assert not gate.wait_idle(0.01)
+    threading.Timer(0.05, gate.release).start()
+    assert gate.wait_idle(5)
+
+
+def test_shutdown_waits_for_transaction(coordinator, gate):
+    gate.acquire()
+    threading.Timer(0.05, gate.release).start()
+    assert coordinator.shutdown(timeout=5)
+
+
+def test_shutdown_cancels_stuck_transactions(coordinator, gate, monkeypatch):
+    cancelled, closed = [], []
+    monkeypatch.setattr(Config, "SHUTDOWN_CANCEL_GRACE", 0.01)
+    monkeypatch.setattr(postgres_db, "cancel_active", lambda: cancelled.append(1) or 1)
+    monkeypatch.setattr(postgres_db, "close_active", lambda: closed.append(1) or 1)
+
+    gate.acquire()
+    assert not coordinator.shutdown(timeout=0.05)
+    assert cancelled == [1]
+    assert closed == [1]
+    gate.release()
@@ -0,0 +1,46 @@
+import sys
+
+from vpncon.app import create_app
+from vpncon.config import Config
+from vpncon.startup import StartupProfile
+
+
+class MinimalConfig(Config):
+    APP_SWAGGER_UI = False
+    APP_VALIDATE_REQUESTS = False
+
+
+def test_phases_accumulate():
+    profile = StartupProfile()
+    with profile.phase("a"):
+        pass
+    with profile.phase("a"):
+        pass
+    assert list(profile.phases) == ["a"]
+    assert "phase  a" in profile.report()
+
+
+def test_track_imports(tmp_path, monkeypatch):
+    (tmp_path / "vpncon_startup_probe.py").write_text("import time\ntime.sleep(0.01)\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    profile = StartupProfile()
+    with profile.track_imports():
+        import vpncon_startup_probe  # noqa: F401
+    sys.modules.pop("vpncon_startup_probe")
+    assert [name for name, _ in profile.heavy_imports()] == ["vpncon_startup_probe"]
+
+
+def test_optional_parts_are_disabled():
+    profile = StartupProfile()
+    app = create_app(MinimalConfig, profile=profile)
+    assert app.extensions["startup_profile"] is profile
+    assert "swagger_ui" not in profile.phases
+    assert "request_validation" not in profile.phases
+    assert not any(rule.rule.startswith('/api/doc') for rule in app.url_map.iter_rules())
+
+
+def test_optional_parts_are_enabled():
+    app = create_app()
+    profile = app.extensions["startup_profile"]
+    assert {"blueprints", "request_validation", "swagger_ui"} <= set(profile.phases)
+    assert "init_db" not in profile.phases
@@ -0,0 +1,87 @@
+import pytest
+import yaml
+from flask import Flask, jsonify
+
+from vpncon import metrics
+from vpncon.users.model import Role
+from vpncon.validation import RequestValidator, SchemaCompiler
+
+
+with open('openapi.yml', encoding='utf-8') as f:
+    SPEC = yaml.safe_load(f)
+
+
+@pytest.fixture
+def client():
+    app = Flask(__name__)
+    app.before_request(RequestValidator(SPEC))
+
+    @app.route('/users/<int:telegram_id>', methods=['GET'])
+    def get_user(telegram_id):
+        return jsonify({'ok': True})
+
+    @app.route('/users/', methods=['GET', 'POST'])
+    def users():
+        return jsonify({'ok': True})
+
+    @app.route('/peers/', methods=['GET'])
+    def peers():
+        return jsonify({'ok': True})
+
+    return app.test_client()
+
+
+VALID_USER = {'telegram_id': 1, 'telegram_nick': 'nick', 'role': 'ADMIN'}
+
+
+def test_role_enum_matches_model():
+    assert set(SPEC['components']['schemas']['Role']['enum']) == {r.value for r in Role}
+
+
+def test_valid_body_passes(client):
+    assert client.post('/users/', json=VALID_USER).status_code == 200
+    body = {**VALID_USER, 'expires_at': '2026-01-01T00:00:00+00:00'}
+    assert client.post('/users/', json=body).status_code == 200
+
+
+@pytest.mark.parametrize('body', [
+    {**VALID_USER, 'role': 'ROOT'},
+    {**VALID_USER, 'role': None},
+    {**VALID_USER, 'telegram_id': '1'},
+    {**VALID_USER, 'telegram_id': True},
+    {**VALID_USER, 'telegram_nick': ''},
+    {**VALID_USER, 'expires_at': 'tomorrow'},
+    {'telegram_id': 1, 'role': 'ADMIN'},
+    [VALID_USER],
+])
+def test_invalid_body_rejected(client, body):
+    metrics.reset()
+    response = client.post('/users/', json=body)
+    assert response.status_code == 400
+    assert response.json['error']
+    assert metrics.get('api.validation_failed') == 1
+
+
+def test_missing_body_rejected(client):
+    assert client.post('/users/', data='garbage').status_code == 400
+
+
+def test_query_params(client):
+    assert client.get('/users/?limit=10').status_code == 200
+    assert client.get('/users/?limit=0').status_code == 400
+    assert client.get('/users/?limit=abc').status_code == 400
+    assert client.get('/peers/').status_code == 400
+    assert client.get('/peers/?telegram_id=5').status_code == 200
+
+
+def test_path_params(client):
+    assert client.get('/users/5').status_code == 200
+
+
+def test_nullable_and_nested_schema():
+    check = SchemaCompiler(SPEC).compile({
+        'type': 'array',
+        'items': {'type': 'integer', 'nullable': True, 'minimum': 1},
+    })
+    assert check([1, None, 2]) is None
+    assert check([1, 0]) == '[1]: must be >= 1'
@@ -0,0 +1,57 @@
+import os
+from datetime import datetime, timezone
+from vpncon.traffic.accounting import DeltaTracker, RollupBuffer, minute_bucket
+from vpncon.traffic.dump import PeerSample, parse_dump
+
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+PEER_1 = "xTIBA5rboUvnH4htodjb6e697QjLERt1NAB4mZqp8Dg="
+PEER_2 = "TrMvSoP4jYQlY6RIzBgbssQqY3vxI2Pi+y71lOWWXX0="
+PEER_3 = "gN65BkIKy1eCE9pP1wdc8ROUtkHLF2PfAqYdyYBz6EA="
+
+
+def read_snapshots():
+    with open(os.path.join(DATA_DIR, "gw1.dump"), encoding="utf-8") as f:
+        return list(parse_dump(f, "wg0"))
+
+
+def test_parse_saved_dump():
+    snapshots = read_snapshots()
+    assert len(snapshots) == 3
+    assert snapshots[0][0] == PeerSample("wg0", PEER_1, 100, 200)
+
+
+def test_parse_all_interfaces_dump():
+    lines = [
+        "wg0\tpriv\tpub\t51820\toff",
+        f"wg0\t{PEER_1}\t(none)\t(none)\t10.8.0.2/32\t0\t1\t2\toff",
+        "wg1\tpriv\tpub\t51821\toff",
+        f"wg1\t{PEER_2}\t(none)\t(none)\t10.9.0.2/32\t0\t3\t4\toff",
+        "wg0\tpriv\tpub\t51820\toff",
+        f"wg0\t{PEER_1}\t(none)\t(none)\t10.8.0.2/32\t0\t5\t6\toff",
+    ]
+    snapshots = list(parse_dump(lines))
+    assert [len(s) for s in snapshots] == [2, 1]
+    assert snapshots[0][1].interface == "wg1"
+
+
+def test_deltas_with_counter_reset():
+    tracker = DeltaTracker()
+    first, second, third = read_snapshots()
+    # Первый снимок - точка отсчёта
+    assert tracker.update("gw1", first) == []
+    assert tracker.update("gw1", second) == [(PEER_1, 50, 60), (PEER_2, 10, 20)]
+    # Счётчики PEER_1 сброшены: приращение равно новому значению
+    assert tracker.update("gw1", third) == [
+        (PEER_1, 40, 30), (PEER_2, 5, 5), (PEER_3, 2000, 500)
+    ]
+
+
+def test_rollup_buffer_aggregates_by_minute():
+    buffer = RollupBuffer()
+    at = datetime(2026, 1, 1, 12, 30, 15, tzinfo=timezone.utc)
+    buffer.add(at, [(PEER_1, 1, 2)])
+    buffer.add(at.replace(second=45), [(PEER_1, 3, 4)])
+    rows = buffer.drain()
+    assert rows == {(PEER_1, minute_bucket(at)): [4, 6]}
+    assert len(buffer) == 0
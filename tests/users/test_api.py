@@ -0,0 +1,66 @@
+import pytest
+from flask import Flask
+
+from vpncon import ratelimit
+from vpncon.db import bind_executor
+from vpncon.db.memory_db import MemoryDatabase, MemoryExecutor
+from vpncon.users import users_bp
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """Blueprint пользователей поверх чистой in-memory базы, без rate limit."""
+    monkeypatch.setattr(ratelimit, "_limiter", None)
+    monkeypatch.setattr(ratelimit, "_limits", {})
+    app = Flask(__name__)
+    app.register_blueprint(users_bp)
+    with bind_executor(MemoryExecutor(MemoryDatabase())):
+        yield app.test_client()
+
+
+def create(client, telegram_id, nick, role='ADMIN'):
+    response = client.post(
+        '/users/', json={'telegram_id': telegram_id, 'telegram_nick': nick, 'role': role}
+    )
+    assert response.status_code == 201
+
+
+def test_search_is_fuzzy_by_default(client):
+    create(client, 1, 'alice')
+    create(client, 2, 'alicja')
+    create(client, 3, 'bob')
+    response = client.get('/users/search?nick=alicia')
+    assert response.status_code == 200
+    nicks = [user['telegram_nick'] for user in response.json['users']]
+    assert set(nicks) == {'alice', 'alicja'}
+
+
+def test_change_roles_by_ids(client):
+    create(client, 1, 'alice', 'ACTIVATED_USER')
+    create(client, 2, 'bob', 'ADMIN')
+    response = client.patch('/users/roles', json={'role': 'ADMIN', 'telegram_ids': [1, 2]})
+    assert response.status_code == 200
+    assert response.json == {'status': 'updated', 'updated': 1}
+    assert client.get('/users/1').json['role'] == 'ADMIN'
+
+
+def test_change_roles_by_filter(client):
+    create(client, 1, 'alice', 'ACTIVATED_USER')
+    create(client, 2, 'bob', 'ACTIVATED_USER')
+    response = client.patch(
+        '/users/roles', json={'role': 'DEACTIVATED_USER', 'filter': {'role': 'ACTIVATED_USER'}}
+    )
+    assert response.json == {'status': 'updated', 'updated': 2}
+
+
+def test_stats_counts_roles(client):
+    create(client, 1, 'alice', 'ACTIVATED_USER')
+    create(client, 2, 'bob', 'ACTIVATED_USER')
+    create(client, 3, 'carol')
+    client.patch('/users/roles', json={'role': 'DEACTIVATED_USER', 'telegram_ids': [2]})
+    client.delete('/users/3')
+    response = client.get('/users/stats')
+    assert response.status_code == 200
+    assert response.json == {
+        'roles': {'ACTIVATED_USER': 1, 'DEACTIVATED_USER': 1}, 'total': 2, 'daily': []
+    }
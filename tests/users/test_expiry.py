@@ -0,0 +1,112 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from vpncon.users import expiry
+from vpncon.users.expiry import EXPIRING_ROLES_SQL, ExpiryScheduler
+from vpncon.users.model import EXPIRING_ROLES, User, Role
+
+
+def test_expiring_roles_sql_matches_model():
+    for role in EXPIRING_ROLES:
+        assert f"'{role.value}'" in EXPIRING_ROLES_SQL
+    assert f"'{Role.ADMIN.value}'" not in EXPIRING_ROLES_SQL
+
+
+def test_user_from_raw_with_expiry():
+    expires_at = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    user = User.from_raw((1, 'nick', 'ACTIVATED_USER', expires_at))
+    assert user.expires_at == expires_at
+
+
+def test_user_from_raw_without_expiry():
+    user = User.from_raw((1, 'nick', 'ACTIVATED_USER', None))
+    assert user.expires_at is None
+
+
+@pytest.fixture
+def two_shards(monkeypatch):
+    monkeypatch.setattr(expiry, "shard_count", lambda: 2)
+
+
+def test_run_pass_deactivates_in_batches(monkeypatch, two_shards):
+    batches = {0: [[1, 2], [3, 4], [5]], 1: [[6, 7], []]}
+    calls = []
+    def deactivate(batch_size, shard):
+        calls.append((batch_size, shard))
+        return batches[shard].pop(0)
+    monkeypatch.setattr(expiry, "deactivate_due_batch", deactivate)
+    assert ExpiryScheduler(batch_size=2).run_pass() == 7
+    assert calls == [(2, 0), (2, 0), (2, 0), (2, 1), (2, 1)]
+
+
+def test_run_pass_stops_between_batches(monkeypatch, two_shards):
+    scheduler = ExpiryScheduler(batch_size=1)
+    def deactivate(batch_size, shard):
+        scheduler._stop.set()
+        return [shard]
+    monkeypatch.setattr(expiry, "deactivate_due_batch", deactivate)
+    assert scheduler.run_pass() == 1
+
+
+def test_deactivate_due_skips_locked_rows():
+    # Параллельные планировщики разбирают разные пачки, а не ждут друг друга
+    assert "FOR UPDATE SKIP LOCKED" in expiry.DEACTIVATE_DUE_SQL
+    assert "LIMIT %(batch_size)s" in expiry.DEACTIVATE_DUE_SQL
+
+
+@pytest.mark.parametrize("next_due, expected", [
+    (None, 60.0),
+    (timedelta(seconds=-5), 0.0),
+    (timedelta(seconds=30), 30.0),
+    (timedelta(hours=1), 60.0),
+])
+def test_seconds_until_next_due(monkeypatch, next_due, expected):
+    now = datetime.now(timezone.utc)
+    monkeypatch.setattr(
+        expiry, "get_next_due", lambda: None if next_due is None else now + next_due
+    )
+    delay = ExpiryScheduler(max_sleep=60)._seconds_until_next_due()
+    assert delay == pytest.approx(expected, abs=1)
+
+
+def test_sleep_returns_on_stop():
+    scheduler = ExpiryScheduler()
+    threading.Timer(0.05, scheduler._stop.set).start()
+    started = time.monotonic()
+    scheduler._sleep(10)
+    assert time.monotonic() - started < 1
+
+
+def test_sleep_returns_on_notify():
+    class Listener:
+        def notifies(self, timeout, stop_after):
+            yield object()
+    scheduler = ExpiryScheduler()
+    scheduler._listener = Listener()
+    started = time.monotonic()
+    scheduler._sleep(10)
+    assert time.monotonic() - started < 1
+
+
+def test_stop_joins_thread(monkeypatch, two_shards):
+    passes = threading.Event()
+    monkeypatch.setattr(expiry, "deactivate_due_batch", lambda batch_size, shard: passes.set() or [])
+    monkeypatch.setattr(expiry, "get_next_due", lambda: None)
+    scheduler = ExpiryScheduler(max_sleep=60)
+    thread = threading.Thread(target=scheduler.run_forever)
+    scheduler._thread = thread
+    thread.start()
+    assert passes.wait(1)
+    scheduler.stop(timeout=2)
+    assert not thread.is_alive()
+
+
+def test_notify_triggers_match_expiring_roles():
+    from vpncon.db.migrations import M_0011_narrow_users_expiry_notify as migration
+    triggers = [script for script in migration.scripts if "CREATE TRIGGER" in script]
+    assert len(triggers) == 2
+    for script in triggers:
+        assert "FOR EACH ROW" in script
+        assert EXPIRING_ROLES_SQL.removeprefix("role ") in script
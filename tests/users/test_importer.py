@@ -0,0 +1,183 @@
+import io
+
+import psycopg
+import pytest
+from vpncon.config import Config
+from vpncon.users import importer
+from vpncon.users.importer import (
+    HistoryMode, ImportFormat, ImportReport, build_report, detect_format,
+)
+
+
+def rows(text, fmt):
+    return list(importer._iter_rows(io.StringIO(text), fmt))
+
+
+def test_csv_columns_in_header_order():
+    text = "role,telegram_id,telegram_nick\nADMIN,1,alice\n,2,bob\n"
+    assert rows(text, ImportFormat.CSV) == [('1', 'alice', 'ADMIN'), ('2', 'bob', None)]
+
+
+def test_csv_rejects_malformed_lines():
+    text = "telegram_id,telegram_nick,role\n1,alice\n2,bob,ADMIN,extra\n3,a\0b,ADMIN\n4,\"x\"y,ADMIN\n"
+    assert rows(text, ImportFormat.CSV) == [None, None, None, ('4', 'xy', 'ADMIN')]
+
+
+def test_csv_invalid_header():
+    with pytest.raises(ValueError):
+        rows("id,nick,role\n1,alice,ADMIN\n", ImportFormat.CSV)
+
+
+def test_ndjson_rows():
+    text = (
+        '{"telegram_id": 1, "telegram_nick": "alice", "role": "ADMIN"}\n'
+        '\n'
+        'not json\n'
+        '[1, 2, 3]\n'
+        '{"telegram_id": 2, "telegram_nick": "a\\u0000b", "role": "ADMIN"}\n'
+        '{"telegram_id": 3}\n'
+    )
+    assert rows(text, ImportFormat.NDJSON) == [
+        ('1', 'alice', 'ADMIN'), None, None, None, ('3', None, None)
+    ]
+
+
+def test_detect_format():
+    assert detect_format("users.ndjson") == ImportFormat.NDJSON
+    assert detect_format("users.JSONL") == ImportFormat.NDJSON
+    assert detect_format("users.csv") == ImportFormat.CSV
+    assert detect_format("-") == ImportFormat.CSV
+
+
+class RecordingCopy:
+    def __init__(self, written):
+        self.written = written
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc):
+        return False
+    def write_row(self, row):
+        self.written.append(row)
+
+
+class RecordingCursor:
+    def __init__(self):
+        self.written = []
+    def copy(self, query):
+        return RecordingCopy(self.written)
+
+
+@pytest.mark.parametrize("fmt, text", [
+    (ImportFormat.CSV, "telegram_id,telegram_nick,role\n1,alice,ADMIN\n2,bob\n3,carol,ADMIN\n"),
+    (ImportFormat.NDJSON, (
+        '{"telegram_id": 1, "telegram_nick": "alice", "role": "ADMIN"}\n'
+        '{"telegram_id": 2,\n'
+        '{"telegram_id": 3, "telegram_nick": "carol", "role": "ADMIN"}\n'
+    )),
+])
+def test_copy_rows_counts_rejected_in_both_formats(fmt, text):
+    cursor = RecordingCursor()
+    assert importer._copy_rows([cursor], io.StringIO(text), fmt) == 1
+    assert cursor.written == [('1', 'alice', 'ADMIN'), ('3', 'carol', 'ADMIN')]
+
+
+def test_copy_rows_splits_by_shard(monkeypatch):
+    monkeypatch.setattr(importer, "shard_for", lambda telegram_id: telegram_id % 2)
+    cursors = [RecordingCursor(), RecordingCursor()]
+    text = "telegram_id,telegram_nick,role\n1,a,ADMIN\n2,b,ADMIN\nx,c,ADMIN\n"
+    assert importer._copy_rows(cursors, io.StringIO(text), ImportFormat.CSV) == 0
+    # Строка с некорректным id отбракуется при валидации на первом шарде
+    assert [row[0] for row in cursors[0].written] == ['2', 'x']
+    assert [row[0] for row in cursors[1].written] == ['1']
+
+
+def test_build_report():
+    # 10 строк: 1 не разобралась, 2 не прошли валидацию, 1 дубль id, 1 без изменений
+    report = build_report(parse_rejected=1, loaded=9, rejected=2, inserted=4, updated=1)
+    assert report == ImportReport(total=10, inserted=4, updated=1, unchanged=2, rejected=3)
+    assert str(report) == "total=10 inserted=4 updated=1 unchanged=2 rejected=3"
+
+
+# ===============================================
+# Postgres
+# ===============================================
+needs_postgres = pytest.mark.skipif(
+    Config.DB_BACKEND == "memory", reason="needs postgres COPY and triggers"
+)
+
+# Пользователи до импорта: 101 не изменится, 102 сменит ник
+EXISTING_USERS = [(101, 'alice', 'ADMIN'), (102, 'bob', 'ADMIN')]
+IMPORT_CSV = (
+    "telegram_id,telegram_nick,role\n"
+    "101,alice,ADMIN\n"
+    "102,bobby,ADMIN\n"
+    "103,carol,ACTIVATED_USER\n"
+    "104,dave,ROOT\n"
+    "x,eve,ADMIN\n"
+    "103,caroline,DEACTIVATED_USER\n"
+)
+
+
+@pytest.fixture
+def import_cursor():
+    """Курсор в транзакции с staging таблицей и уже заведёнными пользователями.
+    Транзакция откатывается после теста
+    """
+    with psycopg.connect(Config.DB_URI, connect_timeout=20) as conn:
+        with conn.cursor() as cur:
+            cur.executemany(
+                "INSERT INTO users (telegram_id, telegram_nick, role) VALUES (%s, %s, %s)",
+                EXISTING_USERS,
+            )
+            # Ключ истории - (telegram_id, valid_to), а `now()` в транзакции одно и то же:
+            # сдвигаем строки вставки, чтобы слияние записало свои
+            cur.execute(
+                "UPDATE users_history SET valid_to = valid_to - interval '1 second'"
+                " WHERE telegram_id = ANY(%s)",
+                ([telegram_id for telegram_id, _, _ in EXISTING_USERS],),
+            )
+            cur.execute(importer.CREATE_STAGING_SQL)
+            yield cur
+        conn.rollback()
+
+
+def import_history(cur):
+    cur.execute(
+        "SELECT telegram_id, telegram_nick, role, action FROM users_history"
+        " WHERE telegram_id BETWEEN 101 AND 104 AND valid_to = now()"
+        " ORDER BY telegram_id"
+    )
+    return cur.fetchall()
+
+
+@needs_postgres
+def test_merge_staging_on_postgres(import_cursor):
+    stream = io.StringIO(IMPORT_CSV)
+    assert importer._copy_rows([import_cursor], stream, ImportFormat.CSV) == 0
+
+    # 6 строк: роль ROOT и id `x` отбракованы, 103 встречается дважды, 101 без изменений
+    assert importer._merge_staging(import_cursor, HistoryMode.ROW) == (6, 2, 1, 1)
+    import_cursor.execute(
+        "SELECT telegram_id, telegram_nick, role FROM users"
+        " WHERE telegram_id BETWEEN 101 AND 104 ORDER BY telegram_id"
+    )
+    # Из дублей побеждает последняя строка файла
+    assert import_cursor.fetchall() == [
+        (101, 'alice', 'ADMIN'), (102, 'bobby', 'ADMIN'), (103, 'caroline', 'DEACTIVATED_USER'),
+    ]
+
+
+@needs_postgres
+@pytest.mark.parametrize("history, expected", [
+    (HistoryMode.ROW, [(102, 'bob', 'ADMIN', 'U'), (103, 'caroline', 'DEACTIVATED_USER', 'I')]),
+    (HistoryMode.BATCH, [(102, 'bob', 'ADMIN', 'U'), (103, 'caroline', 'DEACTIVATED_USER', 'I')]),
+    (HistoryMode.OFF, []),
+])
+def test_merge_staging_history_modes(import_cursor, history, expected):
+    importer._copy_rows([import_cursor], io.StringIO(IMPORT_CSV), ImportFormat.CSV)
+    importer._merge_staging(import_cursor, history)
+    assert import_history(import_cursor) == expected
+
+    # После импорта триггеры истории снова включены
+    import_cursor.execute("UPDATE users SET telegram_nick = 'alicia' WHERE telegram_id = 101")
+    assert (101, 'alice', 'ADMIN', 'U') in import_history(import_cursor)
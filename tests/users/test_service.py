@@ -0,0 +1,112 @@
+from datetime import datetime, timezone
+
+import pytest
+from vpncon.db import bind_executor
+from vpncon.db.memory_db import MemoryDatabase, MemoryExecutor
+from vpncon.exceptions import (
+    EntityAlreadyExistsException, EntityNotExistsException, EntityValidationFailedException
+)
+from vpncon.users.model import Role
+from vpncon.users.service import UserServiceCRUD
+
+
+@pytest.fixture
+def service():
+    """Сервис поверх чистой in-memory базы."""
+    with bind_executor(MemoryExecutor(MemoryDatabase())):
+        yield UserServiceCRUD()
+
+
+def test_create_and_get_user(service):
+    expires_at = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    service.create_user(1, 'nick', 'ACTIVATED_USER', expires_at)
+    user = service.get_user(1)
+    assert user is not None
+    assert user.role == Role.ACTIVATED_USER
+    assert user.expires_at == expires_at
+
+
+def test_create_duplicate_user(service):
+    service.create_user(1, 'nick', 'ADMIN')
+    with pytest.raises(EntityAlreadyExistsException):
+        service.create_user(1, 'other', 'ADMIN')
+
+
+def test_update_and_delete_user(service):
+    service.create_user(1, 'nick', 'ADMIN')
+    service.update_user(1, 'renamed', 'DEACTIVATED_USER')
+    user = service.get_user(1)
+    assert user is not None and user.telegram_nick == 'renamed'
+    service.delete_user(1)
+    assert service.get_user(1) is None
+    with pytest.raises(EntityNotExistsException):
+        service.delete_user(1)
+
+
+def test_list_users_pages(service):
+    for telegram_id in range(1, 6):
+        service.create_user(telegram_id, f'nick{telegram_id}', 'ADMIN')
+    first = service.list_users(None, 2)
+    second = service.list_users(first[-1].telegram_id, 10)
+    assert [u.telegram_id for u in first] == [1, 2]
+    assert [u.telegram_id for u in second] == [3, 4, 5]
+
+
+def test_search_users_by_prefix(service):
+    for telegram_id, nick in enumerate(['Alice', 'alex', 'al_bob', 'albert', 'bob'], start=1):
+        service.create_user(telegram_id, nick, 'ADMIN')
+    found = service.search_users('AL', 10, fuzzy=False)
+    assert [u.telegram_nick for u in found] == ['al_bob', 'albert', 'alex', 'Alice']
+    assert [u.telegram_nick for u in service.search_users('al', 2, fuzzy=False)] == ['al_bob', 'albert']
+    # Спецсимволы LIKE сравниваются буквально
+    assert [u.telegram_nick for u in service.search_users('al_', 10, fuzzy=False)] == ['al_bob']
+    assert service.search_users('%', 10, fuzzy=False) == []
+
+
+def test_change_roles_groups_ids_by_shard(monkeypatch):
+    from vpncon.users import service as service_module
+    calls = []
+    monkeypatch.setattr(service_module, "shard_for", lambda telegram_id: telegram_id % 2)
+    monkeypatch.setattr(
+        service_module, "update_roles_by_ids",
+        lambda ids, role, shard: calls.append((shard, ids, role)) or ids[:1]
+    )
+    updated = UserServiceCRUD().change_roles('ADMIN', telegram_ids=[3, 1, 2, 3])
+    assert updated == 2
+    assert calls == [(0, [2], Role.ADMIN), (1, [1, 3], Role.ADMIN)]
+
+
+def test_change_roles_by_filter_on_every_shard(monkeypatch):
+    from vpncon.users import service as service_module
+    monkeypatch.setattr(service_module, "shard_count", lambda: 3)
+    monkeypatch.setattr(
+        service_module, "update_roles_by_role", lambda current, role, shard: [shard]
+    )
+    assert UserServiceCRUD().change_roles('DEACTIVATED_USER', current_role='ACTIVATED_CLOSE_USER') == 3
+
+
+def test_change_roles_requires_one_selector():
+    with pytest.raises(EntityValidationFailedException):
+        UserServiceCRUD().change_roles('ADMIN')
+    with pytest.raises(EntityValidationFailedException):
+        UserServiceCRUD().change_roles('ADMIN', telegram_ids=[1], current_role='ADMIN')
+
+
+def test_change_roles_by_ids_updates_rows(service):
+    for telegram_id, role in [(1, 'ADMIN'), (2, 'ACTIVATED_USER'), (3, 'ACTIVATED_USER')]:
+        service.create_user(telegram_id, f'nick{telegram_id}', role)
+    # Пользователь 1 уже ADMIN и не считается, 4 не существует
+    assert service.change_roles('ADMIN', telegram_ids=[1, 2, 4]) == 1
+    assert [service.get_user(i).role for i in (1, 2, 3)] == [
+        Role.ADMIN, Role.ADMIN, Role.ACTIVATED_USER
+    ]
+
+
+def test_change_roles_by_filter_updates_rows(service):
+    for telegram_id, role in [(1, 'ADMIN'), (2, 'ACTIVATED_USER'), (3, 'ACTIVATED_USER')]:
+        service.create_user(telegram_id, f'nick{telegram_id}', role)
+    assert service.change_roles('DEACTIVATED_USER', current_role='ACTIVATED_USER') == 2
+    assert service.get_user(2).role == Role.DEACTIVATED_USER
+    assert service.get_user(1).role == Role.ADMIN
+    # Смена роли на ту же ничего не трогает
+    assert service.change_roles('ADMIN', current_role='ADMIN') == 0
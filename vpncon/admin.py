@@ -0,0 +1,56 @@
+"""Служебные эндпоинты для диагностики.
+
+Доступны только с заголовком `Authorization: Bearer <ADMIN_TOKEN>`.
+Без `ADMIN_TOKEN` в окружении выключены и отвечают `404`.
+
+- `GET /admin/slow-queries` - планы медленных запросов процесса (см. `vpncon/db/slow_queries.py`),
+  от новых к старым. `?fingerprint=` - только записи одного запроса
+- `DELETE /admin/slow-queries` - очистить буфер
+- `GET /admin/metrics` - снимок метрик процесса (см. `vpncon/metrics.py`),
+  используется `python -m vpncon.replay`
+
+Данные относятся к процессу, который обработал запрос: у каждого воркера свои
+"""
+import hmac
+
+from flask import Blueprint, jsonify, request
+
+from vpncon.config import Config
+
+
+admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
+
+
+@admin_bp.before_request
+def require_admin_token():
+    """Пропускает только запросы с верным `ADMIN_TOKEN`."""
+    if not Config.ADMIN_TOKEN:
+        return jsonify({'error': 'Not found'}), 404
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    valid = hmac.compare_digest(token.encode(), Config.ADMIN_TOKEN.encode())
+    if scheme.lower() != 'bearer' or not valid:
+        return jsonify({'error': 'Unauthorized'}), 401
+    return None
+
+
+@admin_bp.route('/slow-queries', methods=['GET'])
+def slow_queries():
+    from vpncon.db.slow_queries import get_slow_query_log
+
+    entries = get_slow_query_log().entries(request.args.get('fingerprint'))
+    return jsonify({'slow_queries': [entry.as_dict() for entry in entries]})
+
+
+@admin_bp.route('/slow-queries', methods=['DELETE'])
+def clear_slow_queries():
+    from vpncon.db.slow_queries import get_slow_query_log
+
+    get_slow_query_log().clear()
+    return jsonify({'status': 'cleared'})
+
+
+@admin_bp.route('/metrics', methods=['GET'])
+def process_metrics():
+    from vpncon import metrics
+
+    return jsonify(metrics.snapshot())
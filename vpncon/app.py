@@ -0,0 +1,125 @@
+"""Сборка Flask приложения.
+
+Используется как dev сервером (`app.py`), так и production сервером (`gunicorn.conf.py`).
+В отличие от старого `app.py`, при импорте модуля ничего не происходит:
+инициализация БД и создание приложения - отдельные явные шаги.
+
+Пример production запуска:
+```sh
+gunicorn -c gunicorn.conf.py
+```
+"""
+import logging
+from typing import TYPE_CHECKING
+from flask import Flask, jsonify
+
+from vpncon.config import Config
+
+if TYPE_CHECKING:
+    from vpncon.startup import StartupProfile
+
+
+logger = logging.getLogger(__name__)
+
+
+def init_db(validate: bool = True, migrate: bool = True) -> None:
+    """Проверяет соединение с БД и применяет миграции.
+
+    Должен вызываться один раз на весь деплой (в мастер процессе), а не в каждом воркере
+    """
+    if Config.DB_BACKEND == "memory":
+        logger.info("In-memory DB backend, nothing to initialize")
+        return
+
+    logger.debug("Initializing the DB module")
+    if validate:
+        from vpncon.db import validate_connection
+        validate_connection()
+        logger.debug("Connection validated")
+
+    if migrate:
+        # Модули миграций грузятся только здесь
+        from vpncon.db.db_migrations import DbMigrator, PostgresMigrationExecutor
+        logger.info("Applying DB migrations if needed")
+        DbMigrator(PostgresMigrationExecutor).apply_migrations()
+    logger.info("DB module is initialized")
+
+
+def create_app(config: type[Config] = Config, profile: 'StartupProfile | None' = None) -> Flask:
+    """Создаёт и настраивает Flask приложение.
+
+    Необязательные части включаются флагами `config` и импортируются только если включены:
+    - `APP_VALIDATE_DB`, `APP_RUN_MIGRATIONS` - проверка соединения и миграции.
+      По умолчанию выключены: пул соединений создаётся лениво или через `warmup_pool()`
+    - `APP_BACKGROUND_BOOTSTRAP` - проверка соединения, миграции (если `APP_RUN_MIGRATIONS`)
+      и прогрев пула выполняются в фоне с повторами, API отвечает `503` до готовности БД
+    - `APP_VALIDATE_REQUESTS` - проверка запросов по `openapi.yml`
+    - `APP_SWAGGER_UI` - документация API на `/api/doc`
+    - `APP_RECORD_REQUESTS` - запись запросов для `python -m vpncon.replay`
+
+    Время каждой фазы и тяжёлых импортов пишется в `profile`
+    (по умолчанию новый `StartupProfile`) и в лог.
+    """
+    from vpncon.startup import StartupProfile
+
+    profile = profile or StartupProfile()
+    with profile.track_imports():
+        if config.APP_BACKGROUND_BOOTSTRAP:
+            with profile.phase("init_db"):
+                from vpncon.bootstrap import start_bootstrap
+                start_bootstrap(migrate=config.APP_RUN_MIGRATIONS)
+        elif config.APP_VALIDATE_DB or config.APP_RUN_MIGRATIONS:
+            with profile.phase("init_db"):
+                init_db(validate=config.APP_VALIDATE_DB, migrate=config.APP_RUN_MIGRATIONS)
+
+        with profile.phase("blueprints"):
+            from vpncon.db import PoolExhaustedError
+            from vpncon.users import users_bp
+            from vpncon.peers import peers_bp
+            from vpncon.health import health_bp
+            from vpncon.admin import admin_bp
+
+            from vpncon.shutdown import reject_when_draining
+
+            app = Flask(__name__)
+            app.config.from_object(config)
+            app.before_request(reject_when_draining)
+            if config.APP_BACKGROUND_BOOTSTRAP:
+                from vpncon.bootstrap import reject_until_ready
+                app.before_request(reject_until_ready)
+            app.register_blueprint(health_bp)
+            app.register_blueprint(users_bp)
+            app.register_blueprint(peers_bp)
+            app.register_blueprint(admin_bp)
+            app.register_error_handler(PoolExhaustedError, _handle_pool_exhausted)
+
+        if config.APP_RECORD_REQUESTS:
+            with profile.phase("request_recording"):
+                from vpncon.replay import RequestRecorder
+                # До проверки запросов: в запись попадает и некорректный трафик
+                app.before_request(RequestRecorder.from_path(config.APP_RECORD_REQUESTS))
+
+        if config.APP_VALIDATE_REQUESTS:
+            with profile.phase("request_validation"):
+                from vpncon.validation import RequestValidator
+                # Хуки приложения выполняются раньше хуков блюпринтов:
+                # некорректный запрос не трогает ни лимиты, ни БД
+                app.before_request(RequestValidator.from_file(config.OPENAPI_PATH))
+
+        if config.APP_SWAGGER_UI:
+            with profile.phase("swagger_ui"):
+                from swagger_ui import api_doc
+                api_doc(app, config_path=config.OPENAPI_PATH, url_prefix='/api/doc', title='API doc')
+
+    app.extensions["startup_profile"] = profile
+    logger.info(profile.report())
+    return app
+
+
+def _handle_pool_exhausted(exc: Exception):
+    """Быстрый отказ, когда нет свободных соединений с БД."""
+    logger.warning("Request rejected: %s", exc)
+    response = jsonify({'error': 'Service is overloaded, retry later'})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(Config.DB_RETRY_AFTER)
+    return response
@@ -0,0 +1,158 @@
+"""Фоновая инициализация БД в воркере.
+
+Воркер стартует сразу, не дожидаясь БД. В фоновом потоке `DbBootstrap`:
+1. проверяет соединение с БД
+2. применяет миграции (`APP_RUN_MIGRATIONS`, параллельные воркеры ждут друг друга
+   на advisory lock) или ждёт, пока их применит кто-то другой
+3. прогревает пул соединений
+
+Шаги повторяются с экспоненциальной задержкой (`BOOTSTRAP_BACKOFF_BASE`..`BOOTSTRAP_BACKOFF_MAX`),
+поэтому недоступный на старте postgres не роняет воркер и не получает шквал подключений.
+Пока инициализация не закончена, `/readyz` отвечает `503`, а API - `503` с `Retry-After`.
+
+Пример подключения:
+```python
+bootstrap = start_bootstrap(migrate=True)
+app.before_request(reject_until_ready)
+```
+"""
+import logging
+import random
+import threading
+import time
+
+from flask import jsonify, request
+
+from vpncon import metrics
+from vpncon.config import Config
+
+
+logger = logging.getLogger(__name__)
+
+
+class DbBootstrap:
+    """Фоновый поток инициализации БД."""
+    def __init__(self, migrate: bool) -> None:
+        self.migrate = migrate
+        self.ready = threading.Event()
+        self.state = "starting"
+        self.attempts = 0
+        self.last_error: str | None = None
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def _wait_for_schema(self) -> None:
+        from vpncon.db.db_migrations import DbMigrator, PostgresMigrationExecutor
+
+        migrator = DbMigrator(PostgresMigrationExecutor)
+        expected = migrator.latest_version()
+        current = migrator.current_version()
+        if current is None or current < expected:
+            raise RuntimeError(f"DB schema version is {current}, waiting for {expected}")
+
+    def bootstrap_once(self) -> None:
+        """Одна попытка инициализации. Бросает исключение, если БД ещё не готова."""
+        from vpncon.app import init_db
+        from vpncon.db import warmup_pool
+
+        if Config.DB_BACKEND == "memory":
+            return
+
+        self.state = "connecting"
+        init_db(validate=True, migrate=False)
+        if self.migrate:
+            self.state = "migrating"
+            init_db(validate=False, migrate=True)
+        else:
+            self.state = "waiting_for_schema"
+            self._wait_for_schema()
+        self.state = "warming_up_pool"
+        warmup_pool()
+
+    def _delay(self) -> float:
+        """Экспоненциальная задержка с полным случайным разбросом."""
+        cap = min(
+            Config.BOOTSTRAP_BACKOFF_MAX,
+            Config.BOOTSTRAP_BACKOFF_BASE * 2 ** min(self.attempts, 32),
+        )
+        return random.uniform(cap / 2, cap)
+
+    def run(self) -> None:
+        """Повторяет инициализацию до успеха или остановки."""
+        started = time.monotonic()
+        while not self._stop.is_set():
+            self.attempts += 1
+            try:
+                self.bootstrap_once()
+            except Exception as exc:
+                self.last_error = f"{exc.__class__.__name__}: {exc}"
+                metrics.inc("app.bootstrap.failures")
+                delay = self._delay()
+                logger.warning(
+                    "DB is not ready (%s, attempt %d), retrying in %.1fs",
+                    self.last_error, self.attempts, delay
+                )
+                self._stop.wait(delay)
+                continue
+
+            self.state = "ready"
+            self.last_error = None
+            elapsed = time.monotonic() - started
+            metrics.observe("app.bootstrap.seconds", elapsed)
+            logger.info("DB is ready after %d attempts, %.1fs", self.attempts, elapsed)
+            self.ready.set()
+            return
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name="db-bootstrap", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float | None = None) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def status(self) -> dict[str, object]:
+        return {
+            'state': self.state,
+            'attempts': self.attempts,
+            'error': self.last_error,
+        }
+
+
+_bootstrap: DbBootstrap | None = None
+
+def get_bootstrap() -> DbBootstrap | None:
+    """Возвращает инициализацию БД процесса или None, если она не запускалась."""
+    return _bootstrap
+
+
+def start_bootstrap(migrate: bool) -> DbBootstrap:
+    """Запускает фоновую инициализацию БД процесса."""
+    global _bootstrap
+    if _bootstrap is not None:
+        _bootstrap.stop()
+    _bootstrap = DbBootstrap(migrate)
+    _bootstrap.start()
+    from vpncon.shutdown import get_coordinator
+    get_coordinator().register("db_bootstrap", _bootstrap.stop)
+    return _bootstrap
+
+
+# Эндпоинты, которые работают до готовности БД
+NOT_GATED_BLUEPRINTS = frozenset({"health", "admin"})
+
+def reject_until_ready():
+    """`before_request` хук: пока БД не готова, отвечает `503` без обращения к пулу."""
+    bootstrap = _bootstrap
+    if bootstrap is None or bootstrap.ready.is_set():
+        return None
+    if request.blueprint in NOT_GATED_BLUEPRINTS:
+        return None
+    metrics.inc("app.bootstrap.rejected")
+    response = jsonify({'error': 'Service is starting, retry later'})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(Config.DB_RETRY_AFTER)
+    return response
@@ -8,10 +8,148 @@ load_dotenv()
 
 class Config:
     DB_URI:str = os.getenv("DB_URI") or ""
+    # Шарды пользовательских данных: строки подключения через `;`, по одной на шард.
+    # Шард выбирается по хешу telegram_id, пусто - одна база DB_URI.
+    # Число шардов нельзя менять после записи данных: перераспределения нет
+    DB_SHARD_URIS:list[str] = [
+        uri.strip() for uri in (os.getenv("DB_SHARDS") or "").split(";") if uri.strip()
+    ]
+    # Реализация DBExecutor: postgres | memory (in-memory база для тестов и бенчмарков)
+    DB_BACKEND:str = os.getenv("DB_BACKEND") or "postgres"
     DB_POOL_MIN_SIZE:int = int(os.getenv("DB_POOL_MIN_SIZE") or 1)
     DB_POOL_MAX_SIZE:int = int(os.getenv("DB_POOL_MAX_SIZE") or 5)
+    # Сколько секунд воркер ждёт открытия DB_POOL_MIN_SIZE соединений перед приёмом трафика
+    DB_POOL_WARMUP_TIMEOUT:float = float(os.getenv("DB_POOL_WARMUP_TIMEOUT") or 30)
+    # Сколько секунд транзакция ждёт свободного соединения, прежде чем получить 503
+    DB_POOL_TIMEOUT:float = float(os.getenv("DB_POOL_TIMEOUT") or 5)
+    # Сколько транзакций может ждать соединения одновременно. Остальные отклоняются сразу
+    DB_POOL_MAX_WAITING:int = int(os.getenv("DB_POOL_MAX_WAITING") or 20)
+    # Сколько соединений пула доступны только для транзакций с высоким приоритетом
+    DB_POOL_RESERVED_HIGH:int = int(os.getenv("DB_POOL_RESERVED_HIGH") or 1)
+    # statement_timeout для каждого соединения пула, 0 - без ограничения
+    DB_STATEMENT_TIMEOUT_MS:int = int(os.getenv("DB_STATEMENT_TIMEOUT_MS") or 30000)
+    # Экспоненциальная задержка между повторами транзакции (секунды), см. auto_transaction(retries=...)
+    DB_RETRY_BACKOFF_BASE:float = float(os.getenv("DB_RETRY_BACKOFF_BASE") or 0.01)
+    DB_RETRY_BACKOFF_MAX:float = float(os.getenv("DB_RETRY_BACKOFF_MAX") or 0.5)
+    # Сколько свободных DBExecutor держать для повторного использования между транзакциями
+    DB_EXECUTOR_POOL_MAX_IDLE:int = int(os.getenv("DB_EXECUTOR_POOL_MAX_IDLE") or 64)
+    # Сколько потоков читают один снимок в `read_in_snapshot()`, каждому своё соединение
+    DB_SNAPSHOT_WORKERS:int = int(os.getenv("DB_SNAPSHOT_WORKERS") or 4)
+    # Значение заголовка Retry-After при отказе из-за нехватки соединений
+    DB_RETRY_AFTER:int = int(os.getenv("DB_RETRY_AFTER") or 1)
+    # Запросы дольше порога (мс, 0 - выключено) попадают в лог медленных запросов,
+    # для доли из них, но не чаще раза в интервал (секунды) на запрос, снимается план.
+    # См. `vpncon/db/slow_queries.py`
+    DB_SLOW_QUERY_MS:float = float(os.getenv("DB_SLOW_QUERY_MS") or 500)
+    DB_SLOW_QUERY_SAMPLE_RATE:float = float(os.getenv("DB_SLOW_QUERY_SAMPLE_RATE") or 0.1)
+    DB_SLOW_QUERY_EXPLAIN_INTERVAL:float = float(os.getenv("DB_SLOW_QUERY_EXPLAIN_INTERVAL") or 60)
+    DB_SLOW_QUERY_BUFFER_SIZE:int = int(os.getenv("DB_SLOW_QUERY_BUFFER_SIZE") or 100)
+    DB_SLOW_QUERY_LOCK_TIMEOUT_MS:int = int(os.getenv("DB_SLOW_QUERY_LOCK_TIMEOUT_MS") or 1000)
+    DB_SLOW_QUERY_EXPLAIN_TIMEOUT_MS:int = int(os.getenv("DB_SLOW_QUERY_EXPLAIN_TIMEOUT_MS") or 10000)
+
+    # Параметры production сервера (см. gunicorn.conf.py).
+    # На каждый воркер свой пул, поэтому WEB_THREADS стоит держать не больше DB_POOL_MAX_SIZE,
+    # а WEB_WORKERS * DB_POOL_MAX_SIZE - не больше max_connections у postgres
+    WEB_BIND:str = os.getenv("WEB_BIND") or "0.0.0.0:8000"
+    WEB_WORKERS:int = int(os.getenv("WEB_WORKERS") or 2)
+    WEB_THREADS:int = int(os.getenv("WEB_THREADS") or 4)
+    # gthread | gevent | eventlet. Для кооперативных воркеров ожидание соединения
+    # ограничивает admission gate, а не число потоков
+    WEB_WORKER_CLASS:str = os.getenv("WEB_WORKER_CLASS") or "gthread"
+    WEB_WORKER_CONNECTIONS:int = int(os.getenv("WEB_WORKER_CONNECTIONS") or 1000)
+
+    # Планировщик истечения подписок: размер пачки деактивации и максимальный сон (секунды)
+    EXPIRY_SCHEDULER_ENABLED:bool = (os.getenv("EXPIRY_SCHEDULER_ENABLED") or "false").lower() == "true"
+    EXPIRY_BATCH_SIZE:int = int(os.getenv("EXPIRY_BATCH_SIZE") or 5000)
+    EXPIRY_MAX_SLEEP:float = float(os.getenv("EXPIRY_MAX_SLEEP") or 60)
+
+    # Сверка статистики пользователей: сбор дневной статистики из истории и пересчёт
+    # счётчиков ролей (секунды), за сколько последних дней пересобирать дневную статистику
+    USERS_STATS_JOB_ENABLED:bool = (os.getenv("USERS_STATS_JOB_ENABLED") or "false").lower() == "true"
+    USERS_STATS_ROLLUP_INTERVAL:float = float(os.getenv("USERS_STATS_ROLLUP_INTERVAL") or 60)
+    USERS_STATS_RECONCILE_INTERVAL:float = float(os.getenv("USERS_STATS_RECONCILE_INTERVAL") or 3600)
+    USERS_STATS_ROLLUP_DAYS:int = int(os.getenv("USERS_STATS_ROLLUP_DAYS") or 2)
+    # Дней дневной статистики в ответе `/users/stats` по умолчанию и максимум
+    USERS_STATS_DAYS:int = int(os.getenv("USERS_STATS_DAYS") or 30)
+    USERS_STATS_MAX_DAYS:int = int(os.getenv("USERS_STATS_MAX_DAYS") or 365)
+
+    # Сколько секунд хранить ответы на запросы с `Idempotency-Key`, очистка просроченных
+    IDEMPOTENCY_TTL:float = float(os.getenv("IDEMPOTENCY_TTL") or 86400)
+    IDEMPOTENCY_PURGE_ENABLED:bool = (os.getenv("IDEMPOTENCY_PURGE_ENABLED") or "false").lower() == "true"
+    IDEMPOTENCY_PURGE_INTERVAL:float = float(os.getenv("IDEMPOTENCY_PURGE_INTERVAL") or 300)
+    IDEMPOTENCY_PURGE_BATCH_SIZE:int = int(os.getenv("IDEMPOTENCY_PURGE_BATCH_SIZE") or 5000)
+
+    # Необязательные части приложения, см. `create_app()`
+    APP_VALIDATE_DB:bool = (os.getenv("APP_VALIDATE_DB") or "false").lower() == "true"
+    APP_RUN_MIGRATIONS:bool = (os.getenv("APP_RUN_MIGRATIONS") or "false").lower() == "true"
+    APP_VALIDATE_REQUESTS:bool = (os.getenv("APP_VALIDATE_REQUESTS") or "true").lower() == "true"
+    APP_BACKGROUND_BOOTSTRAP:bool = (
+        (os.getenv("APP_BACKGROUND_BOOTSTRAP") or "false").lower() == "true"
+    )
+    APP_SWAGGER_UI:bool = (os.getenv("APP_SWAGGER_UI") or "true").lower() == "true"
+    OPENAPI_PATH:str = os.getenv("OPENAPI_PATH") or "openapi.yml"
+    # Целевое время холодного старта в секундах, проверяется `python -m vpncon.startup --check`
+    APP_STARTUP_TARGET:float = float(os.getenv("APP_STARTUP_TARGET") or 1.0)
+    # Файл для записи входящих запросов (JSONL для `python -m vpncon.replay`). Пустой - не писать
+    APP_RECORD_REQUESTS:str = os.getenv("APP_RECORD_REQUESTS") or ""
+
+    # Задержка между попытками фоновой инициализации БД, секунды
+    BOOTSTRAP_BACKOFF_BASE:float = float(os.getenv("BOOTSTRAP_BACKOFF_BASE") or 0.5)
+    BOOTSTRAP_BACKOFF_MAX:float = float(os.getenv("BOOTSTRAP_BACKOFF_MAX") or 30)
+    # Сколько секунд `/readyz` отдаёт закэшированный результат проверки БД
+    READINESS_CACHE_SECONDS:float = float(os.getenv("READINESS_CACHE_SECONDS") or 1)
+    # Сколько секунд от SIGTERM ждать завершения открытых транзакций, см. `vpncon/shutdown.py`
+    SHUTDOWN_TIMEOUT:float = float(os.getenv("SHUTDOWN_TIMEOUT") or 20)
+    # Сколько секунд дать на откат транзакциям, запросы которых отменены по дедлайну
+    SHUTDOWN_CANCEL_GRACE:float = float(os.getenv("SHUTDOWN_CANCEL_GRACE") or 2)
+
+    # Размер страницы списка пользователей по умолчанию и максимальный
+    USERS_PAGE_SIZE:int = int(os.getenv("USERS_PAGE_SIZE") or 1000)
+    USERS_PAGE_MAX_SIZE:int = int(os.getenv("USERS_PAGE_MAX_SIZE") or 10000)
+    # Максимум telegram_id в одном запросе массовой смены ролей
+    USERS_BULK_MAX_IDS:int = int(os.getenv("USERS_BULK_MAX_IDS") or 100000)
+    # Размер ответа поиска по нику по умолчанию и максимальный
+    USERS_SEARCH_LIMIT:int = int(os.getenv("USERS_SEARCH_LIMIT") or 20)
+    USERS_SEARCH_MAX_LIMIT:int = int(os.getenv("USERS_SEARCH_MAX_LIMIT") or 100)
+    # С какой длины запроса искать ещё и нечётко: у коротких строк мало триграмм
+    USERS_SEARCH_FUZZY_MIN_LENGTH:int = int(os.getenv("USERS_SEARCH_FUZZY_MIN_LENGTH") or 3)
+
+    # Ограничение частоты запросов: local | postgres | off, лимиты `endpoint=rate:burst,...`
+    RATE_LIMIT_BACKEND:str = os.getenv("RATE_LIMIT_BACKEND") or "local"
+    RATE_LIMITS:str = os.getenv("RATE_LIMITS") or (
+        "default=10:20,users_api.api_get_user=50:100"
+    )
+    # Заголовок с идентификатором клиента от доверенного прокси. Пустая строка - по IP
+    RATE_LIMIT_CLIENT_HEADER:str = os.getenv("RATE_LIMIT_CLIENT_HEADER") or ""
+    RATE_LIMIT_MAX_KEYS:int = int(os.getenv("RATE_LIMIT_MAX_KEYS") or 100000)
+    # Очистка полных бакетов из `rate_limit_buckets` (RATE_LIMIT_BACKEND=postgres)
+    RATE_LIMIT_PURGE_INTERVAL:float = float(os.getenv("RATE_LIMIT_PURGE_INTERVAL") or 60)
+    RATE_LIMIT_PURGE_BATCH_SIZE:int = int(os.getenv("RATE_LIMIT_PURGE_BATCH_SIZE") or 5000)
+
+    # Подсети, из которых выдаются адреса пирам WireGuard. Пустая строка - семейство не используется
+    PEER_SUBNET_V4:str = os.getenv("PEER_SUBNET_V4") or "10.8.0.0/16"
+    PEER_SUBNET_V6:str = os.getenv("PEER_SUBNET_V6") or ""
+
+    # Серверная часть клиентских конфигов WireGuard
+    WG_SERVER_PUBLIC_KEY:str = os.getenv("WG_SERVER_PUBLIC_KEY") or ""
+    WG_ENDPOINT:str = os.getenv("WG_ENDPOINT") or ""
+    WG_DNS:str = os.getenv("WG_DNS") or "1.1.1.1"
+    WG_ALLOWED_IPS:str = os.getenv("WG_ALLOWED_IPS") or "0.0.0.0/0, ::/0"
+    WG_PERSISTENT_KEEPALIVE:int = int(os.getenv("WG_PERSISTENT_KEEPALIVE") or 25)
+
+    # Массовая выдача доступа: генерация ключей в пуле процессов кусками по KEYGEN_CHUNK_SIZE
+    KEYGEN_PROCESSES:int = int(os.getenv("KEYGEN_PROCESSES") or os.cpu_count() or 1)
+    KEYGEN_CHUNK_SIZE:int = int(os.getenv("KEYGEN_CHUNK_SIZE") or 500)
+    # Максимум пользователей в одном запросе на массовую выдачу
+    PROVISION_MAX_BATCH:int = int(os.getenv("PROVISION_MAX_BATCH") or 10000)
+
+    # Учёт трафика: буфер приращений сбрасывается в БД по размеру или по времени (секунды)
+    TRAFFIC_FLUSH_ROWS:int = int(os.getenv("TRAFFIC_FLUSH_ROWS") or 50000)
+    TRAFFIC_FLUSH_INTERVAL:float = float(os.getenv("TRAFFIC_FLUSH_INTERVAL") or 30)
 
     TELEGRAM_BOT_TOKEN:str = os.getenv("TELEGRAM_BOT_TOKEN") or ""
+    # Токен эндпоинтов `/admin` (заголовок `Authorization: Bearer <token>`). Пустой - они выключены
+    ADMIN_TOKEN:str = os.getenv("ADMIN_TOKEN") or ""
 
 
 
@@ -3,7 +3,11 @@
 в окружении множества воркеров и множества потоков в параллели.
 
 При корректном использовании модуля для каждого воркера будет свой пул соединений
-и для каждого потока свой экзекьютер запросов, безопасно обрабатывая транзакции и избегая гонок
+и для каждой транзакции свой экзекьютер запросов, безопасно обрабатывая транзакции и избегая гонок.
+Транзакция привязывается к контексту (`contextvars`), а не к потоку, поэтому модуль одинаково
+работает с потоками, гринлетами gevent/eventlet и задачами asyncio. Экзекьютеры переиспользуются
+через `ExecutorPool`. Задачи, запущенные внутри транзакции, наследуют её и не должны
+выполнять запросы параллельно с родителем
 
 Пример корректного использования:
 ```python
@@ -11,7 +15,7 @@ from db import get_db_executor
 
 # !!! Важно !!!
 # Вызывать get_db_executor() нужно внутри функции, которая обрабатывает запрос
-# Тем самым гарантируется, что для каждого потока будет свой экземпляр и свой пул
+# Тем самым гарантируется, что для каждого контекста будет свой экземпляр
 db_executor = get_db_executor()
 db_executor.open()
 try:
@@ -37,20 +41,44 @@ def foo(...):
     return ...
 ```
 """
+import importlib
+import inspect
+import os
+import random
+import sys
 import threading
-from typing import Callable, TypeVar, ParamSpec
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from dataclasses import dataclass
+from typing import Any, Callable, Iterator, Sequence, TypeVar, ParamSpec, overload
 from functools import wraps
-import weakref
 import logging
-from .db import DBExecutor, DataModel, UniqueConstraintError
-from .postgres_db import PostgresExecutor, get_pool, validate_connection
+from vpncon import metrics
+from vpncon.config import Config
+from .db import (
+    DBExecutor, DataModel, UniqueConstraintError, PoolExhaustedError,
+    TransientTransactionError, IsolationLevel, CrossShardTransactionError,
+    ReadOnlyTransactionError
+)
+from .admission import Priority, admission_priority, admit, no_admission_wait
+from .sharding import shard_count, shard_for
 
 # Строгое ограничение для импорта внешним кодом
 # Модуль может гарантировать что либо, только при правильном использовании
 # Поэтому вставляю все палки в колёса необдуманному использованию
 __all__ = ["DBExecutor", "get_db_executor", "auto_transaction",
-           "validate_connection", "DataModel", "UniqueConstraintError"]
+           "validate_connection", "warmup_pool", "close_pool",
+           "DataModel", "UniqueConstraintError", "PoolExhaustedError", "Priority",
+           "TransientTransactionError", "IsolationLevel", "rollback_only_transaction",
+           "CrossShardTransactionError", "shard_count", "shard_for", "bind_executor",
+           "ReadOnlyTransactionError", "read_in_snapshot"]
+# Реализации экзекьютеров импортируются лениво, но остаются доступны как подмодули
+_LAZY_SUBMODULES = ("postgres_db", "memory_db", "sharded_db", "slow_queries")
 def __getattr__(name:str):
+    if name in _LAZY_SUBMODULES:
+        return importlib.import_module(f".{name}", __name__)
     if name not in __all__:
         raise ImportError(
             f"Restricted access! Cannot import '{name}' from {__name__}. Use only {__all__}"
@@ -61,31 +89,237 @@ def __getattr__(name:str):
 logger = logging.getLogger(__name__)
 
 
-_thread_local = threading.local()
+@dataclass(frozen=True)
+class _Scope:
+    """Экзекьютер, привязанный к текущему контексту, и глубина вложенности транзакции.
 
-def _create_executor() -> DBExecutor:
-    """Создаёт `DBExecutor` и вешает на него хук для его закрытия перед удалением Garbage Collector
+    Значение `ContextVar` наследуется дочерними контекстами (задачи asyncio, гринлеты
+    с копией контекста), поэтому scope неизменяемый: вложенный вызов ставит новый scope,
+    а не меняет общий объект.
     """
-    executor = PostgresExecutor(get_pool())
-    # Освободить ресурсы при уничтожении объекта
-    # Думаю это можно назвать хуком, который будет вызван сборщиком мусора
-    weakref.finalize(executor, executor.close)
+    executor: DBExecutor
+    depth: int
+    # Экзекьютер закреплён за контекстом через get_db_executor()/bind_executor(),
+    # а не взят из пула на время транзакции
+    pinned: bool
+    # Scope, унаследованный через fork, ссылается на пулы соединений родителя
+    pid: int
+
+
+_scope: ContextVar[_Scope | None] = ContextVar("vpncon_db_scope", default=None)
+
+# id закреплённых экзекьютеров, в которых сейчас открыта транзакция.
+# Несколько задач могут унаследовать один закреплённый экзекьютер,
+# транзакцию в нём открывает только первая, остальные берут экзекьютер из пула
+_claimed: set[int] = set()
+_claimed_lock = threading.Lock()
+
+
+def _current_scope() -> _Scope | None:
+    scope = _scope.get()
+    if scope is None or scope.pid != os.getpid():
+        return None
+    return scope
+
+
+def _create_executor() -> DBExecutor:
+    """Создаёт `DBExecutor` согласно `DB_BACKEND`"""
+    # Драйвер импортируется только для выбранной реализации: psycopg - заметная часть старта
+    executor: DBExecutor
+    if Config.DB_BACKEND == "memory":
+        from .memory_db import MemoryExecutor
+        executor = MemoryExecutor()
+    elif Config.DB_BACKEND == "postgres" and shard_count() > 1:
+        from .sharded_db import ShardedExecutor
+        executor = ShardedExecutor(shard_count())
+    elif Config.DB_BACKEND == "postgres":
+        from .postgres_db import PostgresExecutor, get_pool
+        executor = PostgresExecutor(get_pool())
+    else:
+        raise ValueError(f"Unknown DB_BACKEND: {Config.DB_BACKEND!r}")
     return executor
 
 
+def _admits_per_shard() -> bool:
+    """Занимает ли экзекьютер `DB_BACKEND` слоты `AdmissionGate` сам, по шардам"""
+    return Config.DB_BACKEND == "postgres" and shard_count() > 1
+
+
+class ExecutorPool:
+    """Пул свободных экзекьютеров процесса.
+
+    Экзекьютер берётся из пула на время транзакции и возвращается после неё,
+    поэтому их число ограничено числом одновременных транзакций, а не потоков
+    или кооперативных задач. Соединение экзекьютер держит только внутри транзакции
+    """
+    def __init__(self, max_idle: int) -> None:
+        self.max_idle = max_idle
+        self._idle: list[DBExecutor] = []
+        self._lock = threading.Lock()
+
+    def acquire(self) -> DBExecutor:
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        metrics.inc("db.executor_pool.created")
+        return _create_executor()
+
+    def release(self, executor: DBExecutor) -> None:
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(executor)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._idle.clear()
+
+
+_executor_pool = ExecutorPool(Config.DB_EXECUTOR_POOL_MAX_IDLE)
+
+def _reset_executors_after_fork() -> None:
+    """Экзекьютеры, созданные до fork, ссылаются на пул соединений родителя. В дочернем процессе их забываем
+    """
+    global _claimed_lock
+    _executor_pool.clear()
+    _claimed.clear()
+    _claimed_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_executors_after_fork)
+
+
+def _enter_transaction() -> tuple[DBExecutor, Token[_Scope | None], bool]:
+    """Выбирает экзекьютер для новой транзакции верхнего уровня и ставит scope глубины 1.
+
+    Returns:
+        Экзекьютер, токен для восстановления scope и флаг, что экзекьютер закреплён за контекстом.
+    """
+    scope = _current_scope()
+    if scope is not None and scope.pinned:
+        with _claimed_lock:
+            claimed = id(scope.executor) not in _claimed
+            if claimed:
+                _claimed.add(id(scope.executor))
+        if claimed:
+            token = _scope.set(_Scope(scope.executor, 1, True, scope.pid))
+            return scope.executor, token, True
+    executor = _executor_pool.acquire()
+    token = _scope.set(_Scope(executor, 1, False, os.getpid()))
+    return executor, token, False
+
+
+def _exit_transaction(executor: DBExecutor, token: Token[_Scope | None], pinned: bool) -> None:
+    """Восстанавливает scope до транзакции и освобождает экзекьютер."""
+    _scope.reset(token)
+    if pinned:
+        with _claimed_lock:
+            _claimed.discard(id(executor))
+    else:
+        _executor_pool.release(executor)
+
+
+def validate_connection() -> None:
+    """Проверяет, что можно выполнить простейший запрос к базе каждого шарда. См. `postgres_db`"""
+    from .postgres_db import validate_connection as validate
+    validate()
+
+
+def warmup_pool() -> None:
+    """Создаёт пулы шардов и ждёт открытия `DB_POOL_MIN_SIZE` соединений. См. `postgres_db`"""
+    from .postgres_db import warmup_pool as warmup
+    warmup()
+
+
+def close_pool() -> None:
+    """Закрывает пулы текущего процесса, если они были созданы."""
+    # Пул не мог быть создан, если драйвер даже не импортировался
+    postgres_db = sys.modules.get(f"{__name__}.postgres_db")
+    if postgres_db is not None:
+        postgres_db.close_pool()
+
+
 def get_db_executor() -> DBExecutor:
-    """Возвращает `DBExecutor` для конкретного потока.
-    Инициализирует `DBExecutor`, если он еще создан для потока
+    """Возвращает `DBExecutor` текущего контекста: потока, гринлета или задачи asyncio.
+
+    Внутри транзакции - экзекьютер этой транзакции. Вне транзакции закрепляет
+    за контекстом отдельный экзекьютер, в котором потом откроется транзакция
+    верхнего уровня этого контекста
     """
-    if not hasattr(_thread_local, "executor"):
-        _thread_local.executor = _create_executor()
-    return _thread_local.executor
+    scope = _current_scope()
+    if scope is None:
+        scope = _Scope(_create_executor(), 0, True, os.getpid())
+        _scope.set(scope)
+    return scope.executor
+
+
+@contextmanager
+def bind_executor(executor: DBExecutor) -> Iterator[DBExecutor]:
+    """Закрепляет `executor` за текущим контекстом на время блока.
+    Транзакции верхнего уровня внутри блока выполняются в нём:
+    ```python
+    with bind_executor(MemoryExecutor(MemoryDatabase())):
+        user_service.create_user(...)
+    ```
+    """
+    if getattr(_current_scope(), "depth", 0) != 0:
+        raise RuntimeError("bind_executor cannot be used inside a transaction")
+    token = _scope.set(_Scope(executor, 0, True, os.getpid()))
+    try:
+        yield executor
+    finally:
+        _scope.reset(token)
+
+
+def _retry_delay(attempt: int) -> float:
+    """Экспоненциальная задержка перед повтором с полным случайным разбросом."""
+    cap = min(Config.DB_RETRY_BACKOFF_MAX, Config.DB_RETRY_BACKOFF_BASE * 2 ** attempt)
+    return random.uniform(0, cap)
+
+
+def _shard_key_getter(func: Callable[..., object], shard_by: str) -> Callable[..., int]:
+    """Собирает функцию, которая достаёт ключ шарда из аргументов вызова `func`.
+
+    `shard_by` - имя аргумента с telegram_id или путь к атрибуту через точку: `"user.telegram_id"`
+    """
+    arg_name, *attrs = shard_by.split(".")
+    signature = inspect.signature(func)
+    if arg_name not in signature.parameters:
+        raise TypeError(f"{func.__qualname__} has no argument {arg_name!r} to shard by")
+
+    def get_key(*args: object, **kwargs: object) -> int:
+        value = signature.bind(*args, **kwargs).arguments[arg_name]
+        for attr in attrs:
+            value = getattr(value, attr)
+        return value  # type: ignore[return-value]
+
+    return get_key
 
 
 P = ParamSpec("P")          # Параметры оборачиваемой функции
 R = TypeVar("R")            # Возвращаемое значение оборачиваемой функции
 
-def auto_transaction(func: Callable[P, R]) -> Callable[P, R]:
+@overload
+def auto_transaction(func: Callable[P, R]) -> Callable[P, R]: ...
+@overload
+def auto_transaction(
+    *,
+    priority: Priority = Priority.NORMAL,
+    retries: int = 0,
+    isolation_level: IsolationLevel | None = None,
+    read_only: bool = False,
+    deferrable: bool = False,
+    shard_by: str | None = None,
+) -> Callable[[Callable[P, R]], Callable[P, R]]: ...
+
+def auto_transaction(
+    func: Callable[P, R] | None = None,
+    *,
+    priority: Priority = Priority.NORMAL,
+    retries: int = 0,
+    isolation_level: IsolationLevel | None = None,
+    read_only: bool = False,
+    deferrable: bool = False,
+    shard_by: str | None = None,
+) -> Callable[P, R] | Callable[[Callable[P, R]], Callable[P, R]]:
     """Враппер для функции.
     Управляет подключением и транзакцией `DBExecutor` на время работы функции.
     Открывает транзакцию на входе в функцию и закрывает её после выхода из функции.
@@ -101,47 +335,257 @@ def auto_transaction(func: Callable[P, R]) -> Callable[P, R]:
 
     Таким образом общая рекомендация по использованию аннотации: добавлять её в любую функцию,
     где есть работа с `DBExecutor`
+
+    Перед открытием транзакции занимает слот в `AdmissionGate` с приоритетом `priority`
+    (с шардированием - слот шарда, когда транзакция на него направляется).
+    Если свободных соединений нет и очередь ожидания полна, бросает `PoolExhaustedError`.
+    Приоритет учитывается только на самом верхнем уровне:
+    ```python
+    @auto_transaction(priority=Priority.HIGH)
+    def api_get_user(...): ...
+    ```
+
+    `retries` включает повтор транзакции при `TransientTransactionError`
+    (serialization failure, deadlock): транзакция откатывается и функция вызывается заново
+    после экспоненциальной задержки со случайным разбросом.
+    Повтор возможен только на самом верхнем уровне, поэтому оборачиваемая функция
+    не должна иметь побочных эффектов вне БД.
+    `isolation_level` задаёт уровень изоляции транзакции, тоже только на верхнем уровне.
+    ```python
+    @auto_transaction(retries=3, isolation_level=IsolationLevel.SERIALIZABLE)
+    def api_update_user(...): ...
+    ```
+
+    `read_only` открывает транзакцию только для чтения: изменения данных в ней бросают
+    `ReadOnlyTransactionError`. `deferrable` (только вместе с `read_only`, уровень
+    `SERIALIZABLE` по умолчанию) ждёт безопасного снимка: долгий отчёт читает согласованные
+    данные, не получает serialization failure и не мешает пишущим транзакциям.
+    Тоже только на верхнем уровне.
+    ```python
+    @auto_transaction(read_only=True, deferrable=True, priority=Priority.LOW)
+    def export_users(...): ...
+    ```
+    Параллельное чтение одного снимка несколькими потоками - `read_in_snapshot()`.
+
+    `shard_by` направляет транзакцию на шард пользователя, см. `DBExecutor.route()`.
+    В отличие от остальных параметров учитывается на любом уровне вложенности:
+    транзакция, уже направленная на другой шард, получит `CrossShardTransactionError`.
+    ```python
+    @auto_transaction(shard_by="user.telegram_id")
+    def update_user(user: User): ...
+    ```
+    """
+    if deferrable:
+        if not read_only:
+            raise ValueError("deferrable transaction must be read only")
+        if isolation_level not in (None, IsolationLevel.SERIALIZABLE):
+            raise ValueError("deferrable transaction must be SERIALIZABLE")
+        # Без SERIALIZABLE postgres молча игнорирует DEFERRABLE
+        isolation_level = IsolationLevel.SERIALIZABLE
+
+    def decorator(func: Callable[P, R]) -> Callable[P, R]:
+        get_shard_key = _shard_key_getter(func, shard_by) if shard_by is not None else None
+
+        def run_once(*args: P.args, **kwargs: P.kwargs) -> R:
+            scope = _current_scope()
+            depth = scope.depth if scope is not None else 0
+            logger.debug("auto_transaction: call depth: %d", depth + 1)
+
+            if depth > 0:
+                # Вложенный вызов: работаем в транзакции верхнего уровня
+                assert scope is not None
+                token = _scope.set(_Scope(scope.executor, depth + 1, scope.pinned, scope.pid))
+                try:
+                    if get_shard_key is not None:
+                        scope.executor.route(get_shard_key(*args, **kwargs))
+                    return func(*args, **kwargs)
+                finally:
+                    _scope.reset(token)
+
+            # Первый уровень — занимаем слот, берём экзекьютер и открываем транзакцию
+            with admission_priority(priority):
+                # С шардированием слот шарда занимает экзекьютер, когда выбирает шард
+                gate = None if _admits_per_shard() else admit()
+                try:
+                    db_executor, token, pinned = _enter_transaction()
+                    try:
+                        logger.debug("auto_transaction: opening the transaction")
+                        db_executor.open()
+                        try:
+                            if read_only:
+                                db_executor.configure_transaction(
+                                    isolation_level, read_only=True, deferrable=deferrable
+                                )
+                            elif isolation_level is not None:
+                                db_executor.configure_transaction(isolation_level)
+                            if get_shard_key is not None:
+                                db_executor.route(get_shard_key(*args, **kwargs))
+                            logger.debug("auto_transaction: call wrapped func")
+                            result = func(*args, **kwargs)
+                        except Exception:
+                            logger.debug("auto_transaction: rollback the transaction")
+                            db_executor.rollback_and_close()
+                            raise
+                        logger.debug("auto_transaction: commit the transaction")
+                        db_executor.commit_and_close()
+                        return result
+                    finally:
+                        _exit_transaction(db_executor, token, pinned)
+                finally:
+                    if gate is not None:
+                        gate.release()
+
+        @wraps(func)
+        def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+            # Повторять можно только транзакцию целиком, то есть с самого верхнего уровня
+            outermost = getattr(_current_scope(), "depth", 0) == 0
+            attempt = 0
+            while True:
+                try:
+                    return run_once(*args, **kwargs)
+                except TransientTransactionError:
+                    if not outermost or attempt >= retries:
+                        if outermost and retries:
+                            metrics.inc("db.transaction.retries_exhausted")
+                        raise
+                    attempt += 1
+                    metrics.inc("db.transaction.retries")
+                    delay = _retry_delay(attempt)
+                    logger.info(
+                        "auto_transaction: transient error, retry %d/%d in %.3fs",
+                        attempt, retries, delay
+                    )
+                    time.sleep(delay)
+
+        return wrapper
+
+    if func is None:
+        return decorator
+    return decorator(func)
+
+
+@contextmanager
+def rollback_only_transaction() -> Iterator[DBExecutor]:
+    """Открывает транзакцию текущего потока, которая всегда откатывается на выходе.
+
+    Все вызовы функций с `auto_transaction` внутри блока выполняются во вложенном режиме,
+    то есть в этой транзакции, и ничего не коммитят. Предназначено для изоляции тестов:
+    ```python
+    with rollback_only_transaction():
+        user_service.create_user(...)
+    # Пользователя в БД нет
+    ```
+    После ошибки БД внутри блока транзакция остаётся в прерванном состоянии
+    до выхода из блока, как и в обычной транзакции.
     """
+    if getattr(_current_scope(), "depth", 0) != 0:
+        raise RuntimeError("rollback_only_transaction cannot be nested in another transaction")
+    db_executor, token, pinned = _enter_transaction()
+    try:
+        db_executor.open()
+        try:
+            yield db_executor
+        finally:
+            db_executor.rollback_and_close()
+    finally:
+        _exit_transaction(db_executor, token, pinned)
+
 
-    @wraps(func)
-    def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
-        # Получаем счётчик глубины для текущего потока
-        depth = getattr(_thread_local, "tx_depth", 0)
-        _thread_local.tx_depth = depth + 1
-        logger.debug("auto_transaction: call depth: %d", _thread_local.tx_depth)
+def read_in_snapshot(
+    tasks: Sequence[Callable[[], R]],
+    *,
+    shard: int = 0,
+    workers: int | None = None,
+    deferrable: bool = False,
+    priority: Priority = Priority.LOW,
+) -> list[R]:
+    """Выполняет функции чтения `tasks` на одном согласованном снимке шарда `shard`,
+    параллельно в `workers` потоках (по умолчанию `DB_SNAPSHOT_WORKERS`).
 
-        # Получаем экзекьютер для текущего потока
-        db_executor = get_db_executor()
+    Открывает транзакцию только для чтения (`REPEATABLE READ`, с `deferrable` -
+    `SERIALIZABLE READ ONLY DEFERRABLE`) и экспортирует её снимок. Каждый дополнительный
+    поток открывает свою транзакцию, импортирует снимок и выполняет задачи из общей очереди,
+    поэтому все задачи видят одни и те же данные, а пишущие транзакции не блокируются.
+    Задачи получают экзекьютер через `get_db_executor()`, как в `auto_transaction`.
+    ```python
+    users, history = read_in_snapshot([export_users, export_users_history], deferrable=True)
+    ```
+    Реализации без экспорта снимка (`DB_BACKEND=memory`) выполняют задачи по очереди
+    в одной транзакции. Экспортирующая транзакция ждёт слот `AdmissionGate` с приоритетом
+    `priority`, а дополнительные потоки берут только свободные слоты и без них не запускаются:
+    иначе параллельные вызовы, занявшие по слоту, ждали бы друг друга до таймаута.
+
+    Returns:
+        list[R]: Результаты задач в порядке `tasks`.
+    """
+    if getattr(_current_scope(), "depth", 0) != 0:
+        raise RuntimeError("read_in_snapshot cannot be used inside a transaction")
+    workers = min(workers or Config.DB_SNAPSHOT_WORKERS, len(tasks))
+    # Импортирующая транзакция не может быть DEFERRABLE: снимок экспортёра уже безопасный
+    isolation_level = IsolationLevel.SERIALIZABLE if deferrable else IsolationLevel.REPEATABLE_READ
+    results: list[Any] = [None] * len(tasks)
+    pending = iter(enumerate(tasks))
+    pending_lock = threading.Lock()
+    failed = threading.Event()
 
-        # Если это первый уровень — открываем транзакцию
-        if depth == 0:
-            logger.debug("auto_transaction: opening the transaction")
-            db_executor.open()
+    def drain() -> None:
+        while not failed.is_set():
+            with pending_lock:
+                item = next(pending, None)
+            if item is None:
+                return
+            index, task = item
+            try:
+                results[index] = task()
+            except BaseException:
+                failed.set()
+                raise
+
+    def drain_imported(snapshot: str) -> None:
+        admitted = False
+
+        @auto_transaction(priority=priority, isolation_level=isolation_level, read_only=True)
+        def run() -> None:
+            nonlocal admitted
+            executor = get_db_executor()
+            executor.route_shard(shard)
+            admitted = True
+            executor.import_snapshot(snapshot)
+            drain()
 
         try:
-            logger.debug("auto_transaction: call wrapped func")
-            result = func(*args, **kwargs)
-
-            # Закрываем транзакцию только при выходе из самого верхнего уровня
-            if _thread_local.tx_depth == 1:
-                logger.debug("auto_transaction: commit the transaction")
-                db_executor.commit_and_close()
-
-            logger.debug("auto_transaction: retrieving func result")
-            return result
-        except Exception:
-            # Закрываем транзакцию только на верхнем уровне
-            logger.debug(
-                "auto_transaction: caught exception on call depth: %d",
-                _thread_local.tx_depth
-            )
-
-            if _thread_local.tx_depth == 1:
-                logger.debug("auto_transaction: rollback the transaction")
-                db_executor.rollback_and_close()
+            with no_admission_wait():
+                run()
+        except PoolExhaustedError:
+            if admitted:
+                failed.set()
+                raise
+            # Свободного слота нет: задачи доделают потоки, которые уже работают
+            logger.debug("read_in_snapshot: no free slot for an extra worker")
+        except BaseException:
+            failed.set()
             raise
-        finally:
-            # Уменьшаем глубину
-            _thread_local.tx_depth -= 1
 
-    return wrapper
+    @auto_transaction(
+        priority=priority, isolation_level=isolation_level, read_only=True, deferrable=deferrable
+    )
+    def drain_exported() -> None:
+        executor = get_db_executor()
+        executor.route_shard(shard)
+        snapshot = executor.export_snapshot() if workers > 1 else None
+        if snapshot is None:
+            drain()
+            return
+        # Снимок живёт, пока открыта эта транзакция: выходим только после всех потоков
+        with ThreadPoolExecutor(workers - 1, thread_name_prefix="db-snapshot") as pool:
+            futures = [pool.submit(drain_imported, snapshot) for _ in range(workers - 1)]
+            try:
+                drain()
+            finally:
+                wait(futures)
+            for future in futures:
+                future.result()
+
+    if tasks:
+        drain_exported()
+    return results
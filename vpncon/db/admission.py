@@ -0,0 +1,219 @@
+"""Контроль допуска транзакций к пулу соединений.
+
+Стоит перед пулом каждого шарда и ограничивает количество одновременно открытых
+на шарде транзакций размером его пула (`DB_POOL_MAX_SIZE`), поэтому нагрузка на один шард
+не копит потоки в `pool.getconn()` этого шарда. Без шардирования слот занимает
+`auto_transaction` до открытия транзакции, с шардированием - `ShardedExecutor`
+при выборе шарда, а чтения по всем шардам - каждое на своём шарде.
+Вместо того чтобы копить потоки в `pool.getconn()`:
+- ожидающих транзакций не больше `DB_POOL_MAX_WAITING`, остальные сразу отклоняются
+- ожидание ограничено `DB_POOL_TIMEOUT`
+- `DB_POOL_RESERVED_HIGH` слотов доступны только транзакциям с `Priority.HIGH`,
+  поэтому дешёвые чтения продолжают проходить во время всплеска записей
+- транзакции внутри `no_admission_wait()` не ждут слот вовсе: так дополнительные
+  соединения берутся только из свободных, не блокируя других, пока свой слот уже занят
+
+Отказ выражается через `PoolExhaustedError`, который API превращает в `503`.
+"""
+import os
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Iterator
+
+from vpncon import metrics
+from vpncon.config import Config
+from .db import PoolExhaustedError
+
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    """Приоритет транзакции при допуске к пулу."""
+    LOW = 0
+    NORMAL = 1
+    HIGH = 2
+
+
+class AdmissionGate:
+    """Ограничитель одновременно открытых транзакций с ограниченной очередью ожидания.
+    Потокобезопасный. Один экземпляр на процесс, см. `get_admission_gate()`
+    """
+    def __init__(
+        self, capacity: int, max_waiting: int, reserved_high: int, timeout: float
+    ) -> None:
+        self.capacity = capacity
+        self.max_waiting = max_waiting
+        self.reserved_high = min(reserved_high, capacity - 1)
+        self.timeout = timeout
+        self.in_use = 0
+        self._waiting: dict[Priority, int] = {p: 0 for p in Priority}
+        self._cond = threading.Condition()
+
+    def _limit(self, priority: Priority) -> int:
+        if priority >= Priority.HIGH:
+            return self.capacity
+        return self.capacity - self.reserved_high
+
+    def _can_enter(self, priority: Priority) -> bool:
+        if self.in_use >= self._limit(priority):
+            return False
+        # Не обгоняем ожидающих с более высоким приоритетом
+        return not any(self._waiting[p] for p in Priority if p > priority)
+
+    def acquire(self, priority: Priority = Priority.NORMAL, wait: bool = True) -> None:
+        """Занимает слот. Бросает `PoolExhaustedError`, если очередь полна
+        или слот не освободился за `timeout` секунд. С `wait=False` не ждёт:
+        бросает `PoolExhaustedError`, если свободного слота нет прямо сейчас
+        """
+        with self._cond:
+            if self._can_enter(priority):
+                self.in_use += 1
+                return
+
+            if not wait:
+                raise PoolExhaustedError("No free connection slot")
+
+            if sum(self._waiting.values()) >= self.max_waiting:
+                metrics.inc("db.admission.rejected")
+                logger.warning(
+                    "Admission rejected: %d in use, %d waiting", self.in_use, self.max_waiting
+                )
+                raise PoolExhaustedError("Too many transactions are waiting for a connection")
+
+            started = time.monotonic()
+            deadline = started + self.timeout
+            self._waiting[priority] += 1
+            try:
+                while not self._can_enter(priority):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        metrics.inc("db.admission.timeout")
+                        raise PoolExhaustedError(
+                            f"No connection available within {self.timeout} seconds"
+                        )
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting[priority] -= 1
+                # Наш уход из очереди мог разблокировать ожидающих с меньшим приоритетом
+                self._cond.notify_all()
+            metrics.observe("db.admission.wait_seconds", time.monotonic() - started)
+            self.in_use += 1
+
+    def release(self) -> None:
+        """Освобождает слот, занятый через `acquire()`."""
+        with self._cond:
+            self.in_use -= 1
+            self._cond.notify_all()
+
+    def wait_idle(self, timeout: float) -> bool:
+        """Ждёт, пока не останется открытых транзакций.
+
+        Returns:
+            bool: True, если все слоты освободились за `timeout` секунд.
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self.in_use > 0:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+
+_wait_for_slot: ContextVar[bool] = ContextVar("admission_wait_for_slot", default=True)
+
+@contextmanager
+def no_admission_wait() -> Iterator[None]:
+    """Транзакции верхнего уровня внутри блока не ждут слот `AdmissionGate`:
+    если свободного нет, сразу бросают `PoolExhaustedError`
+    """
+    token = _wait_for_slot.set(False)
+    try:
+        yield
+    finally:
+        _wait_for_slot.reset(token)
+
+
+def admission_waits() -> bool:
+    """Ждать ли слот в текущем контексте, см. `no_admission_wait()`"""
+    return _wait_for_slot.get()
+
+
+_priority: ContextVar[Priority] = ContextVar("admission_priority", default=Priority.NORMAL)
+
+@contextmanager
+def admission_priority(priority: Priority) -> Iterator[None]:
+    """Слоты, которые транзакция займёт внутри блока, запрашиваются с приоритетом `priority`"""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> Priority:
+    """Приоритет транзакции текущего контекста, см. `admission_priority()`"""
+    return _priority.get()
+
+
+_gates: dict[int, AdmissionGate] = {}
+_gates_lock = threading.Lock()
+
+def get_admission_gate(shard: int = 0) -> AdmissionGate:
+    """Возвращает `AdmissionGate` шарда `shard`. Создаёт его при первом обращении."""
+    gate = _gates.get(shard)
+    if gate is None:
+        with _gates_lock:
+            gate = _gates.get(shard)
+            if gate is None:
+                # У каждого шарда свой пул, транзакция занимает соединение одного из них
+                gate = _gates[shard] = AdmissionGate(
+                    capacity=Config.DB_POOL_MAX_SIZE,
+                    max_waiting=Config.DB_POOL_MAX_WAITING,
+                    reserved_high=Config.DB_POOL_RESERVED_HIGH,
+                    timeout=Config.DB_POOL_TIMEOUT,
+                )
+    return gate
+
+
+def admit(shard: int = 0) -> AdmissionGate:
+    """Занимает слот шарда `shard` с приоритетом и режимом ожидания текущего контекста.
+
+    Returns:
+        AdmissionGate: Гейт, которому нужно вернуть слот через `release()`.
+    """
+    gate = get_admission_gate(shard)
+    gate.acquire(current_priority(), wait=admission_waits())
+    return gate
+
+
+def admission_gates() -> list[AdmissionGate]:
+    """Гейты шардов, созданные в этом процессе."""
+    with _gates_lock:
+        return list(_gates.values())
+
+
+def wait_all_idle(timeout: float) -> bool:
+    """Ждёт, пока на всех шардах не останется открытых транзакций.
+
+    Returns:
+        bool: True, если все слоты освободились за `timeout` секунд.
+    """
+    deadline = time.monotonic() + timeout
+    return all(
+        gate.wait_idle(max(deadline - time.monotonic(), 0.0)) for gate in admission_gates()
+    )
+
+
+def _reset_gate_after_fork() -> None:
+    global _gates, _gates_lock
+    _gates = {}
+    _gates_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_gate_after_fork)
@@ -1,4 +1,5 @@
 from abc import ABC, abstractmethod
+from enum import StrEnum
 from typing import Any, LiteralString
 import logging
 import dataclasses
@@ -10,6 +11,30 @@ class UniqueConstraintError(Exception):
     """Raised when a unique constraint is violated in the database."""
 
 
+class PoolExhaustedError(Exception):
+    """Raised when no database connection can be acquired in time."""
+
+
+class TransientTransactionError(Exception):
+    """Raised when a transaction failed due to a serialization failure or a deadlock
+    and can be safely retried from the beginning."""
+
+
+class CrossShardTransactionError(Exception):
+    """Raised when a transaction routed to one shard tries to touch another one."""
+
+
+class ReadOnlyTransactionError(Exception):
+    """Raised when a read-only transaction tries to modify data."""
+
+
+class IsolationLevel(StrEnum):
+    """Уровень изоляции транзакции."""
+    READ_COMMITTED = "READ COMMITTED"
+    REPEATABLE_READ = "REPEATABLE READ"
+    SERIALIZABLE = "SERIALIZABLE"
+
+
 class DBExecutor(ABC):
     """Обёртка вокруг драйвера ДБ.
     Предоставляет абстрагированный от конкретной реализации драйвера функционал:
@@ -40,6 +65,23 @@ class DBExecutor(ABC):
     def rollback_and_close(self) -> None:
         """Закрывает соединение и откатывает транзакцию"""
 
+    @abstractmethod
+    def configure_transaction(
+        self,
+        isolation_level: IsolationLevel | None,
+        read_only: bool = False,
+        deferrable: bool = False,
+    ) -> None:
+        """Задаёт уровень изоляции и режим открытой транзакции.
+
+        `read_only` запрещает изменения данных (`ReadOnlyTransactionError`).
+        `deferrable` вместе с `read_only` и `SERIALIZABLE` ждёт снимка, на котором транзакция
+        не может получить serialization failure и не отслеживается SSI.
+        `isolation_level=None` - уровень по умолчанию.
+
+        Должен вызываться сразу после `.open()`, до первого `.execute()`
+        """
+
     @abstractmethod
     def execute(self, query: LiteralString, **kwargs: Any) -> list[tuple[Any, ...]]:
         """Выполняет переданный запрос с параметрами и возвращает ответ в виде списка кортежей.
@@ -47,6 +89,43 @@ class DBExecutor(ABC):
         Перед вызовом метода необходимо открыть соединение, вызвав `.open()`
         """
 
+    def route(self, telegram_id: int) -> None:
+        """Направляет открытую транзакцию на шард пользователя `telegram_id`.
+
+        Транзакция работает только с одним шардом: попытка направить её на другой
+        бросает `CrossShardTransactionError`. Без шардирования ничего не делает
+        """
+
+    def route_shard(self, shard: int) -> None:
+        """Направляет открытую транзакцию на шард с номером `shard`. См. `.route()`"""
+
+    def scatter(self, query: LiteralString, **kwargs: Any) -> list[tuple[Any, ...]]:
+        """Выполняет запрос на всех шардах и возвращает объединённый ответ.
+
+        Порядок строк между шардами не определён, сортировку и `LIMIT`
+        нужно повторить над объединённым ответом. Без шардирования - то же, что `.execute()`
+        """
+        return self.execute(query, **kwargs)
+
+    def export_snapshot(self) -> str | None:
+        """Экспортирует снимок открытой транзакции, см. `.import_snapshot()`.
+        Снимок доступен, пока эта транзакция открыта.
+
+        Returns:
+            str | None: Идентификатор снимка или None, если реализация не поддерживает экспорт:
+                тогда читать из этого снимка можно только в этой же транзакции.
+        """
+        return None
+
+    def import_snapshot(self, snapshot: str) -> None:
+        """Переводит открытую транзакцию на снимок, экспортированный `.export_snapshot()`
+        другой транзакцией той же базы.
+
+        Транзакция должна быть `REPEATABLE READ` или `SERIALIZABLE` (как у экспортирующей),
+        вызов - до первого `.execute()`
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support snapshot import")
+
 
 class DataModel(object):
     """Базовый класс для моделей данных, реализованных через dataclass.
@@ -1,22 +1,29 @@
 """Модуль для управления миграциями и валидацией схемы БД.
 Собирает миграции из папки `.migrations` и применяет их по необходимости.
 Также инициализирует таблицу версий схемы БД при первой миграции.
+При шардировании миграции применяются к каждому шарду по очереди.
 """
 
 from abc import ABC, abstractmethod
+from contextlib import contextmanager, nullcontext
 from dataclasses import dataclass
-from typing import Any, LiteralString
+from typing import Any, ContextManager, Iterator, LiteralString
 import logging
 import psycopg
 import os
 import importlib
 
 from vpncon.config import Config
+from .sharding import shard_count
 
 
 logger = logging.getLogger(__name__)
 
 
+# Ключ advisory lock, под которым применяются миграции
+MIGRATIONS_LOCK_KEY = 0x7670_6E6D
+
+
 
 
 
@@ -32,16 +39,42 @@ class MigrationExecutor(ABC):
         """Выполняет переданные запросы с параметрами
           и возвращает ответ в виде списка списка кортежей."""
 
+    @staticmethod
+    def lock() -> ContextManager[None]:
+        """Блокировка, под которой миграции применяет только один процесс.
+        По умолчанию ничего не блокирует
+        """
+        return nullcontext()
+
+    @classmethod
+    def for_shards(cls) -> list[type['MigrationExecutor']]:
+        """Экзекьютеры всех шардов. По умолчанию шард один"""
+        return [cls]
+
 
 class PostgresMigrationExecutor(MigrationExecutor):
     """Реализация `MigrationExecutor` для работы с postgres.
     Более подробное описание назначения можно увидеть в `MigrationExecutor`
     """
-
-    @staticmethod
-    def execute(queries: list[LiteralString], autocommit:bool=False, **kwargs: Any) -> list[list[tuple[Any, ...]]]:
+    # Строка подключения. None - `DB_URI`
+    conninfo: str | None = None
+
+    @classmethod
+    def for_uri(cls, conninfo: str) -> type['PostgresMigrationExecutor']:
+        """Экзекьютер для базы `conninfo`."""
+        return type(cls.__name__, (cls,), {'conninfo': conninfo})
+
+    @classmethod
+    def for_shards(cls) -> list[type[MigrationExecutor]]:
+        if cls.conninfo is not None or shard_count() == 1:
+            return [cls]
+        return [cls.for_uri(uri) for uri in Config.DB_SHARD_URIS]
+
+    @classmethod
+    def execute(cls, queries: list[LiteralString], autocommit:bool=False, **kwargs: Any) -> list[list[tuple[Any, ...]]]:
         logger.debug("Opening new connection for migration executor")
-        with psycopg.connect(Config.DB_URI, autocommit=autocommit, connect_timeout=20) as conn:
+        conninfo = cls.conninfo or Config.DB_URI
+        with psycopg.connect(conninfo, autocommit=autocommit, connect_timeout=20) as conn:
             logger.debug("Connection opened")
             with conn.cursor() as cur:
                 results:list[list[tuple[Any, ...]]] = []
@@ -54,6 +87,19 @@ class PostgresMigrationExecutor(MigrationExecutor):
                         results.append([])
         return results
 
+    @classmethod
+    @contextmanager
+    def lock(cls) -> Iterator[None]:
+        # Сессионная advisory блокировка на отдельном соединении:
+        # воркеры, стартующие одновременно, применяют миграции по очереди
+        conninfo = cls.conninfo or Config.DB_URI
+        with psycopg.connect(conninfo, autocommit=True, connect_timeout=20) as conn:
+            conn.execute("SELECT pg_advisory_lock(%s)", (MIGRATIONS_LOCK_KEY,))
+            try:
+                yield
+            finally:
+                conn.execute("SELECT pg_advisory_unlock(%s)", (MIGRATIONS_LOCK_KEY,))
+
 
 # дата класс для хранения миграции
 @dataclass(frozen=True)
@@ -147,11 +193,35 @@ class DbMigrator:
             full_name=str(migration)
         )
 
+    def latest_version(self) -> int:
+        """Версия последней миграции из `.migrations`, то есть ожидаемая версия схемы."""
+        migrations = self._load_migrations()
+        if not migrations:
+            raise RuntimeError("No migrations found.")
+        return migrations[-1].version
+
+    def current_version(self) -> int | None:
+        """Текущая версия схемы БД или None, если миграции ещё не применялись.
+        При шардировании - наименьшая версия по шардам
+        """
+        shards = self.executor.for_shards()
+        if len(shards) > 1:
+            versions = [DbMigrator(executor).current_version() for executor in shards]
+            return None if None in versions else min(versions)  # type: ignore[type-var]
+        return self._get_current_schema_version()
+
     def apply_migrations(self) -> None:
         """
         Сверяет текущую версию схемы БД с версиями миграций, приставленных в `.migrations`.
         Если текущая версия меньше, чем последняя миграция, применяет все необходимые миграции
         """
+        shards = self.executor.for_shards()
+        if len(shards) > 1:
+            for i, executor in enumerate(shards):
+                logger.info("Migrating shard %d", i)
+                DbMigrator(executor).apply_migrations()
+            return
+
         # 1. Получить список миграций
         migrations = self._load_migrations()
         if not migrations or migrations[0].version != 0:
@@ -161,19 +231,20 @@ class DbMigrator:
             )
             raise RuntimeError("No migrations found.")
 
-        # 2. Определяем текущую версию схемы
-        current_version = self._get_current_schema_version()
-        logger.info("Current DB schema version: %s", current_version)
+        with self.executor.lock():
+            # 2. Определяем текущую версию схемы
+            current_version = self._get_current_schema_version()
+            logger.info("Current DB schema version: %s", current_version)
 
-        # 3. Фильтруем миграции, которые нужно применить
-        migrations_to_apply_filter = filter(
-            lambda m: current_version is None or m.version > current_version, migrations
-        )
+            # 3. Фильтруем миграции, которые нужно применить
+            migrations_to_apply_filter = filter(
+                lambda m: current_version is None or m.version > current_version, migrations
+            )
 
-        # 4. Применить недостающие миграции
-        for migration in migrations_to_apply_filter:
-            logger.info("Applying migration: %s", migration)
-            self._apply_migration(migration)
-            logger.info("Migration applied: %s", migration)
+            # 4. Применить недостающие миграции
+            for migration in migrations_to_apply_filter:
+                logger.info("Applying migration: %s", migration)
+                self._apply_migration(migration)
+                logger.info("Migration applied: %s", migration)
 
         logger.info("DB schema is up to date")
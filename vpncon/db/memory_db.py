@@ -0,0 +1,280 @@
+"""In-memory реализация `DBExecutor` для быстрых unit тестов и бенчмарков.
+
+Включается через `DB_BACKEND=memory`. Данные живут в in-memory базе sqlite процесса,
+поэтому тесты сервисов и API не требуют postgres, а бенчмарки меряют накладные расходы
+python кода отдельно от задержек БД.
+
+Семантика транзакций:
+- транзакции выполняются строго по одной (сериализуются блокировкой базы),
+  поэтому любой уровень изоляции выполняется как SERIALIZABLE
+- транзакция только для чтения бросает `ReadOnlyTransactionError` на изменение данных.
+  Экспорт снимка не поддерживается: параллельная транзакция ждала бы блокировку базы
+- `commit_and_close()` фиксирует, `rollback_and_close()` откатывает изменения
+- нарушение первичного ключа или уникальности бросает `UniqueConstraintError`
+
+Запросы пишутся так же, как для postgres: параметры `%(name)s` переводятся в `:name`,
+а `= ANY(%(name)s)` со списком - в `IN` по JSON массиву.
+Функция `similarity()` из `pg_trgm` реализована в python. Операторы `pg_trgm` переводятся в неё:
+`a %% b` - в `similarity(a, b) >= TRIGRAM_SIMILARITY_THRESHOLD`, `a <-> b` - в `1 - similarity(a, b)`.
+Операнды операторов - колонка, параметр или вызов функции без вложенных скобок.
+Схема - упрощённая копия таблиц, которые нужны коду без специфичного для postgres SQL
+(см. `MEMORY_SCHEMA`), миграции к ней не применяются. Счётчики ролей поддерживаются
+построчными триггерами в одном слоте, истории пользователей нет,
+поэтому дневная статистика всегда пустая.
+"""
+import json
+import re
+import sqlite3
+import threading
+import logging
+from datetime import datetime
+from typing import Any, LiteralString
+
+from .db import DBExecutor, UniqueConstraintError, IsolationLevel, ReadOnlyTransactionError
+
+
+logger = logging.getLogger(__name__)
+
+
+MEMORY_SCHEMA: list[str] = ["""
+CREATE TABLE users (
+    telegram_id BIGINT PRIMARY KEY,
+    telegram_nick VARCHAR(255) NOT NULL,
+    role VARCHAR(255) NOT NULL,
+    expires_at TIMESTAMPTZ
+)
+""","""
+CREATE TABLE idempotency_keys (
+    key VARCHAR(255) PRIMARY KEY,
+    fingerprint VARCHAR(64) NOT NULL,
+    status SMALLINT,
+    content_type VARCHAR(255),
+    body BLOB,
+    created_at TIMESTAMPTZ NOT NULL,
+    expires_at TIMESTAMPTZ NOT NULL
+)
+""","""
+CREATE TABLE users_role_counts (
+    role VARCHAR(255) NOT NULL,
+    slot SMALLINT NOT NULL,
+    count BIGINT NOT NULL,
+    PRIMARY KEY (role, slot)
+)
+""","""
+CREATE TRIGGER users_role_counts_insert_trigger
+AFTER INSERT ON users
+BEGIN
+    INSERT INTO users_role_counts (role, slot, count) VALUES (NEW.role, 0, 1)
+    ON CONFLICT (role, slot) DO UPDATE SET count = count + 1;
+END
+""","""
+CREATE TRIGGER users_role_counts_update_trigger
+AFTER UPDATE OF role ON users
+WHEN OLD.role <> NEW.role
+BEGIN
+    UPDATE users_role_counts SET count = count - 1 WHERE role = OLD.role AND slot = 0;
+    INSERT INTO users_role_counts (role, slot, count) VALUES (NEW.role, 0, 1)
+    ON CONFLICT (role, slot) DO UPDATE SET count = count + 1;
+END
+""","""
+CREATE TRIGGER users_role_counts_delete_trigger
+AFTER DELETE ON users
+BEGIN
+    UPDATE users_role_counts SET count = count - 1 WHERE role = OLD.role AND slot = 0;
+END
+""","""
+CREATE TABLE users_daily_stats (
+    day DATE PRIMARY KEY,
+    signups BIGINT NOT NULL,
+    churned BIGINT NOT NULL
+)
+"""]
+
+# `= ANY(%(name)s)` -> `IN (SELECT value FROM json_each(:name))`
+_ANY_RE = re.compile(r"=\s*ANY\(\s*%\((\w+)\)s\s*\)", re.IGNORECASE)
+# `%(name)s` -> `:name`, `%%` -> `%`
+_PARAM_RE = re.compile(r"%\((\w+)\)s|%%")
+
+# Порог похожести по умолчанию `pg_trgm.similarity_threshold`
+TRIGRAM_SIMILARITY_THRESHOLD = 0.3
+# Операнд оператора `pg_trgm`: вызов функции без вложенных скобок, параметр или колонка
+_TRGM_OPERAND = r"\w+\([^()]*\)|%\(\w+\)s|[\w.]+"
+# `a <-> b` -> `(1 - similarity(a, b))`
+_TRGM_DISTANCE_RE = re.compile(rf"({_TRGM_OPERAND})\s*<->\s*({_TRGM_OPERAND})")
+# `a %% b` -> `(similarity(a, b) >= порог)`
+_TRGM_SIMILAR_RE = re.compile(rf"({_TRGM_OPERAND})\s+%%\s+({_TRGM_OPERAND})")
+
+
+def _translate_query(query: str) -> str:
+    query = _ANY_RE.sub(r"IN (SELECT value FROM json_each(%(\1)s))", query)
+    query = _TRGM_DISTANCE_RE.sub(r"(1 - similarity(\1, \2))", query)
+    query = _TRGM_SIMILAR_RE.sub(
+        rf"(similarity(\1, \2) >= {TRIGRAM_SIMILARITY_THRESHOLD})", query
+    )
+    return _PARAM_RE.sub(lambda m: f":{m.group(1)}" if m.group(1) else "%", query)
+
+
+def _adapt_params(params: dict[str, Any]) -> dict[str, Any]:
+    """Списки передаются в sqlite как JSON массивы для `json_each`."""
+    return {
+        name: json.dumps(list(value)) if isinstance(value, (list, tuple)) else value
+        for name, value in params.items()
+    }
+
+
+def _adapt_datetime(value: datetime) -> str:
+    return value.isoformat()
+
+
+def _convert_datetime(value: bytes) -> datetime:
+    return datetime.fromisoformat(value.decode())
+
+
+sqlite3.register_adapter(datetime, _adapt_datetime)
+sqlite3.register_converter("TIMESTAMPTZ", _convert_datetime)
+
+
+def _trigrams(value: str) -> set[str]:
+    """Триграммы строки как в `pg_trgm`: слова из букв и цифр в нижнем регистре,
+    дополненные двумя пробелами в начале и одним в конце
+    """
+    trigrams: set[str] = set()
+    for word in re.findall(r"[^\W_]+", value.lower()):
+        padded = f"  {word} "
+        trigrams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return trigrams
+
+
+def trigram_similarity(left: str | None, right: str | None) -> float | None:
+    """Похожесть строк по триграммам, как `similarity()` из `pg_trgm`."""
+    if left is None or right is None:
+        return None
+    a, b = _trigrams(left), _trigrams(right)
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class MemoryDatabase:
+    """In-memory база процесса. Одно соединение sqlite на всех,
+    доступ к нему выдаётся на время транзакции
+    """
+    def __init__(self) -> None:
+        self.conn = sqlite3.connect(
+            ":memory:",
+            check_same_thread=False,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            # Транзакциями управляем сами
+            isolation_level=None,
+        )
+        self.lock = threading.Lock()
+        # Побайтовая сортировка postgres `COLLATE "C"`
+        self.conn.create_collation("C", lambda a, b: (a > b) - (a < b))
+        self.conn.create_function("similarity", 2, trigram_similarity, deterministic=True)
+        for script in MEMORY_SCHEMA:
+            self.conn.execute(script)
+
+
+_memory_db: MemoryDatabase | None = None
+_memory_db_lock = threading.Lock()
+
+def get_memory_db() -> MemoryDatabase:
+    """Возвращает in-memory базу процесса. Создаёт её при первом обращении."""
+    global _memory_db
+    if _memory_db is None:
+        with _memory_db_lock:
+            if _memory_db is None:
+                _memory_db = MemoryDatabase()
+    return _memory_db
+
+
+def reset_memory_db() -> None:
+    """Удаляет все данные: следующий `get_memory_db()` создаст пустую базу."""
+    global _memory_db
+    with _memory_db_lock:
+        _memory_db = None
+
+
+class MemoryExecutor(DBExecutor):
+    """Реализация `DBExecutor` поверх `MemoryDatabase`.
+    Более подробное описание назначения можно увидеть в `DBExecutor`
+    """
+    def __init__(self, db: MemoryDatabase | None = None) -> None:
+        self._db = db
+        self.db: MemoryDatabase | None = None
+        self.read_only = False
+
+    def open(self) -> None:
+        if self.db:
+            raise RuntimeError(
+                "Incorrect use: repeated .open() method"
+                + " invocation when the connection is already open"
+            )
+        db = self._db or get_memory_db()
+        db.lock.acquire()
+        try:
+            db.conn.execute("BEGIN")
+        except Exception:
+            db.lock.release()
+            raise
+        self.db = db
+
+    def _finish(self, statement: str) -> None:
+        db = self.db
+        if db is None:
+            return
+        self.db = None
+        try:
+            db.conn.execute(statement)
+        finally:
+            try:
+                if self.read_only:
+                    self.read_only = False
+                    db.conn.execute("PRAGMA query_only = OFF")
+            finally:
+                db.lock.release()
+
+    def close(self) -> None:
+        logger.debug("Closing connection")
+        # Незавершённая транзакция не должна пережить возврат соединения
+        self._finish("ROLLBACK")
+
+    def commit_and_close(self) -> None:
+        logger.debug("Closing connection with commit")
+        self._finish("COMMIT")
+
+    def rollback_and_close(self) -> None:
+        logger.debug("Closing connection with rollback")
+        self._finish("ROLLBACK")
+
+    def configure_transaction(
+        self,
+        isolation_level: IsolationLevel | None,
+        read_only: bool = False,
+        deferrable: bool = False,
+    ) -> None:
+        if self.db is None:
+            raise RuntimeError("Connection is not open. Use 'open()' method first.")
+        # Транзакции и так выполняются по одной
+        logger.debug("Memory executor runs every transaction as %s", IsolationLevel.SERIALIZABLE)
+        if read_only:
+            self.db.conn.execute("PRAGMA query_only = ON")
+            self.read_only = True
+
+    def execute(self, query: LiteralString, **kwargs: Any) -> list[tuple[Any, ...]]:
+        if self.db is None:
+            raise RuntimeError("Connection is not open. Use 'open()' method first.")
+        try:
+            logger.debug("Executing query: `%s`, with param `%s`", query, kwargs)
+            cur = self.db.conn.execute(_translate_query(query), _adapt_params(kwargs))
+        except sqlite3.IntegrityError as exc:
+            if "UNIQUE constraint failed" in str(exc):
+                raise UniqueConstraintError(str(exc)) from exc
+            raise
+        except sqlite3.OperationalError as exc:
+            if self.read_only and "readonly" in str(exc):
+                raise ReadOnlyTransactionError(str(exc)) from exc
+            raise
+        if cur.description:
+            return cur.fetchall()
+        return []
@@ -0,0 +1,88 @@
+"""
+Пиры WireGuard и пулы адресов для них.
+
+Адреса пула хранятся битовыми картами по `chunk_size` адресов в `address_pool_chunks`.
+Куски создаются лениво, по мере заполнения пула, поэтому даже огромная IPv6 подсеть
+занимает место пропорционально количеству выданных адресов.
+Частичный индекс по кускам со свободными адресами позволяет найти свободный адрес
+без сканирования таблицы, а триггер на `peers` возвращает адрес в пул при удалении пира.
+"""
+
+scripts = ["""
+CREATE TABLE IF NOT EXISTS address_pools (
+    pool_id SERIAL PRIMARY KEY,
+    cidr CIDR NOT NULL UNIQUE,
+    chunk_size INT NOT NULL,
+    -- количество уже созданных кусков и их максимально возможное количество
+    next_chunk BIGINT NOT NULL DEFAULT 0,
+    total_chunks BIGINT NOT NULL
+);
+""","""
+
+CREATE TABLE IF NOT EXISTS address_pool_chunks (
+    pool_id INT NOT NULL REFERENCES address_pools(pool_id) ON DELETE CASCADE,
+    chunk_no BIGINT NOT NULL,
+    bitmap BYTEA NOT NULL,
+    free_count INT NOT NULL,
+
+    PRIMARY KEY (pool_id, chunk_no)
+);
+""","""
+
+CREATE INDEX IF NOT EXISTS address_pool_chunks_free_idx
+ON address_pool_chunks (pool_id, chunk_no)
+WHERE free_count > 0
+;
+""","""
+
+CREATE TABLE IF NOT EXISTS peers (
+    public_key VARCHAR(64) PRIMARY KEY,
+    telegram_id BIGINT NOT NULL REFERENCES users(telegram_id) ON DELETE CASCADE,
+    address_v4 INET UNIQUE,
+    address_v6 INET UNIQUE,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+""","""
+
+CREATE INDEX IF NOT EXISTS peers_telegram_id_idx ON peers (telegram_id);
+""","""
+
+CREATE OR REPLACE FUNCTION release_pool_address(addr INET)
+RETURNS VOID AS $$
+BEGIN
+    IF addr IS NULL THEN
+        RETURN;
+    END IF;
+
+    UPDATE address_pool_chunks c
+    SET bitmap = set_bit(c.bitmap, mod(addr - host(p.cidr)::inet, p.chunk_size)::int, 0),
+        free_count = c.free_count + 1
+    FROM address_pools p
+    WHERE addr << p.cidr
+      AND c.pool_id = p.pool_id
+      AND c.chunk_no = div(addr - host(p.cidr)::inet, p.chunk_size)
+      AND get_bit(c.bitmap, mod(addr - host(p.cidr)::inet, p.chunk_size)::int) = 1;
+END;
+$$ LANGUAGE plpgsql
+;
+""","""
+
+CREATE OR REPLACE FUNCTION release_peer_addresses()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM release_pool_address(OLD.address_v4);
+    PERFORM release_pool_address(OLD.address_v6);
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql
+;
+""","""
+
+CREATE TRIGGER peers_release_addresses_trigger
+AFTER DELETE
+ON peers
+FOR EACH ROW
+EXECUTE FUNCTION release_peer_addresses()
+;
+"""
+]
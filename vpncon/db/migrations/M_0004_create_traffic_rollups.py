@@ -0,0 +1,36 @@
+"""
+Учёт трафика пользователей: накопительные таблицы по минутам, часам и дням.
+Каждая строка - сумма принятых и отправленных байт пользователя за интервал `bucket`.
+"""
+
+scripts = ["""
+CREATE TABLE IF NOT EXISTS traffic_minute (
+    telegram_id BIGINT NOT NULL,
+    bucket TIMESTAMPTZ NOT NULL,
+    rx_bytes BIGINT NOT NULL DEFAULT 0,
+    tx_bytes BIGINT NOT NULL DEFAULT 0,
+
+    PRIMARY KEY (telegram_id, bucket)
+);
+""","""
+
+CREATE TABLE IF NOT EXISTS traffic_hour (
+    telegram_id BIGINT NOT NULL,
+    bucket TIMESTAMPTZ NOT NULL,
+    rx_bytes BIGINT NOT NULL DEFAULT 0,
+    tx_bytes BIGINT NOT NULL DEFAULT 0,
+
+    PRIMARY KEY (telegram_id, bucket)
+);
+""","""
+
+CREATE TABLE IF NOT EXISTS traffic_day (
+    telegram_id BIGINT NOT NULL,
+    bucket TIMESTAMPTZ NOT NULL,
+    rx_bytes BIGINT NOT NULL DEFAULT 0,
+    tx_bytes BIGINT NOT NULL DEFAULT 0,
+
+    PRIMARY KEY (telegram_id, bucket)
+);
+"""
+]
@@ -0,0 +1,40 @@
+"""
+Срок действия подписки пользователя.
+
+Частичный индекс содержит только активных пользователей с заданным сроком,
+поэтому поиск ближайшего истечения и выборка просроченных не зависят от размера `users`.
+Триггер уведомляет планировщик истечений (канал `users_expiry`) об изменении сроков,
+чтобы он пересчитал время следующего пробуждения.
+"""
+
+scripts = ["""
+ALTER TABLE users ADD COLUMN IF NOT EXISTS expires_at TIMESTAMPTZ;
+""","""
+
+ALTER TABLE users_history ADD COLUMN IF NOT EXISTS expires_at TIMESTAMPTZ;
+""","""
+
+CREATE INDEX IF NOT EXISTS users_expires_at_idx
+ON users (expires_at)
+WHERE expires_at IS NOT NULL AND role IN ('ACTIVATED_USER', 'ACTIVATED_CLOSE_USER')
+;
+""","""
+
+CREATE OR REPLACE FUNCTION notify_users_expiry()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('users_expiry', '');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+;
+""","""
+
+CREATE TRIGGER users_expiry_notify_trigger
+AFTER INSERT OR UPDATE OF expires_at, role
+ON users
+FOR EACH STATEMENT
+EXECUTE FUNCTION notify_users_expiry()
+;
+"""
+]
@@ -0,0 +1,12 @@
+"""
+Общие для всех воркеров бакеты ограничения частоты запросов (RATE_LIMIT_BACKEND=postgres).
+Таблица unlogged: после сбоя бакеты просто начинаются заново полными.
+"""
+
+scripts = ["""
+CREATE UNLOGGED TABLE IF NOT EXISTS rate_limit_buckets (
+    key VARCHAR(255) PRIMARY KEY,
+    tokens DOUBLE PRECISION NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL
+);
+"""]
@@ -0,0 +1,24 @@
+"""
+Индексы поиска пользователей по `telegram_nick` без учёта регистра.
+
+- btree по `lower(telegram_nick)` в сортировке `C` (как `text_pattern_ops`, но годится и для
+  `ORDER BY`): поиск по префиксу через `LIKE 'abc%'` идёт упорядоченным проходом индекса
+  и останавливается на `LIMIT`
+- GiST триграммный индекс `pg_trgm` по `lower(telegram_nick)`: нечёткий поиск оператором `%`
+  с сортировкой по расстоянию `<->` (поиск ближайших соседей по индексу, тоже до `LIMIT`)
+"""
+
+scripts = ["""
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+""","""
+
+CREATE INDEX IF NOT EXISTS users_nick_prefix_idx
+ON users ((lower(telegram_nick) COLLATE "C"), telegram_id)
+;
+""","""
+
+CREATE INDEX IF NOT EXISTS users_nick_trgm_idx
+ON users USING gist (lower(telegram_nick) gist_trgm_ops)
+;
+"""
+]
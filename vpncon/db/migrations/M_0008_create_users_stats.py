@@ -0,0 +1,102 @@
+"""
+Счётчики для статистики пользователей.
+
+- `users_role_counts`: число пользователей по ролям. Поддерживается триггерами уровня оператора
+  с таблицами переходов: один оператор над любым числом строк меняет не больше одной строки
+  счётчика на роль. Счётчик роли разбит на 16 слотов (по `pg_backend_pid()`),
+  чтобы параллельные транзакции не ждали друг друга на одной строке.
+  Число пользователей роли - сумма её слотов
+- `users_daily_stats`: регистрации и отток по дням. Собирается из `users_history`
+  фоновой сверкой (`vpncon/users/stats.py`), поэтому индекс по `valid_to`
+"""
+
+scripts = ["""
+CREATE TABLE IF NOT EXISTS users_role_counts (
+    role VARCHAR(255) NOT NULL,
+    slot SMALLINT NOT NULL,
+    count BIGINT NOT NULL,
+    PRIMARY KEY (role, slot)
+)
+;
+""","""
+
+-- До создания триггеров users не меняется, иначе начальные счётчики разойдутся
+LOCK TABLE users IN SHARE ROW EXCLUSIVE MODE
+;
+""","""
+
+INSERT INTO users_role_counts (role, slot, count)
+SELECT role, 0, count(*) FROM users GROUP BY role
+;
+""","""
+
+CREATE OR REPLACE FUNCTION users_role_counts_apply()
+RETURNS TRIGGER AS $$
+DECLARE
+    counter_slot SMALLINT := pg_backend_pid() %% 16;
+BEGIN
+    -- Строки счётчиков блокируются в порядке ролей, чтобы операторы не взаимоблокировались
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO users_role_counts AS c (role, slot, count)
+        SELECT role, counter_slot, count(*) FROM new_rows GROUP BY role ORDER BY role
+        ON CONFLICT (role, slot) DO UPDATE SET count = c.count + EXCLUDED.count;
+    ELSIF TG_OP = 'DELETE' THEN
+        INSERT INTO users_role_counts AS c (role, slot, count)
+        SELECT role, counter_slot, -count(*) FROM old_rows GROUP BY role ORDER BY role
+        ON CONFLICT (role, slot) DO UPDATE SET count = c.count + EXCLUDED.count;
+    ELSE
+        INSERT INTO users_role_counts AS c (role, slot, count)
+        SELECT role, counter_slot, sum(delta)
+        FROM (
+            SELECT role, 1 AS delta FROM new_rows
+            UNION ALL
+            SELECT role, -1 AS delta FROM old_rows
+        ) AS changes
+        GROUP BY role
+        HAVING sum(delta) <> 0
+        ORDER BY role
+        ON CONFLICT (role, slot) DO UPDATE SET count = c.count + EXCLUDED.count;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+;
+""","""
+
+CREATE TRIGGER users_role_counts_insert_trigger
+AFTER INSERT ON users
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION users_role_counts_apply()
+;
+""","""
+
+CREATE TRIGGER users_role_counts_update_trigger
+AFTER UPDATE ON users
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION users_role_counts_apply()
+;
+""","""
+
+CREATE TRIGGER users_role_counts_delete_trigger
+AFTER DELETE ON users
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION users_role_counts_apply()
+;
+""","""
+
+CREATE TABLE IF NOT EXISTS users_daily_stats (
+    day DATE PRIMARY KEY,
+    signups BIGINT NOT NULL,
+    churned BIGINT NOT NULL
+)
+;
+""","""
+
+CREATE INDEX IF NOT EXISTS users_history_valid_to_idx
+ON users_history (valid_to)
+;
+"""
+]
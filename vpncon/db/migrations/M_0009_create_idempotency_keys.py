@@ -0,0 +1,26 @@
+"""
+Ответы на запросы с заголовком `Idempotency-Key` (см. `vpncon/idempotency.py`).
+
+Строка ключа пишется в той же транзакции, что и изменения запроса, поэтому ключ
+без ответа никогда не виден другим транзакциям. Просроченные строки удаляются фоновой
+очисткой по индексу `expires_at`.
+"""
+
+scripts = ["""
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    key VARCHAR(255) PRIMARY KEY,
+    fingerprint VARCHAR(64) NOT NULL,
+    status SMALLINT,
+    content_type VARCHAR(255),
+    body BYTEA,
+    created_at TIMESTAMPTZ NOT NULL,
+    expires_at TIMESTAMPTZ NOT NULL
+)
+;
+""","""
+
+CREATE INDEX IF NOT EXISTS idempotency_keys_expires_at_idx
+ON idempotency_keys (expires_at)
+;
+"""
+]
@@ -0,0 +1,69 @@
+"""
+История пользователей пишется триггерами уровня оператора вместо построчного.
+
+Построчный `users_history_trigger` на каждую строку заново собирает список колонок
+и выполняет динамический INSERT, поэтому массовые изменения (смена ролей когорты, импорт)
+тратят на историю больше, чем на само изменение. Триггеры уровня оператора с таблицами переходов
+пишут историю всего оператора одним `INSERT ... SELECT`. Семантика та же:
+для вставки - новые значения с action = 'I', для изменения и удаления - старые с 'U' и 'D'.
+"""
+
+scripts = ["""
+CREATE OR REPLACE FUNCTION log_table_history_statement()
+RETURNS TRIGGER AS $$
+DECLARE
+    hist_table TEXT := TG_TABLE_NAME || '_history';
+    cols TEXT;
+BEGIN
+    SELECT string_agg(quote_ident(column_name), ', ' ORDER BY ordinal_position)
+    INTO cols
+    FROM information_schema.columns
+    WHERE table_name = TG_TABLE_NAME
+      AND table_schema = TG_TABLE_SCHEMA;
+
+    -- Таблицы переходов видны и в динамическом SQL функции
+    IF TG_OP = 'INSERT' THEN
+        EXECUTE format(
+            'INSERT INTO %%I (%%s, action) SELECT %%s, %%L FROM new_rows',
+            hist_table, cols, cols, 'I'
+        );
+    ELSE
+        EXECUTE format(
+            'INSERT INTO %%I (%%s, action) SELECT %%s, %%L FROM old_rows',
+            hist_table, cols, cols, left(TG_OP, 1)
+        );
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+;
+""","""
+
+DROP TRIGGER IF EXISTS users_history_trigger ON users
+;
+""","""
+
+CREATE TRIGGER users_history_insert_trigger
+AFTER INSERT ON users
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION log_table_history_statement()
+;
+""","""
+
+CREATE TRIGGER users_history_update_trigger
+AFTER UPDATE ON users
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION log_table_history_statement()
+;
+""","""
+
+CREATE TRIGGER users_history_delete_trigger
+AFTER DELETE ON users
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION log_table_history_statement()
+;
+"""
+]
@@ -0,0 +1,42 @@
+"""
+Уведомление планировщика истечений только при изменении сроков.
+
+Триггер уровня оператора из `M_0005` слал `pg_notify` на каждую вставку и смену роли,
+в том числе на деактивации самого планировщика, импорт без сроков и массовую смену ролей,
+и будил планировщик впустую. Построчные триггеры с `WHEN` уведомляют, только если
+у активного пользователя появился или изменился срок либо пользователь с заданным сроком
+стал активным: только так ближайшее истечение может стать раньше.
+Одинаковые уведомления одной транзакции postgres доставляет один раз.
+Предикат по ролям должен совпадать с `EXPIRING_ROLES_SQL` из `vpncon/users/expiry.py`.
+"""
+
+scripts = ["""
+DROP TRIGGER IF EXISTS users_expiry_notify_trigger ON users
+;
+""","""
+
+CREATE TRIGGER users_expiry_notify_insert_trigger
+AFTER INSERT
+ON users
+FOR EACH ROW
+WHEN (
+    NEW.expires_at IS NOT NULL
+    AND NEW.role IN ('ACTIVATED_USER', 'ACTIVATED_CLOSE_USER')
+)
+EXECUTE FUNCTION notify_users_expiry()
+;
+""","""
+
+CREATE TRIGGER users_expiry_notify_update_trigger
+AFTER UPDATE OF expires_at, role
+ON users
+FOR EACH ROW
+WHEN (
+    NEW.expires_at IS NOT NULL
+    AND NEW.role IN ('ACTIVATED_USER', 'ACTIVATED_CLOSE_USER')
+    AND (OLD.expires_at, OLD.role) IS DISTINCT FROM (NEW.expires_at, NEW.role)
+)
+EXECUTE FUNCTION notify_users_expiry()
+;
+"""
+]
@@ -1,51 +1,183 @@
 from typing import Any, LiteralString
+import os
+import re
 import threading
+import time
 import logging
+import weakref
 import psycopg
 from psycopg.cursor import Cursor
 from psycopg import Connection
 from psycopg.rows import TupleRow
-from psycopg_pool import ConnectionPool
+from psycopg_pool import ConnectionPool, PoolTimeout, TooManyRequests
 
+from vpncon import metrics
 from vpncon.config import Config
-from .db import DBExecutor, UniqueConstraintError
+from .db import (
+    DBExecutor, UniqueConstraintError, PoolExhaustedError,
+    TransientTransactionError, IsolationLevel, ReadOnlyTransactionError
+)
 
 logger = logging.getLogger(__name__)
 
-_pool: ConnectionPool | None = None
+# SQLSTATE ошибок, после которых транзакцию можно безопасно повторить:
+# serialization_failure и deadlock_detected
+RETRYABLE_SQLSTATES = frozenset({"40001", "40P01"})
+# read_only_sql_transaction
+READ_ONLY_SQLSTATE = "25006"
+# Идентификатор снимка из `pg_export_snapshot()`, например `00000003-0000001B-1`
+_SNAPSHOT_ID_RE = re.compile(r"^[0-9A-F]+-[0-9A-F]+(-[0-9]+)?$")
+
+# Пулы по номерам шардов. Без шардирования - единственный пул с номером 0
+_pools: dict[int, ConnectionPool] = {}
 _pool_lock = threading.Lock()
+# Пулы, унаследованные от родительского процесса после fork.
+# Держим на них ссылки, чтобы сборщик мусора не закрыл соединения,
+# сокеты которых всё ещё используются родителем
+_inherited_pools: list[ConnectionPool] = []
+
+
+def shard_uris() -> list[str]:
+    """Строки подключения шардов по порядку. Без шардирования - только `DB_URI`."""
+    return Config.DB_SHARD_URIS or [Config.DB_URI]
+
 
-def get_pool() -> ConnectionPool:
-    """ Возвращает пул соединений. Создаёт его при первом обращении.
+def get_pool(shard: int = 0) -> ConnectionPool:
+    """ Возвращает пул соединений шарда `shard`. Создаёт его при первом обращении.
 
     Потокобезопасный. Разделяет общий пул на все потоки
     """
-    global _pool
-    if _pool is None:                        # быстрая проверка без блокировки
+    pool = _pools.get(shard)                 # быстрая проверка без блокировки
+    if pool is None:
         with _pool_lock:                      # блокируем создание
-            if _pool is None:                 # повторная проверка (double-checked locking)
-                _pool = ConnectionPool(
-                    conninfo=Config.DB_URI,
+            pool = _pools.get(shard)          # повторная проверка (double-checked locking)
+            if pool is None:
+                kwargs: dict[str, Any] = {}
+                if Config.DB_STATEMENT_TIMEOUT_MS > 0:
+                    # Передаём через startup параметры, чтобы не тратить лишний запрос
+                    kwargs["options"] = f"-c statement_timeout={Config.DB_STATEMENT_TIMEOUT_MS}"
+                pool = _pools[shard] = ConnectionPool(
+                    conninfo=shard_uris()[shard],
                     min_size=Config.DB_POOL_MIN_SIZE,
-                    max_size=Config.DB_POOL_MAX_SIZE
+                    max_size=Config.DB_POOL_MAX_SIZE,
+                    timeout=Config.DB_POOL_TIMEOUT,
+                    max_waiting=Config.DB_POOL_MAX_WAITING,
+                    kwargs=kwargs,
+                    name=f"shard-{shard}",
                 )
-    return _pool
+    return pool
+
+
+def reset_pool() -> None:
+    """Забывает текущие пулы без их закрытия. Следующий `get_pool()` создаст новый.
+
+    Предназначен для вызова в дочернем процессе сразу после fork:
+    фоновые потоки пула в дочерний процесс не переезжают,
+    а соединения разделяют сокеты с родителем, поэтому закрывать их здесь нельзя
+    """
+    with _pool_lock:
+        if _pools:
+            logger.debug("Dropping the connection pools inherited from the parent process")
+            _inherited_pools.extend(_pools.values())
+        _pools.clear()
+
+
+def warmup_pool() -> None:
+    """Создаёт пулы всех шардов и ждёт, пока в каждом откроется `DB_POOL_MIN_SIZE` соединений.
+
+    Вызывается в воркере до приёма трафика, чтобы первые запросы после деплоя
+    не платили за установку соединений.
+    Бросает `psycopg_pool.PoolTimeout`, если не уложились в `DB_POOL_WARMUP_TIMEOUT`
+    """
+    shards = len(shard_uris())
+    logger.info(
+        "Warming up the connection pools: %d shards, %d connections each",
+        shards, Config.DB_POOL_MIN_SIZE
+    )
+    for shard in range(shards):
+        get_pool(shard).wait(timeout=Config.DB_POOL_WARMUP_TIMEOUT)
+    logger.info("Connection pools are warmed up")
+
+
+def close_pool() -> None:
+    """Закрывает пулы текущего процесса, если они были созданы."""
+    with _pool_lock:
+        for pool in _pools.values():
+            logger.debug("Closing the connection pool %s", pool.name)
+            pool.close()
+        _pools.clear()
+
+
+# Экзекьютеры с открытой транзакцией, чтобы при остановке прервать зависшие
+_active: "weakref.WeakSet[PostgresExecutor]" = weakref.WeakSet()
+_active_lock = threading.Lock()
+
+
+def _reset_after_fork() -> None:
+    global _active, _active_lock
+    reset_pool()
+    # Транзакции родителя в дочернем процессе не наши
+    _active = weakref.WeakSet()
+    _active_lock = threading.Lock()
+
+
+# Любой fork (pre-fork сервер, multiprocessing) получает свой пул
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def cancel_active() -> int:
+    """Отменяет выполняющиеся запросы всех открытых транзакций процесса.
+    Владелец транзакции получит ошибку и откатит её сам
+
+    Returns:
+        int: Количество открытых транзакций.
+    """
+    with _active_lock:
+        executors = list(_active)
+    for executor in executors:
+        conn = executor.conn
+        if conn is None:
+            continue
+        try:
+            conn.cancel_safe(timeout=1)
+        except Exception as exc:
+            logger.warning("Cannot cancel the query: %s", exc)
+    return len(executors)
+
+
+def close_active() -> int:
+    """Закрывает соединения транзакций, которые так и не завершились.
+    Postgres откатывает транзакцию закрытого соединения
+
+    Returns:
+        int: Количество закрытых соединений.
+    """
+    with _active_lock:
+        executors = list(_active)
+    closed = 0
+    for executor in executors:
+        conn = executor.conn
+        if conn is not None and not conn.closed:
+            conn.close()
+            closed += 1
+    return closed
 
 
 def validate_connection() -> None:
     """
-    Проверяет, что можно выполнить простейший запрос к базе.
+    Проверяет, что можно выполнить простейший запрос к базе каждого шарда.
     Создаёт временное соединение с таймаутом 20 секунд
     """
-    logger.debug("Trying to connect to the database...")
-    with psycopg.connect(Config.DB_URI, connect_timeout=20) as conn:
-        logger.debug("Connection to the database established.")
-        with conn.cursor() as cur:
-            logger.debug("Executing test query...")
-            cur.execute("SELECT 1")
-            result = cur.fetchone()
-            if result is None or result[0] != 1:
-                raise RuntimeError("Database connection validation failed.")
+    for uri in shard_uris():
+        logger.debug("Trying to connect to the database...")
+        with psycopg.connect(uri, connect_timeout=20) as conn:
+            logger.debug("Connection to the database established.")
+            with conn.cursor() as cur:
+                logger.debug("Executing test query...")
+                cur.execute("SELECT 1")
+                result = cur.fetchone()
+                if result is None or result[0] != 1:
+                    raise RuntimeError("Database connection validation failed.")
     logger.debug("Database connection validated successfully")
 
 
@@ -65,8 +197,14 @@ class PostgresExecutor(DBExecutor):
                 + " invocation when the connection is already open"
             )
         logger.debug("Opening new connection from the pool")
-        self.conn = self.pool.getconn()
+        try:
+            self.conn = self.pool.getconn()
+        except (PoolTimeout, TooManyRequests) as exc:
+            metrics.inc("db.pool.timeout")
+            raise PoolExhaustedError(str(exc)) from exc
         self.cur = self.conn.cursor()  # type: ignore
+        with _active_lock:
+            _active.add(self)
 
     def close(self):
         logger.debug("Closing connection")
@@ -76,39 +214,114 @@ class PostgresExecutor(DBExecutor):
             self.pool.putconn(self.conn)
         self.conn = None
         self.cur = None
+        with _active_lock:
+            _active.discard(self)
 
 
     def commit_and_close(self):
         logger.debug("Closing connection with commit")
         if self.cur:
             self.cur.close()
-        if self.conn:
-            self.conn.commit()
-            self.pool.putconn(self.conn)
-        self.conn = None
-        self.cur = None
+        try:
+            if self.conn:
+                # При SERIALIZABLE конфликт может обнаружиться только на коммите
+                self.conn.commit()
+        except Exception as exc:
+            translated = _translate_error(exc)
+            if translated is exc:
+                raise
+            raise translated from exc
+        finally:
+            if self.conn:
+                self.pool.putconn(self.conn)
+            self.conn = None
+            self.cur = None
+            with _active_lock:
+                _active.discard(self)
 
     def rollback_and_close(self) -> None:
         logger.debug("Closing connection with rollback")
         if self.cur:
             self.cur.close()
-        if self.conn:
-            self.conn.rollback()
-            self.pool.putconn(self.conn)
-        self.conn = None
-        self.cur = None
+        try:
+            if self.conn:
+                self.conn.rollback()
+        finally:
+            # Соединение с упавшим откатом пул сам проверит и заменит
+            if self.conn:
+                self.pool.putconn(self.conn)
+            self.conn = None
+            self.cur = None
+            with _active_lock:
+                _active.discard(self)
+
+    def configure_transaction(
+        self,
+        isolation_level: IsolationLevel | None,
+        read_only: bool = False,
+        deferrable: bool = False,
+    ) -> None:
+        if not self.conn or not self.cur:
+            raise RuntimeError("Connection is not open. Use 'open()' method first.")
+        modes: list[str] = []
+        if isolation_level is not None:
+            # Значение берётся только из IsolationLevel
+            modes.append(f"ISOLATION LEVEL {isolation_level.value}")
+        if read_only:
+            modes.append("READ ONLY")
+        if deferrable:
+            modes.append("DEFERRABLE")
+        if not modes:
+            return
+        logger.debug("Setting transaction modes: %s", modes)
+        # Один запрос на все режимы
+        self.cur.execute(
+            f"SET TRANSACTION {', '.join(modes)}" # pyright: ignore[reportArgumentType]
+        )
+
+    def export_snapshot(self) -> str | None:
+        return self.execute("SELECT pg_export_snapshot()")[0][0]
+
+    def import_snapshot(self, snapshot: str) -> None:
+        if not self.conn or not self.cur:
+            raise RuntimeError("Connection is not open. Use 'open()' method first.")
+        if not _SNAPSHOT_ID_RE.match(snapshot):
+            raise ValueError(f"Invalid snapshot id: {snapshot!r}")
+        logger.debug("Importing snapshot %s", snapshot)
+        # SET не принимает параметры, идентификатор проверен выше
+        self.execute(
+            f"SET TRANSACTION SNAPSHOT '{snapshot}'" # pyright: ignore[reportArgumentType]
+        )
 
     def execute(self, query: LiteralString, **kwargs: Any) -> list[tuple[Any, ...]]:
         if not self.conn or not self.cur:
             raise RuntimeError("Connection is not open. Use 'open()' method first.")
         try:
             logger.debug("Executing query: `%s`, with param `%s`", query, kwargs)
+            started = time.perf_counter()
             self.cur.execute(query, kwargs)
-            if self.cur.description:
-                return self.cur.fetchall()
-            return []
+            rows = self.cur.fetchall() if self.cur.description else []
+            elapsed = time.perf_counter() - started
+            if Config.DB_SLOW_QUERY_MS > 0 and elapsed * 1000 >= Config.DB_SLOW_QUERY_MS:
+                from .slow_queries import get_slow_query_log
+                get_slow_query_log().report(query, kwargs, elapsed, self.pool.conninfo)
+            return rows
         except Exception as exc:
-            # Абстрагированная проверка по имени класса
-            if exc.__class__.__name__ == "UniqueViolation":
-                raise UniqueConstraintError() from exc
-            raise
+            translated = _translate_error(exc)
+            if translated is exc:
+                raise
+            raise translated from exc
+
+
+def _translate_error(exc: Exception) -> Exception:
+    """Переводит ошибку драйвера в абстрагированное от драйвера исключение из `db`.
+    Если перевод не нужен, возвращает исходное исключение
+    """
+    # Абстрагированная проверка по имени класса
+    if exc.__class__.__name__ == "UniqueViolation":
+        return UniqueConstraintError()
+    if getattr(exc, "sqlstate", None) in RETRYABLE_SQLSTATES:
+        return TransientTransactionError(str(exc))
+    if getattr(exc, "sqlstate", None) == READ_ONLY_SQLSTATE:
+        return ReadOnlyTransactionError(str(exc))
+    return exc
@@ -0,0 +1,235 @@
+"""Реализация `DBExecutor` поверх нескольких шардов postgres.
+
+`ShardedExecutor` открывает транзакцию лениво: слот `AdmissionGate` шарда и соединение
+из его пула берутся только при первом `.route()`/`.route_shard()`. Транзакция, уже направленная
+на один шард, не может перейти на другой - это `CrossShardTransactionError`,
+распределённых транзакций нет. Чтения по всем шардам (`.scatter()`) выполняются параллельно
+в отдельных соединениях, каждое занимает слот своего шарда с приоритетом транзакции,
+и не образуют согласованного снимка. Чтения держат по одному слоту и ничего не ждут,
+пока держат его, поэтому друг друга не блокируют; `.scatter()` в транзакции,
+уже направленной на шард, держит её слот, пока ждёт остальные шарды.
+Экспорт и импорт снимка (`.export_snapshot()`) работают в пределах шарда транзакции.
+"""
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, LiteralString
+
+from psycopg_pool import ConnectionPool
+
+from vpncon import metrics
+from vpncon.config import Config
+from .admission import AdmissionGate, Priority, admit, current_priority, get_admission_gate
+from .db import DBExecutor, CrossShardTransactionError, IsolationLevel
+from .postgres_db import PostgresExecutor, get_pool
+from .sharding import shard_count, shard_for
+
+
+logger = logging.getLogger(__name__)
+
+
+_scatter_pool: ThreadPoolExecutor | None = None
+_scatter_lock = threading.Lock()
+
+def _get_scatter_pool() -> ThreadPoolExecutor:
+    global _scatter_pool
+    if _scatter_pool is None:
+        with _scatter_lock:
+            if _scatter_pool is None:
+                # Больше потоков, чем соединений всех шардов, всё равно ждали бы слот
+                _scatter_pool = ThreadPoolExecutor(
+                    max_workers=Config.DB_POOL_MAX_SIZE * shard_count(),
+                    thread_name_prefix="db-scatter",
+                )
+                from vpncon.shutdown import get_coordinator
+                get_coordinator().register("db_scatter_pool", _shutdown_scatter_pool)
+    return _scatter_pool
+
+
+def _shutdown_scatter_pool(timeout: float) -> None:
+    global _scatter_pool
+    with _scatter_lock:
+        if _scatter_pool is not None:
+            # Чтения по шардам принадлежат транзакциям, которых дождётся координатор
+            _scatter_pool.shutdown(wait=False)
+        _scatter_pool = None
+
+
+def _reset_scatter_pool_after_fork() -> None:
+    global _scatter_pool, _scatter_lock
+    # Потоки пула в дочерний процесс не переезжают
+    _scatter_pool = None
+    _scatter_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_scatter_pool_after_fork)
+
+
+class ShardedExecutor(DBExecutor):
+    """Реализация `DBExecutor` поверх нескольких шардов postgres.
+    На каждый шард свой `PostgresExecutor` со своим пулом
+    """
+    def __init__(
+        self,
+        shards: int,
+        pool_factory: Callable[[int], ConnectionPool] = get_pool,
+    ) -> None:
+        self.shards = shards
+        self.pool_factory = pool_factory
+        self._executors: dict[int, PostgresExecutor] = {}
+        self._gate: AdmissionGate | None = None
+        self.is_open = False
+        self.shard: int | None = None
+        self.isolation_level: IsolationLevel | None = None
+        self.read_only = False
+        self.deferrable = False
+
+    def _executor(self, shard: int) -> PostgresExecutor:
+        executor = self._executors.get(shard)
+        if executor is None:
+            executor = self._executors[shard] = PostgresExecutor(self.pool_factory(shard))
+        return executor
+
+    @property
+    def active(self) -> PostgresExecutor | None:
+        """Экзекьютер шарда, на который направлена транзакция"""
+        return None if self.shard is None else self._executors[self.shard]
+
+    def open(self) -> None:
+        if self.is_open:
+            raise RuntimeError(
+                "Incorrect use: repeated .open() method"
+                + " invocation when the connection is already open"
+            )
+        self.is_open = True
+        self.shard = None
+        self.isolation_level = None
+        self.read_only = self.deferrable = False
+
+    def route(self, telegram_id: int) -> None:
+        self.route_shard(shard_for(telegram_id))
+
+    def route_shard(self, shard: int) -> None:
+        if not self.is_open:
+            raise RuntimeError("Connection is not open. Use 'open()' method first.")
+        if not 0 <= shard < self.shards:
+            raise ValueError(f"Unknown shard {shard}, there are {self.shards} shards")
+        if self.shard == shard:
+            return
+        if self.shard is not None:
+            metrics.inc("db.shard.cross_shard")
+            raise CrossShardTransactionError(
+                f"Transaction is bound to shard {self.shard}, cannot use shard {shard}"
+            )
+        executor = self._executor(shard)
+        gate = admit(shard)
+        try:
+            executor.open()
+        except BaseException:
+            gate.release()
+            raise
+        self._gate = gate
+        self.shard = shard
+        logger.debug("Transaction routed to shard %d", shard)
+        if self.isolation_level is not None or self.read_only:
+            executor.configure_transaction(self.isolation_level, self.read_only, self.deferrable)
+
+    def _finish(self, finish: Callable[[PostgresExecutor], None]) -> None:
+        active = self.active
+        gate, self._gate = self._gate, None
+        self.is_open = False
+        self.shard = None
+        self.isolation_level = None
+        self.read_only = self.deferrable = False
+        try:
+            if active is not None:
+                finish(active)
+        finally:
+            if gate is not None:
+                gate.release()
+
+    def close(self) -> None:
+        self._finish(PostgresExecutor.close)
+
+    def commit_and_close(self) -> None:
+        self._finish(PostgresExecutor.commit_and_close)
+
+    def rollback_and_close(self) -> None:
+        self._finish(PostgresExecutor.rollback_and_close)
+
+    def configure_transaction(
+        self,
+        isolation_level: IsolationLevel | None,
+        read_only: bool = False,
+        deferrable: bool = False,
+    ) -> None:
+        if not self.is_open:
+            raise RuntimeError("Connection is not open. Use 'open()' method first.")
+        active = self.active
+        if active is not None:
+            active.configure_transaction(isolation_level, read_only, deferrable)
+        else:
+            # Применится при выборе шарда, до первого запроса
+            self.isolation_level = isolation_level
+            self.read_only = read_only
+            self.deferrable = deferrable
+
+    def _routed(self) -> PostgresExecutor:
+        """Экзекьютер шарда транзакции. С одним шардом направляет транзакцию на него."""
+        if not self.is_open:
+            raise RuntimeError("Connection is not open. Use 'open()' method first.")
+        if self.shard is None:
+            if self.shards > 1:
+                raise RuntimeError(
+                    "Transaction is not routed to a shard. Use 'route()' or 'scatter()'"
+                )
+            self.route_shard(0)
+        return self._executors[self.shard]  # type: ignore[index]
+
+    def export_snapshot(self) -> str | None:
+        return self._routed().export_snapshot()
+
+    def import_snapshot(self, snapshot: str) -> None:
+        self._routed().import_snapshot(snapshot)
+
+    def execute(self, query: LiteralString, **kwargs: Any) -> list[tuple[Any, ...]]:
+        return self._routed().execute(query, **kwargs)
+
+    def _execute_on(
+        self, shard: int, priority: Priority, query: LiteralString, kwargs: dict[str, Any]
+    ):
+        """Выполняет запрос в отдельной короткой транзакции шарда `shard`."""
+        gate = get_admission_gate(shard)
+        gate.acquire(priority)
+        try:
+            executor = PostgresExecutor(self.pool_factory(shard))
+            executor.open()
+            try:
+                result = executor.execute(query, **kwargs)
+                executor.commit_and_close()
+            except Exception:
+                executor.rollback_and_close()
+                raise
+            return result
+        finally:
+            gate.release()
+
+    def scatter(self, query: LiteralString, **kwargs: Any) -> list[tuple[Any, ...]]:
+        if not self.is_open:
+            raise RuntimeError("Connection is not open. Use 'open()' method first.")
+        metrics.inc("db.shard.scatter")
+        pool = _get_scatter_pool()
+        # Потоки пула не наследуют контекст: приоритет передаём явно
+        priority = current_priority()
+        futures = {
+            shard: pool.submit(self._execute_on, shard, priority, query, kwargs)
+            for shard in range(self.shards) if shard != self.shard
+        }
+        # Шард текущей транзакции читается в ней же, чтобы видеть её изменения
+        result: list[tuple[Any, ...]] = []
+        for shard in range(self.shards):
+            if shard == self.shard:
+                result.extend(self._executors[shard].execute(query, **kwargs))
+            else:
+                result.extend(futures[shard].result())
+        return result
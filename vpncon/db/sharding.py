@@ -0,0 +1,35 @@
+"""Выбор шарда пользовательских данных.
+
+Шард пользователя выбирается jump consistent hash от `telegram_id` по числу шардов
+из `DB_SHARDS`. Все таблицы с данными пользователя (пользователи, пиры, трафик)
+лежат на его шарде, поэтому любая транзакция над одним пользователем - одношардовая.
+Модуль не зависит от драйвера БД, экзекьютер шардов - в `sharded_db`
+"""
+from vpncon.config import Config
+
+
+_MASK_64 = 0xFFFFFFFFFFFFFFFF
+
+def jump_hash(key: int, buckets: int) -> int:
+    """Jump consistent hash (Lamping, Veach): номер корзины из `buckets` для ключа `key`.
+    При добавлении корзины переезжает только 1/buckets ключей
+    """
+    if buckets <= 0:
+        raise ValueError("buckets must be positive")
+    key &= _MASK_64
+    bucket, j = -1, 0
+    while j < buckets:
+        bucket = j
+        key = (key * 2862933555777941757 + 1) & _MASK_64
+        j = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+def shard_count() -> int:
+    """Число шардов. Без шардирования - 1"""
+    return max(len(Config.DB_SHARD_URIS), 1)
+
+
+def shard_for(telegram_id: int) -> int:
+    """Номер шарда пользователя `telegram_id`"""
+    return jump_hash(telegram_id, shard_count())
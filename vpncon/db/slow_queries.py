@@ -0,0 +1,254 @@
+"""Захват планов медленных запросов.
+
+`PostgresExecutor.execute()` сообщает о запросах дольше `DB_SLOW_QUERY_MS` в `SlowQueryLog`.
+Для доли `DB_SLOW_QUERY_SAMPLE_RATE` из них, но не чаще раза в `DB_SLOW_QUERY_EXPLAIN_INTERVAL`
+секунд для одного запроса, фоновый поток снимает план на отдельном соединении (не из пула):
+- чтение (`SELECT` без блокировки строк) - `EXPLAIN (ANALYZE, BUFFERS)`, запрос выполняется заново
+- изменение данных - только `EXPLAIN`, без выполнения
+Снятие плана идёт в транзакции, которая откатывается, с `lock_timeout` и `statement_timeout`.
+
+Планы хранятся в кольцевом буфере на `DB_SLOW_QUERY_BUFFER_SIZE` записей вместе с отпечатком
+запроса и формой параметров (имена и типы, без значений). Буфер отдаёт `/admin/slow-queries`.
+Медленные запросы без плана видны в метриках `db.slow_queries` и `db.slow_query_seconds`.
+
+Без `auto_explain` на сервере и без доступа к его логам.
+"""
+import hashlib
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, LiteralString
+
+from vpncon import metrics
+from vpncon.config import Config
+
+
+logger = logging.getLogger(__name__)
+
+
+_WHITESPACE_RE = re.compile(r"\s+")
+# Чтение без блокировок строк можно выполнить повторно
+_READ_ONLY_RE = re.compile(r"^\s*(SELECT|WITH)\b", re.IGNORECASE)
+_WRITE_RE = re.compile(
+    r"\b(INSERT|UPDATE|DELETE|MERGE|FOR\s+(NO\s+KEY\s+)?UPDATE|FOR\s+(KEY\s+)?SHARE)\b",
+    re.IGNORECASE,
+)
+
+
+def normalize_query(query: str) -> str:
+    """Текст запроса без лишних пробелов. Запросы параметризованы, поэтому это и есть отпечаток"""
+    return _WHITESPACE_RE.sub(" ", query).strip()
+
+
+def query_fingerprint(query: str) -> str:
+    """Короткий отпечаток запроса для группировки записей."""
+    return hashlib.sha1(normalize_query(query).encode()).hexdigest()[:16]
+
+
+def params_shape(params: dict[str, Any]) -> dict[str, str]:
+    """Имена и типы параметров, без значений."""
+    shape: dict[str, str] = {}
+    for name, value in params.items():
+        kind = type(value).__name__
+        if isinstance(value, (list, tuple)):
+            kind = f"{kind}[{len(value)}]"
+        shape[name] = kind
+    return shape
+
+
+def is_read_only(query: str) -> bool:
+    return bool(_READ_ONLY_RE.match(query)) and not _WRITE_RE.search(query)
+
+
+@dataclass(frozen=True)
+class SlowQuery:
+    """Медленный запрос с планом."""
+    fingerprint: str
+    query: str
+    params_shape: dict[str, str]
+    duration_ms: float
+    captured_at: datetime
+    analyzed: bool
+    plan: Any
+    error: str | None = None
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            'fingerprint': self.fingerprint,
+            'query': self.query,
+            'params_shape': self.params_shape,
+            'duration_ms': round(self.duration_ms, 3),
+            'captured_at': self.captured_at.isoformat(),
+            'analyzed': self.analyzed,
+            'plan': self.plan,
+            'error': self.error,
+        }
+
+
+@dataclass(frozen=True)
+class _ExplainTask:
+    conninfo: str
+    query: str
+    params: dict[str, Any]
+    duration: float
+
+
+class SlowQueryLog:
+    """Кольцевой буфер планов медленных запросов и фоновый поток, который их снимает.
+    Потокобезопасный. Один экземпляр на процесс, см. `get_slow_query_log()`
+    """
+    def __init__(
+        self,
+        buffer_size: int,
+        sample_rate: float,
+        explain_interval: float,
+        queue_size: int = 16,
+    ) -> None:
+        self.sample_rate = sample_rate
+        self.explain_interval = explain_interval
+        self._entries: deque[SlowQuery] = deque(maxlen=buffer_size)
+        self._last_explain: dict[str, float] = {}
+        self._lock = threading.Lock()
+        # Ограниченная очередь: при всплеске медленных запросов лишние планы не снимаются
+        self._tasks: queue.Queue[_ExplainTask] = queue.Queue(maxsize=queue_size)
+        self._thread: threading.Thread | None = None
+        self._connections: dict[str, Any] = {}
+
+    def report(self, query: str, params: dict[str, Any], duration: float, conninfo: str) -> None:
+        """Сообщает о медленном запросе. Не блокирует вызывающий поток."""
+        metrics.inc("db.slow_queries")
+        metrics.observe("db.slow_query_seconds", duration)
+        logger.warning(
+            "Slow query %.1fms: %s", duration * 1000, normalize_query(query)[:200]
+        )
+        if random.random() >= self.sample_rate:
+            return
+        fingerprint = query_fingerprint(query)
+        now = time.monotonic()
+        with self._lock:
+            last = self._last_explain.get(fingerprint)
+            if last is not None and now - last < self.explain_interval:
+                return
+            self._last_explain[fingerprint] = now
+            if len(self._last_explain) > 4 * (self._entries.maxlen or 1):
+                # Отпечатки, для которых интервал уже прошёл, можно забыть
+                self._last_explain = {
+                    key: at for key, at in self._last_explain.items()
+                    if now - at < self.explain_interval
+                }
+            self._ensure_thread()
+        try:
+            self._tasks.put_nowait(_ExplainTask(conninfo, query, dict(params), duration))
+        except queue.Full:
+            metrics.inc("db.slow_queries.dropped")
+
+    def entries(self, fingerprint: str | None = None) -> list[SlowQuery]:
+        """Записи буфера от новых к старым."""
+        with self._lock:
+            entries = list(reversed(self._entries))
+        if fingerprint is not None:
+            entries = [entry for entry in entries if entry.fingerprint == fingerprint]
+        return entries
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._last_explain.clear()
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="slow-query-explain", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            task = self._tasks.get()
+            try:
+                self._append(self._explain(task))
+            except Exception:
+                logger.exception("Failed to capture slow query plan")
+
+    def _append(self, entry: SlowQuery) -> None:
+        with self._lock:
+            self._entries.append(entry)
+
+    def _connect(self, conninfo: str) -> Any:
+        import psycopg
+
+        conn = self._connections.get(conninfo)
+        if conn is None or conn.closed:
+            conn = self._connections[conninfo] = psycopg.connect(conninfo, connect_timeout=5)
+            conn.execute(
+                "SELECT set_config('lock_timeout', %s, false),"
+                " set_config('statement_timeout', %s, false)",
+                (
+                    str(Config.DB_SLOW_QUERY_LOCK_TIMEOUT_MS),
+                    str(Config.DB_SLOW_QUERY_EXPLAIN_TIMEOUT_MS),
+                ),
+            )
+            conn.commit()
+        return conn
+
+    def _explain(self, task: _ExplainTask) -> SlowQuery:
+        analyzed = is_read_only(task.query)
+        options: LiteralString = "ANALYZE, BUFFERS, FORMAT JSON" if analyzed else "FORMAT JSON"
+        plan: Any = None
+        error: str | None = None
+        conn = None
+        try:
+            conn = self._connect(task.conninfo)
+            try:
+                # Запрос из `PostgresExecutor.execute()` - уже LiteralString
+                result = conn.execute(
+                    f"EXPLAIN ({options}) {task.query}", task.params  # pyright: ignore[reportArgumentType]
+                ).fetchone()
+                plan = result[0] if result else None
+            finally:
+                conn.rollback()
+        except Exception as exc:
+            error = f"{exc.__class__.__name__}: {exc}"
+            logger.warning("Cannot explain slow query: %s", error)
+            if conn is not None and conn.broken:
+                self._connections.pop(task.conninfo, None)
+        return SlowQuery(
+            fingerprint=query_fingerprint(task.query),
+            query=normalize_query(task.query),
+            params_shape=params_shape(task.params),
+            duration_ms=task.duration * 1000,
+            captured_at=datetime.now(timezone.utc),
+            analyzed=analyzed,
+            plan=plan,
+            error=error,
+        )
+
+
+_log: SlowQueryLog | None = None
+_log_lock = threading.Lock()
+
+def get_slow_query_log() -> SlowQueryLog:
+    """Возвращает `SlowQueryLog` процесса. Создаёт его при первом обращении."""
+    global _log
+    if _log is None:
+        with _log_lock:
+            if _log is None:
+                _log = SlowQueryLog(
+                    buffer_size=Config.DB_SLOW_QUERY_BUFFER_SIZE,
+                    sample_rate=Config.DB_SLOW_QUERY_SAMPLE_RATE,
+                    explain_interval=Config.DB_SLOW_QUERY_EXPLAIN_INTERVAL,
+                )
+    return _log
+
+
+def _reset_after_fork() -> None:
+    # Поток и соединения родителя в дочернем процессе не работают
+    global _log
+    _log = None
+
+os.register_at_fork(after_in_child=_reset_after_fork)
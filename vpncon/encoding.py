@@ -0,0 +1,168 @@
+"""Кодирование ответов API.
+
+Сериализует `DataModel` сразу в байты, минуя `dataclasses.asdict` и JSON провайдер Flask:
+- JSON через `orjson`, который обходит dataclass, `datetime` и `Enum` в C.
+  Без `orjson` используется стандартный `json` с заранее собранным для класса модели геттером полей
+- MessagePack (`Accept: application/msgpack`), если установлен `msgpack`
+- Списки кодируются пачками по `batch_size` и отдаются потоком, не собирая весь ответ в памяти
+
+`datetime` кодируется строкой ISO 8601, как описано в `openapi.yml`.
+
+Пример использования:
+```python
+from vpncon.encoding import encode_response, encode_page
+
+return encode_response(user)
+return encode_page("users", users, next_after=users[-1].telegram_id)
+```
+"""
+import json
+import operator
+from datetime import date, datetime
+from enum import Enum
+from functools import cache
+from typing import Any, Callable, Iterable, Iterator, Sequence
+
+from flask import Response, request
+
+from vpncon.db import DataModel
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - зависит от окружения
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - зависит от окружения
+    msgpack = None
+
+
+JSON_MIMETYPE = "application/json"
+MSGPACK_MIMETYPE = "application/msgpack"
+
+# Моделей в одном куске потокового ответа
+DEFAULT_BATCH_SIZE = 500
+
+
+@cache
+def _model_getter(cls: type) -> Callable[[Any], tuple[Any, ...]]:
+    """Собирает для класса модели функцию, возвращающую значения полей кортежем."""
+    fields = cls.get_model_fields()
+    getter = operator.attrgetter(*fields)
+    if len(fields) == 1:
+        return lambda obj: (getter(obj),)
+    return getter
+
+
+@cache
+def _model_keys(cls: type) -> tuple[str, ...]:
+    return tuple(cls.get_model_fields())
+
+
+def _default(obj: Any) -> Any:
+    """Приводит значения, которые не знает кодировщик, к простым типам."""
+    if isinstance(obj, DataModel):
+        cls = type(obj)
+        return dict(zip(_model_keys(cls), _model_getter(cls)(obj)))
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, Enum):
+        return obj.value
+    raise TypeError(f"Object of type {type(obj).__name__} is not serializable")
+
+
+def dumps_json(obj: Any) -> bytes:
+    """Кодирует объект в компактный JSON."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default)
+    return json.dumps(
+        obj, default=_default, ensure_ascii=False, separators=(",", ":")
+    ).encode()
+
+
+def dumps_msgpack(obj: Any) -> bytes:
+    """Кодирует объект в MessagePack."""
+    if msgpack is None:
+        raise RuntimeError("msgpack is not installed")
+    return msgpack.packb(obj, default=_default, use_bin_type=True)
+
+
+def available_mimetypes() -> list[str]:
+    """Форматы ответа, которые может отдать сервер. Первый - формат по умолчанию."""
+    if msgpack is None:
+        return [JSON_MIMETYPE]
+    return [JSON_MIMETYPE, MSGPACK_MIMETYPE]
+
+
+def negotiate_mimetype() -> str:
+    """Выбирает формат ответа по заголовку `Accept` текущего запроса.
+    Если подходящего формата нет, отвечаем JSON
+    """
+    mimetypes = available_mimetypes()
+    return request.accept_mimetypes.best_match(mimetypes) or mimetypes[0]
+
+
+def encode_response(obj: Any, status: int = 200) -> Response:
+    """Ответ с объектом в формате, запрошенном клиентом."""
+    mimetype = negotiate_mimetype()
+    dumps = dumps_msgpack if mimetype == MSGPACK_MIMETYPE else dumps_json
+    return Response(dumps(obj), status=status, mimetype=mimetype)
+
+
+def _batches(items: Sequence[Any], batch_size: int) -> Iterator[Sequence[Any]]:
+    for start in range(0, len(items), batch_size):
+        yield items[start:start + batch_size]
+
+
+def _iter_json_page(
+    key: str, items: Sequence[Any], extra: dict[str, Any], batch_size: int
+) -> Iterator[bytes]:
+    yield b'{' + dumps_json(key) + b':['
+    for i, batch in enumerate(_batches(items, batch_size)):
+        # Кодируем пачку одним вызовом и снимаем внешние скобки массива
+        chunk = dumps_json(batch)[1:-1]
+        yield chunk if i == 0 else b',' + chunk
+    yield b']'
+    for name, value in extra.items():
+        yield b',' + dumps_json(name) + b':' + dumps_json(value)
+    yield b'}'
+
+
+def _iter_msgpack_page(
+    key: str, items: Sequence[Any], extra: dict[str, Any], batch_size: int
+) -> Iterator[bytes]:
+    assert msgpack is not None
+    packer = msgpack.Packer(default=_default, use_bin_type=True)
+    yield packer.pack_map_header(1 + len(extra)) + packer.pack(key)
+    yield packer.pack_array_header(len(items))
+    for batch in _batches(items, batch_size):
+        yield b''.join(packer.pack(item) for item in batch)
+    for name, value in extra.items():
+        yield packer.pack(name) + packer.pack(value)
+
+
+def iter_page(
+    mimetype: str,
+    key: str,
+    items: Sequence[Any],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    **extra: Any,
+) -> Iterable[bytes]:
+    """Кодирует страницу `{key: [...items], **extra}` кусками по `batch_size` моделей."""
+    if mimetype == MSGPACK_MIMETYPE:
+        return _iter_msgpack_page(key, items, extra, batch_size)
+    return _iter_json_page(key, items, extra, batch_size)
+
+
+def encode_page(
+    key: str,
+    items: Sequence[Any],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    **extra: Any,
+) -> Response:
+    """Потоковый ответ со страницей списка в формате, запрошенном клиентом.
+    Элементы должны быть уже загружены: генератор работает после выхода из транзакции
+    """
+    mimetype = negotiate_mimetype()
+    return Response(iter_page(mimetype, key, items, batch_size, **extra), mimetype=mimetype)
@@ -19,3 +19,8 @@ class EntityNotExistsException(EntityException):
 class EntityAlreadyExistsException(EntityException):
     """Сущность уже существует или нарушено ограничение уникальности."""
     pass
+
+
+class AddressPoolExhaustedException(EntityException):
+    """В пуле не осталось свободных адресов."""
+    pass
@@ -0,0 +1,84 @@
+"""Пробы для оркестратора.
+
+- `/healthz` - liveness: процесс жив и обслуживает запросы. БД не трогает
+- `/readyz` - readiness: процесс не останавливается, фоновая инициализация завершена,
+  пул отдаёт соединения и версия схемы в `schema_migrations` не меньше последней миграции.
+  Результат проверки БД кэшируется на `READINESS_CACHE_SECONDS`,
+  чтобы частые пробы не занимали соединения пула
+"""
+import logging
+import threading
+import time
+from functools import cache
+
+from flask import Blueprint, jsonify
+
+from vpncon.bootstrap import get_bootstrap
+from vpncon.config import Config
+from vpncon.db import auto_transaction, get_db_executor, Priority
+from vpncon.shutdown import get_coordinator
+
+
+logger = logging.getLogger(__name__)
+
+
+health_bp = Blueprint('health', __name__)
+
+
+@cache
+def _expected_schema_version() -> int:
+    from vpncon.db.db_migrations import DbMigrator, PostgresMigrationExecutor
+    return DbMigrator(PostgresMigrationExecutor).latest_version()
+
+
+@auto_transaction(priority=Priority.HIGH)
+def _current_schema_version() -> int | None:
+    """Версия схемы. При шардировании - наименьшая по шардам"""
+    result = get_db_executor().scatter("SELECT max(version) FROM schema_migrations")
+    versions = [row[0] for row in result]
+    if not versions or None in versions:
+        return None
+    return min(versions)
+
+
+_cached: tuple[float, dict[str, object]] | None = None
+_cache_lock = threading.Lock()
+
+def check_db() -> dict[str, object]:
+    """Проверяет пул и версию схемы. Результат кэшируется на `READINESS_CACHE_SECONDS`."""
+    global _cached
+    with _cache_lock:
+        if _cached is not None and time.monotonic() - _cached[0] < Config.READINESS_CACHE_SECONDS:
+            return _cached[1]
+
+        expected = _expected_schema_version()
+        result: dict[str, object] = {'expected_schema_version': expected}
+        try:
+            current = _current_schema_version()
+        except Exception as exc:
+            logger.warning("Readiness check failed: %s", exc)
+            result.update(pool=False, ready=False, error=f"{exc.__class__.__name__}: {exc}")
+        else:
+            ready = current is not None and current >= expected
+            result.update(pool=True, schema_version=current, ready=ready)
+        _cached = (time.monotonic(), result)
+        return result
+
+
+@health_bp.route('/healthz', methods=['GET'])
+def healthz():
+    return jsonify({'status': 'ok'})
+
+
+@health_bp.route('/readyz', methods=['GET'])
+def readyz():
+    if get_coordinator().draining.is_set():
+        return jsonify({'ready': False, 'state': 'draining'}), 503
+    bootstrap = get_bootstrap()
+    if bootstrap is not None and not bootstrap.ready.is_set():
+        return jsonify({'ready': False, **bootstrap.status()}), 503
+    if Config.DB_BACKEND == "memory":
+        return jsonify({'ready': True})
+
+    result = check_db()
+    return jsonify(result), 200 if result['ready'] else 503
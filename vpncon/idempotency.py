@@ -0,0 +1,261 @@
+"""Идемпотентные запросы на запись по заголовку `Idempotency-Key`.
+
+Повтор запроса с тем же ключом не выполняет его снова, а получает сохранённый ответ
+(с заголовком `Idempotent-Replayed: true`). Ключ с другим запросом (метод, путь, тело) - `422`.
+
+Ключ и ответ пишутся в `idempotency_keys` в транзакции самого запроса, на шарде пользователя:
+- ответ сохраняется, только если изменения запроса закоммичены, и наоборот
+- параллельный дубль ждёт на уникальном индексе ключа, пока первая попытка не закончится,
+  и затем получает её ответ. Если первая попытка откатилась (исключение), дубль выполняет
+  запрос сам. Серия повторов превращается в одну транзакцию с изменениями
+- ответы хранятся `IDEMPOTENCY_TTL` секунд, просроченные удаляет `IdempotencyKeyPurger`
+
+Декоратор ставится под `auto_transaction`:
+```python
+@users_bp.route('/', methods=['POST'])
+@auto_transaction(retries=3)
+@idempotent(shard_by="telegram_id")
+def api_create_user():
+    ...
+```
+"""
+import functools
+import hashlib
+import logging
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Callable, LiteralString, ParamSpec
+
+from flask import Response, jsonify, make_response, request
+from flask.typing import ResponseReturnValue
+
+from vpncon import metrics
+from vpncon.config import Config
+from vpncon.db import auto_transaction, get_db_executor, shard_count
+
+
+logger = logging.getLogger(__name__)
+
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+
+# Просроченный, но ещё не удалённый ключ занимается заново
+CLAIM_KEY_SQL: LiteralString = """
+    INSERT INTO idempotency_keys (key, fingerprint, created_at, expires_at)
+    VALUES (%(key)s, %(fingerprint)s, %(now)s, %(expires_at)s)
+    ON CONFLICT (key) DO UPDATE
+        SET fingerprint = EXCLUDED.fingerprint,
+            status = NULL,
+            content_type = NULL,
+            body = NULL,
+            created_at = EXCLUDED.created_at,
+            expires_at = EXCLUDED.expires_at
+        WHERE idempotency_keys.expires_at <= EXCLUDED.created_at
+    RETURNING key
+"""
+
+GET_RESPONSE_SQL: LiteralString = """
+    SELECT fingerprint, status, content_type, body
+    FROM idempotency_keys
+    WHERE key = %(key)s
+"""
+
+STORE_RESPONSE_SQL: LiteralString = """
+    UPDATE idempotency_keys
+    SET status = %(status)s, content_type = %(content_type)s, body = %(body)s
+    WHERE key = %(key)s
+"""
+
+PURGE_EXPIRED_SQL: LiteralString = """
+    DELETE FROM idempotency_keys
+    WHERE key IN (
+        SELECT key FROM idempotency_keys
+        WHERE expires_at <= %(now)s
+        ORDER BY expires_at
+        LIMIT %(batch_size)s
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING key
+"""
+
+
+@dataclass(frozen=True)
+class StoredResponse:
+    """Сохранённый ответ на запрос с ключом идемпотентности."""
+    fingerprint: str
+    status: int
+    content_type: str
+    body: bytes
+
+
+def request_fingerprint() -> str:
+    """Отпечаток текущего запроса: повтор с тем же ключом должен совпадать с оригиналом."""
+    digest = hashlib.sha256()
+    for part in (request.method, request.full_path):
+        digest.update(part.encode())
+        digest.update(b"\0")
+    digest.update(request.get_data(cache=True))
+    return digest.hexdigest()
+
+
+@auto_transaction
+def claim_key(key: str, fingerprint: str) -> StoredResponse | None:
+    """Занимает ключ в текущей транзакции. Если ключ занят транзакцией, которая ещё идёт,
+    ждёт её окончания.
+
+    Returns:
+        StoredResponse | None: Ответ предыдущего запроса с этим ключом
+            или None, если ключ занят текущей транзакцией.
+    """
+    executor = get_db_executor()
+    now = datetime.now(timezone.utc)
+    claimed = executor.execute(
+        CLAIM_KEY_SQL, key=key, fingerprint=fingerprint, now=now,
+        expires_at=now + timedelta(seconds=Config.IDEMPOTENCY_TTL),
+    )
+    if claimed:
+        return None
+    # Отдельный запрос: его снимок уже видит строку транзакции, которую мы ждали
+    result = executor.execute(GET_RESPONSE_SQL, key=key)
+    fingerprint, status, content_type, body = result[0]
+    return StoredResponse(fingerprint, status, content_type, bytes(body))
+
+
+@auto_transaction
+def store_response(key: str, response: Response) -> None:
+    """Сохраняет ответ на запрос с ключом `key`, занятым в текущей транзакции."""
+    get_db_executor().execute(
+        STORE_RESPONSE_SQL, key=key, status=response.status_code,
+        content_type=response.content_type, body=response.get_data(),
+    )
+
+
+def _route(shard_by: str | None) -> None:
+    """Направляет транзакцию на шард пользователя из поля `shard_by` тела запроса."""
+    executor = get_db_executor()
+    body = request.get_json(silent=True)
+    telegram_id = body.get(shard_by) if shard_by and isinstance(body, dict) else None
+    if isinstance(telegram_id, int) and not isinstance(telegram_id, bool):
+        executor.route(telegram_id)
+    else:
+        # Запрос без пользователя всё равно не пройдёт проверку, ключ - на первом шарде
+        executor.route_shard(0)
+
+
+P = ParamSpec("P")
+
+def idempotent(
+    shard_by: str | None = None,
+) -> Callable[[Callable[P, ResponseReturnValue]], Callable[P, ResponseReturnValue]]:
+    """Делает эндпоинт идемпотентным для запросов с заголовком `Idempotency-Key`.
+    Запросы без заголовка выполняются как обычно.
+
+    Args:
+        shard_by (str | None): Поле JSON тела с telegram_id: ключ хранится на шарде
+            пользователя, чтобы попасть в одну транзакцию с изменениями запроса.
+    """
+    def decorator(func: Callable[P, ResponseReturnValue]) -> Callable[P, ResponseReturnValue]:
+        @functools.wraps(func)
+        def wrapper(*args: P.args, **kwargs: P.kwargs) -> ResponseReturnValue:
+            key = request.headers.get(IDEMPOTENCY_HEADER)
+            if key is None:
+                return func(*args, **kwargs)
+            if not 0 < len(key) <= MAX_KEY_LENGTH:
+                return jsonify(
+                    {'error': f'{IDEMPOTENCY_HEADER} must be 1 to {MAX_KEY_LENGTH} characters'}
+                ), 400
+
+            _route(shard_by)
+            fingerprint = request_fingerprint()
+            stored = claim_key(key, fingerprint)
+            if stored is not None:
+                if stored.fingerprint != fingerprint:
+                    metrics.inc("api.idempotency.mismatch")
+                    return jsonify(
+                        {'error': f'{IDEMPOTENCY_HEADER} was used with a different request'}
+                    ), 422
+                metrics.inc("api.idempotency.replayed")
+                logger.debug("Replaying response for idempotency key %s", key)
+                response = Response(
+                    stored.body, status=stored.status, content_type=stored.content_type
+                )
+                response.headers[REPLAYED_HEADER] = 'true'
+                return response
+
+            response = make_response(func(*args, **kwargs))
+            store_response(key, response)
+            return response
+
+        return wrapper
+    return decorator
+
+
+@auto_transaction(retries=3)
+def purge_expired_batch(batch_size: int, shard: int = 0) -> int:
+    """Удаляет пачку просроченных ключей шарда `shard`.
+
+    Returns:
+        int: Количество удалённых ключей.
+    """
+    executor = get_db_executor()
+    executor.route_shard(shard)
+    result = executor.execute(
+        PURGE_EXPIRED_SQL, now=datetime.now(timezone.utc), batch_size=batch_size
+    )
+    return len(result)
+
+
+class IdempotencyKeyPurger:
+    """Фоновый поток, удаляющий просроченные ключи идемпотентности.
+    Безопасен в нескольких воркерах: пачки разбираются через `SKIP LOCKED`
+    """
+    def __init__(self, interval: float | None = None, batch_size: int | None = None) -> None:
+        self.interval = interval or Config.IDEMPOTENCY_PURGE_INTERVAL
+        self.batch_size = batch_size or Config.IDEMPOTENCY_PURGE_BATCH_SIZE
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def run_pass(self) -> int:
+        """Удаляет все просроченные ключи.
+
+        Returns:
+            int: Количество удалённых ключей.
+        """
+        total = 0
+        for shard in range(shard_count()):
+            while not self._stop.is_set():
+                purged = purge_expired_batch(self.batch_size, shard)
+                total += purged
+                if purged < self.batch_size:
+                    break
+        if total:
+            metrics.inc("api.idempotency.purged", total)
+            logger.info("Purged %d expired idempotency keys", total)
+        return total
+
+    def run_forever(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.run_pass()
+            except Exception:
+                logger.exception("Idempotency keys purge failed")
+            self._stop.wait(self.interval)
+
+    def start(self) -> None:
+        """Запускает очистку в фоновом потоке."""
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self.run_forever, name="idempotency-purger", daemon=True
+        )
+        self._thread.start()
+        from vpncon.shutdown import get_coordinator
+        get_coordinator().register("idempotency_purger", self.stop)
+
+    def stop(self, timeout: float | None = None) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
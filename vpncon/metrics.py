@@ -0,0 +1,81 @@
+"""Простейшие внутрипроцессные метрики.
+
+Счётчики и сводки (count/sum/max) хранятся в памяти процесса и потокобезопасны.
+Предназначены для диагностики и нагрузочных прогонов, а не для долговременного хранения.
+
+Пример использования:
+```python
+from vpncon import metrics
+
+metrics.inc("db.admission.rejected")
+metrics.observe("db.pool.wait_seconds", 0.012)
+metrics.snapshot()
+```
+"""
+import threading
+from dataclasses import dataclass
+from typing import Any
+
+
+@dataclass
+class Summary:
+    """Сводка по наблюдаемой величине."""
+    count: int = 0
+    total: float = 0.0
+    max: float = 0.0
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def as_dict(self) -> dict[str, float]:
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "avg": self.total / self.count if self.count else 0.0,
+            "max": self.max,
+        }
+
+
+_lock = threading.Lock()
+_counters: dict[str, int] = {}
+_summaries: dict[str, Summary] = {}
+
+
+def inc(name: str, value: int = 1) -> None:
+    """Увеличивает счётчик `name` на `value`."""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def observe(name: str, value: float) -> None:
+    """Добавляет наблюдение `value` в сводку `name`."""
+    with _lock:
+        summary = _summaries.get(name)
+        if summary is None:
+            summary = _summaries[name] = Summary()
+        summary.observe(value)
+
+
+def get(name: str) -> int:
+    """Возвращает текущее значение счётчика `name`."""
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def snapshot() -> dict[str, Any]:
+    """Возвращает копию всех метрик процесса."""
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "summaries": {name: s.as_dict() for name, s in _summaries.items()},
+        }
+
+
+def reset() -> None:
+    """Обнуляет все метрики. Используется в тестах и нагрузочных прогонах."""
+    with _lock:
+        _counters.clear()
+        _summaries.clear()
@@ -0,0 +1,12 @@
+from flask import Blueprint
+
+from .service import PeerService, PeerServiceCRUD
+from .provisioning import ProvisioningService, ProvisioningServiceCRUD
+
+_peer_service = PeerServiceCRUD()
+peer_service: PeerService = _peer_service
+provisioning_service: ProvisioningService = ProvisioningServiceCRUD(_peer_service)
+
+peers_bp = Blueprint('peers_api', __name__, url_prefix='/peers')
+
+from .api import *
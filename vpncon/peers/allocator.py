@@ -0,0 +1,298 @@
+"""Выдача адресов пирам из пулов IPv4/IPv6.
+
+Пул разбит на куски по `CHUNK_SIZE` адресов, занятость каждого куска хранится битовой картой
+в `address_pool_chunks` (бит `i` - байт `i // 8`, бит `i % 8` начиная с младшего,
+так же как в `get_bit`/`set_bit` postgres).
+- Поиск куска со свободным адресом идёт по частичному индексу `free_count > 0`,
+  поиск свободного бита - по битовой карте фиксированного размера.
+  Поэтому выдача адреса не зависит от количества уже выданных адресов.
+- Пачка адресов выдаётся одним UPDATE по всем затронутым кускам
+- Куски создаются лениво, когда свободных не осталось.
+- `FOR UPDATE SKIP LOCKED` разводит параллельные транзакции по разным кускам.
+- Освобождение адреса выполняет триггер на удаление из `peers` (см. `M_0003_create_peers`)
+- При шардировании у каждого шарда свой пул подсети, а куски распределены между шардами
+  через один: шарду `s` из `n` достаются куски `s`, `s + n`, `s + 2n`... Поэтому адреса,
+  выданные на разных шардах, не пересекаются, а освобождение остаётся локальным для шарда
+"""
+import ipaddress
+import logging
+from typing import LiteralString
+
+from vpncon.db import auto_transaction, get_db_executor, shard_count
+from vpncon.exceptions import AddressPoolExhaustedException
+from .model import AddressPool
+
+
+logger = logging.getLogger(__name__)
+
+
+# Адресов в одном куске. Битовая карта куска - 128 байт
+CHUNK_SIZE = 1024
+# Ограничение на размер пула, чтобы смещения адресов влезали в BIGINT (знаковый, до 2^63 - 1)
+MAX_HOST_BITS = 63
+
+
+def reserved_offsets(network: ipaddress.IPv4Network | ipaddress.IPv6Network) -> set[int]:
+    """Смещения адресов пула, которые не выдаются пирам:
+    адрес сети, адрес сервера (первый адрес) и broadcast для IPv4
+    """
+    if network.num_addresses <= 2:
+        return set()
+    reserved = {0, 1}
+    if network.version == 4:
+        reserved.add(network.num_addresses - 1)
+    return reserved
+
+
+def build_chunk_bitmap(
+    chunk_no: int, chunk_size: int, pool_size: int, reserved: set[int]
+) -> tuple[bytes, int]:
+    """Строит битовую карту нового куска.
+    Занятыми помечаются зарезервированные адреса и хвост за пределами пула.
+
+    Returns:
+        tuple[bytes, int]: Битовая карта и количество свободных адресов в куске.
+    """
+    start = chunk_no * chunk_size
+    count = min(chunk_size, pool_size - start)
+    full = (1 << chunk_size) - 1
+    used = full ^ ((1 << count) - 1)
+    for offset in reserved:
+        if start <= offset < start + count:
+            used |= 1 << (offset - start)
+    free_count = chunk_size - used.bit_count()
+    return used.to_bytes(chunk_size // 8, "little"), free_count
+
+
+def find_free_bit(bitmap: bytes) -> int | None:
+    """Возвращает номер первого нулевого бита в битовой карте или None, если свободных нет."""
+    size = len(bitmap) * 8
+    free = ~int.from_bytes(bitmap, "little") & ((1 << size) - 1)
+    if not free:
+        return None
+    # Младший установленный бит
+    return (free & -free).bit_length() - 1
+
+
+def take_free_bits(bitmap: bytes, count: int) -> tuple[bytes, list[int]]:
+    """Занимает до `count` первых свободных битов битовой карты.
+
+    Returns:
+        tuple[bytes, list[int]]: Новая битовая карта и номера занятых битов.
+    """
+    size = len(bitmap) * 8
+    used = int.from_bytes(bitmap, "little")
+    free = ~used & ((1 << size) - 1)
+    bits: list[int] = []
+    while free and len(bits) < count:
+        lowest = free & -free
+        bits.append(lowest.bit_length() - 1)
+        free ^= lowest
+        used |= lowest
+    return used.to_bytes(len(bitmap), "little"), bits
+
+
+class AddressAllocator:
+    """Аллокатор адресов одной подсети.
+    Все методы работают внутри `auto_transaction`, то есть в транзакции вызывающего кода:
+    выдача адреса откатится вместе с созданием пира
+    """
+    def __init__(self, cidr: str, chunk_size: int = CHUNK_SIZE) -> None:
+        self.network = ipaddress.ip_network(cidr)
+        host_bits = self.network.max_prefixlen - self.network.prefixlen
+        if host_bits > MAX_HOST_BITS:
+            raise ValueError(
+                f"Subnet {cidr} is too large, at most {MAX_HOST_BITS} host bits are supported"
+            )
+        if chunk_size % 8:
+            raise ValueError("chunk_size must be a multiple of 8")
+        self.chunk_size = chunk_size
+        self.reserved = reserved_offsets(self.network)
+
+    @property
+    def total_chunks(self) -> int:
+        return -(-self.network.num_addresses // self.chunk_size)
+
+    def shard_chunks(self, shard: int) -> int:
+        """Сколько кусков подсети достаётся шарду `shard`"""
+        return len(range(shard, self.total_chunks, shard_count()))
+
+    def global_chunk_no(self, shard: int, local_no: int) -> int:
+        """Номер куска в подсети по номеру куска среди кусков шарда"""
+        return local_no * shard_count() + shard
+
+    @auto_transaction
+    def get_pool(self, shard: int = 0) -> AddressPool:
+        """Возвращает пул подсети на шарде текущей транзакции.
+        Создаёт его в БД при первом обращении.
+
+        Пул не кэшируется между транзакциями: строка, созданная в транзакции, исчезает
+        при её откате (дубль пира, повтор транзакции). Поиск по уникальному `cidr` - один
+        запрос по индексу
+        """
+        executor = get_db_executor()
+        query = f"""
+            SELECT {AddressPool.get_model_fields_joined()}
+            FROM address_pools WHERE cidr = %(cidr)s
+        """
+        result = executor.execute(query, cidr=str(self.network))
+        if not result:
+            executor.execute(
+                """
+                INSERT INTO address_pools (cidr, chunk_size, total_chunks)
+                VALUES (%(cidr)s, %(chunk_size)s, %(total_chunks)s)
+                ON CONFLICT (cidr) DO NOTHING
+                """,
+                cidr=str(self.network),
+                chunk_size=self.chunk_size,
+                total_chunks=self.shard_chunks(shard),
+            )
+            result = executor.execute(query, cidr=str(self.network))
+        pool = AddressPool.from_raw(result[0])
+        if pool.chunk_size != self.chunk_size:
+            raise ValueError(
+                f"Pool {pool.cidr} already exists with chunk_size={pool.chunk_size}"
+            )
+        return pool
+
+    def _lock_free_chunks(
+        self, pool: AddressPool, limit: int, after: int = -1
+    ) -> list[tuple[int, bytes]]:
+        """Находит и блокирует до `limit` кусков со свободными адресами с номером больше `after`."""
+        query: LiteralString = """
+            SELECT chunk_no, bitmap
+            FROM address_pool_chunks
+            WHERE pool_id = %(pool_id)s AND free_count > 0 AND chunk_no > %(after)s
+            ORDER BY chunk_no
+            LIMIT %(limit)s
+            FOR UPDATE SKIP LOCKED
+        """
+        result = get_db_executor().execute(
+            query, pool_id=pool.pool_id, limit=limit, after=after
+        )
+        return [(int(chunk_no), bytes(bitmap)) for chunk_no, bitmap in result]
+
+    def _reserve_new_chunks(self, pool: AddressPool, count: int) -> range:
+        """Резервирует номера `count` следующих кусков пула среди кусков шарда.
+        Бросает `AddressPoolExhaustedException`, если все куски уже созданы
+        """
+        executor = get_db_executor()
+        # Блокировка строки пула сериализует создание кусков
+        result = executor.execute(
+            """
+            SELECT next_chunk, total_chunks
+            FROM address_pools WHERE pool_id = %(pool_id)s
+            FOR UPDATE
+            """,
+            pool_id=pool.pool_id,
+        )
+        next_chunk, total_chunks = (int(v) for v in result[0])
+        if next_chunk >= total_chunks:
+            raise AddressPoolExhaustedException(f"Address pool {pool.cidr} is exhausted")
+        end = min(next_chunk + count, total_chunks)
+        executor.execute(
+            "UPDATE address_pools SET next_chunk = %(end)s WHERE pool_id = %(pool_id)s",
+            pool_id=pool.pool_id,
+            end=end,
+        )
+        return range(next_chunk, end)
+
+    @auto_transaction
+    def allocate_many(self, count: int, shard: int = 0) -> list[str]:
+        """Выдаёт `count` свободных адресов подсети.
+        Все изменения битовых карт записываются двумя запросами независимо от `count`.
+        Транзакция должна быть направлена на шард `shard`.
+
+        Returns:
+            list[str]: Адреса без маски, например `10.8.0.2`.
+        Raises:
+            AddressPoolExhaustedException: Если в подсети не хватило свободных адресов.
+        """
+        if count <= 0:
+            return []
+        pool = self.get_pool(shard)
+        offsets: list[int] = []
+        updated: list[tuple[int, bytes, int]] = []
+        created: list[tuple[int, bytes, int]] = []
+
+        # 1. Добираем адреса из существующих кусков. Свободное место может быть
+        # раздроблено по многим кускам, поэтому блокируем их порциями, пока не наберём
+        # `count` или не кончатся куски со свободными адресами. Порция растёт вдвое,
+        # чтобы сильно раздробленный пул не требовал запроса на каждые пару кусков
+        last_chunk = -1
+        limit = -(-count // self.chunk_size) + 1
+        while len(offsets) < count:
+            chunks = self._lock_free_chunks(pool, limit, last_chunk)
+            if not chunks:
+                break
+            limit *= 2
+            for chunk_no, bitmap in chunks:
+                bitmap, bits = take_free_bits(bitmap, count - len(offsets))
+                offsets.extend(chunk_no * self.chunk_size + bit for bit in bits)
+                updated.append((chunk_no, bitmap, len(bits)))
+                last_chunk = chunk_no
+                if len(offsets) == count:
+                    break
+
+        # 2. Недостающие берём из новых кусков
+        while len(offsets) < count:
+            missing = count - len(offsets)
+            for local_no in self._reserve_new_chunks(pool, -(-missing // self.chunk_size)):
+                chunk_no = self.global_chunk_no(shard, local_no)
+                bitmap, free_count = build_chunk_bitmap(
+                    chunk_no, self.chunk_size, self.network.num_addresses, self.reserved
+                )
+                bitmap, bits = take_free_bits(bitmap, count - len(offsets))
+                offsets.extend(chunk_no * self.chunk_size + bit for bit in bits)
+                created.append((chunk_no, bitmap, free_count - len(bits)))
+
+        executor = get_db_executor()
+        if updated:
+            executor.execute(
+                """
+                UPDATE address_pool_chunks c
+                SET bitmap = u.bitmap,
+                    free_count = c.free_count - u.taken
+                FROM unnest(%(chunk_nos)s::BIGINT[], %(bitmaps)s::BYTEA[], %(taken)s::INT[])
+                    AS u(chunk_no, bitmap, taken)
+                WHERE c.pool_id = %(pool_id)s AND c.chunk_no = u.chunk_no
+                """,
+                pool_id=pool.pool_id,
+                chunk_nos=[c[0] for c in updated],
+                bitmaps=[c[1] for c in updated],
+                taken=[c[2] for c in updated],
+            )
+        if created:
+            logger.debug("Creating %d chunks of pool %s", len(created), pool.cidr)
+            executor.execute(
+                """
+                INSERT INTO address_pool_chunks (pool_id, chunk_no, bitmap, free_count)
+                SELECT %(pool_id)s, chunk_no, bitmap, free_count
+                FROM unnest(%(chunk_nos)s::BIGINT[], %(bitmaps)s::BYTEA[], %(free_counts)s::INT[])
+                    AS u(chunk_no, bitmap, free_count)
+                """,
+                pool_id=pool.pool_id,
+                chunk_nos=[c[0] for c in created],
+                bitmaps=[c[1] for c in created],
+                free_counts=[c[2] for c in created],
+            )
+
+        network_address = self.network.network_address
+        return [str(network_address + offset) for offset in offsets]
+
+    def allocate(self, shard: int = 0) -> str:
+        """Выдаёт свободный адрес подсети на шарде `shard`.
+
+        Returns:
+            str: Адрес без маски, например `10.8.0.2`.
+        Raises:
+            AddressPoolExhaustedException: Если в подсети не осталось свободных адресов.
+        """
+        return self.allocate_many(1, shard)[0]
+
+    @auto_transaction
+    def release(self, address: str) -> None:
+        """Возвращает адрес в пул. Повторное освобождение ничего не делает."""
+        get_db_executor().execute(
+            "SELECT release_pool_address(%(address)s::inet)", address=address
+        )
@@ -0,0 +1,63 @@
+# peers package
+from flask import jsonify, request
+from vpncon.db import auto_transaction, Priority
+from vpncon.exceptions import (
+    EntityAlreadyExistsException, EntityNotExistsException, AddressPoolExhaustedException,
+    EntityValidationFailedException
+)
+from ..peers import peers_bp, peer_service, provisioning_service
+
+
+@peers_bp.errorhandler(EntityNotExistsException)
+def handle_not_exists(exc: EntityNotExistsException):
+    return jsonify({'error': exc.message}), 404
+
+@peers_bp.errorhandler(EntityAlreadyExistsException)
+def handle_already_exists(exc: EntityAlreadyExistsException):
+    return jsonify({'error': exc.message}), 400
+
+@peers_bp.errorhandler(EntityValidationFailedException)
+def handle_validation_failed(exc: EntityValidationFailedException):
+    return jsonify({'error': exc.message}), 400
+
+@peers_bp.errorhandler(AddressPoolExhaustedException)
+def handle_pool_exhausted(exc: AddressPoolExhaustedException):
+    return jsonify({'error': exc.message}), 409
+
+
+@peers_bp.route('/', methods=['GET'])
+@auto_transaction(priority=Priority.HIGH)
+def api_get_user_peers():
+    telegram_id = request.args.get('telegram_id', type=int)
+    if telegram_id is None:
+        return jsonify({'error': 'telegram_id query parameter is required'}), 400
+    return jsonify(peer_service.get_user_peers(telegram_id))
+
+# Транзакцию открывает сервис: ключи генерируются до неё
+@peers_bp.route('/provision', methods=['POST'])
+def api_provision_peers():
+    data = request.json
+    provisioned = provisioning_service.provision_users(data.get('telegram_ids') or [])
+    return jsonify([p.as_dict() for p in provisioned]), 201
+
+# Публичный ключ в base64 может содержать '/'
+@peers_bp.route('/<path:public_key>', methods=['GET'])
+@auto_transaction(priority=Priority.HIGH)
+def api_get_peer(public_key:str):
+    peer = peer_service.get_peer(public_key)
+    if peer:
+        return jsonify(peer)
+    return jsonify({'error': 'Peer not found'}), 404
+
+@peers_bp.route('/', methods=['POST'])
+@auto_transaction(retries=3)
+def api_create_peer():
+    data = request.json
+    peer = peer_service.create_peer(data.get('telegram_id'), data.get('public_key'))
+    return jsonify(peer), 201
+
+@peers_bp.route('/<path:public_key>', methods=['DELETE'])
+@auto_transaction(retries=3)
+def api_delete_peer(public_key:str):
+    peer_service.delete_peer(public_key)
+    return jsonify({'status': 'deleted'})
@@ -0,0 +1,153 @@
+from typing import Any
+import logging
+from vpncon.db import auto_transaction, get_db_executor, UniqueConstraintError
+from .model import Peer
+
+
+logger = logging.getLogger(__name__)
+
+
+@auto_transaction
+def get_peer(public_key:str) -> Peer | None:
+    """Получает пира по его публичному ключу.
+    Шард пира по ключу неизвестен, поэтому поиск идёт по всем шардам.
+    Args:
+        public_key (str): Публичный ключ WireGuard.
+    Returns:
+        Peer | None: Экземпляр Peer, если пир найден, иначе None.
+    """
+    executor = get_db_executor()
+    query = f"""
+        SELECT
+            {Peer.get_model_fields_joined()}
+        FROM peers WHERE public_key = %(public_key)s
+    """
+    params:dict[str, Any] = {
+        'public_key': public_key
+    }
+    result = executor.scatter(query, **params)
+    if not result:
+        return None
+    return Peer.from_raw(result[0])
+
+@auto_transaction(shard_by="telegram_id")
+def get_user_peers(telegram_id:int) -> list[Peer]:
+    """Получает всех пиров пользователя.
+    Args:
+        telegram_id (int): Идентификатор пользователя в Telegram.
+    Returns:
+        list[Peer]: Пиры пользователя в порядке создания.
+    """
+    executor = get_db_executor()
+    query = f"""
+        SELECT
+            {Peer.get_model_fields_joined()}
+        FROM peers WHERE telegram_id = %(telegram_id)s
+        ORDER BY created_at
+    """
+    params:dict[str, Any] = {
+        'telegram_id': telegram_id
+    }
+    result = executor.execute(query, **params)
+    return [Peer.from_raw(row) for row in result]
+
+@auto_transaction(shard_by="peer.telegram_id")
+def create_peer(peer:Peer) -> None:
+    """Создаёт нового пира.
+    Если пир с таким публичным ключом или адресом уже существует, бросает исключение.
+    Args:
+        peer (Peer): Экземпляр пира для создания.
+    """
+    executor = get_db_executor()
+    query = f"""
+        INSERT INTO peers ({Peer.get_model_fields_joined()})
+        VALUES (%(public_key)s, %(telegram_id)s, %(address_v4)s, %(address_v6)s)
+    """
+    params: dict[str, Any] = {
+        'public_key': peer.public_key,
+        'telegram_id': peer.telegram_id,
+        'address_v4': peer.address_v4,
+        'address_v6': peer.address_v6
+    }
+    try:
+        executor.execute(query, **params)
+    except UniqueConstraintError as exc:
+        raise UniqueConstraintError(
+            f"Peer with public_key={peer.public_key} already exists"
+        ) from exc
+
+@auto_transaction(shard_by="peer.telegram_id")
+def delete_peer(peer:Peer) -> None:
+    """Удаляет пира. Адреса пира возвращаются в пул триггером.
+
+    Args:
+        peer (Peer): Пир для удаления.
+    """
+    executor = get_db_executor()
+    query = """
+        DELETE FROM peers WHERE public_key = %(public_key)s
+    """
+    params: dict[str, Any] = {
+        'public_key': peer.public_key
+    }
+    executor.execute(query, **params)
+
+@auto_transaction
+def delete_peers(public_keys:list[str]) -> None:
+    """Удаляет пиров одним запросом на шарде текущей транзакции.
+    Адреса пиров возвращаются в пул триггером.
+    Args:
+        public_keys (list[str]): Публичные ключи пиров.
+    """
+    executor = get_db_executor()
+    query = """
+        DELETE FROM peers WHERE public_key = ANY(%(public_keys)s)
+    """
+    params: dict[str, Any] = {
+        'public_keys': public_keys
+    }
+    executor.execute(query, **params)
+
+@auto_transaction
+def create_peers(peers:list[Peer]) -> None:
+    """Создаёт пиров одним запросом на шарде текущей транзакции.
+    Если хотя бы один пир нарушает уникальность, бросает исключение и не создаёт никого.
+    Args:
+        peers (list[Peer]): Пиры для создания.
+    """
+    executor = get_db_executor()
+    query = f"""
+        INSERT INTO peers ({Peer.get_model_fields_joined()})
+        SELECT * FROM unnest(
+            %(public_keys)s::VARCHAR[], %(telegram_ids)s::BIGINT[],
+            %(addresses_v4)s::INET[], %(addresses_v6)s::INET[]
+        )
+    """
+    params: dict[str, Any] = {
+        'public_keys': [p.public_key for p in peers],
+        'telegram_ids': [p.telegram_id for p in peers],
+        'addresses_v4': [p.address_v4 for p in peers],
+        'addresses_v6': [p.address_v6 for p in peers]
+    }
+    try:
+        executor.execute(query, **params)
+    except UniqueConstraintError as exc:
+        raise UniqueConstraintError("Some of the peers already exist") from exc
+
+@auto_transaction
+def get_missing_user_ids(telegram_ids:list[int]) -> list[int]:
+    """Возвращает идентификаторы из списка, для которых нет пользователя
+    на шарде текущей транзакции.
+    Args:
+        telegram_ids (list[int]): Идентификаторы пользователей в Telegram.
+    """
+    executor = get_db_executor()
+    query = """
+        SELECT t.telegram_id
+        FROM unnest(%(telegram_ids)s::BIGINT[]) AS t(telegram_id)
+        WHERE NOT EXISTS (SELECT 1 FROM users u WHERE u.telegram_id = t.telegram_id)
+    """
+    params: dict[str, Any] = {
+        'telegram_ids': telegram_ids
+    }
+    return [row[0] for row in executor.execute(query, **params)]
@@ -0,0 +1,91 @@
+"""Генерация ключей WireGuard (X25519).
+
+Одиночная пара генерируется в текущем процессе.
+Большие пачки режутся на куски и генерируются в пуле процессов,
+чтобы массовый онбординг не упирался в одно ядро и не держал GIL воркера.
+"""
+import base64
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from vpncon.config import Config
+
+
+logger = logging.getLogger(__name__)
+
+
+def generate_keypair() -> tuple[str, str]:
+    """Генерирует пару ключей WireGuard.
+
+    Returns:
+        tuple[str, str]: Приватный и публичный ключ в base64.
+    """
+    # cryptography нужна только при выдаче ключей, не грузим её на старте приложения
+    from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey
+
+    private = X25519PrivateKey.generate()
+    return (
+        base64.b64encode(private.private_bytes_raw()).decode("ascii"),
+        base64.b64encode(private.public_key().public_bytes_raw()).decode("ascii"),
+    )
+
+
+def _generate_chunk(count: int) -> list[tuple[str, str]]:
+    return [generate_keypair() for _ in range(count)]
+
+
+_executor: ProcessPoolExecutor | None = None
+_executor_lock = threading.Lock()
+
+def _get_executor() -> ProcessPoolExecutor:
+    """Возвращает пул процессов для генерации ключей. Создаёт его при первом обращении.
+    Используется spawn: воркер веб-сервера многопоточный, fork из него небезопасен
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                logger.info("Starting keygen process pool: %d processes", Config.KEYGEN_PROCESSES)
+                _executor = ProcessPoolExecutor(
+                    max_workers=Config.KEYGEN_PROCESSES,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+                from vpncon.shutdown import get_coordinator
+                get_coordinator().register("keygen_pool", lambda timeout: shutdown_keygen_pool())
+    return _executor
+
+
+def generate_keypairs(count: int) -> list[tuple[str, str]]:
+    """Генерирует `count` пар ключей.
+    Пачки больше `KEYGEN_CHUNK_SIZE` генерируются параллельно в пуле процессов.
+    """
+    chunk_size = Config.KEYGEN_CHUNK_SIZE
+    if count <= chunk_size or Config.KEYGEN_PROCESSES <= 1:
+        return _generate_chunk(count)
+
+    chunks = [min(chunk_size, count - start) for start in range(0, count, chunk_size)]
+    keypairs: list[tuple[str, str]] = []
+    for chunk in _get_executor().map(_generate_chunk, chunks):
+        keypairs.extend(chunk)
+    return keypairs
+
+
+def shutdown_keygen_pool() -> None:
+    """Останавливает пул процессов, если он был запущен."""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+        _executor = None
+
+
+def _reset_executor_after_fork() -> None:
+    # Процессы пула принадлежат родителю
+    global _executor, _executor_lock
+    _executor = None
+    _executor_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_executor_after_fork)
@@ -0,0 +1,67 @@
+from typing import Any
+from dataclasses import dataclass
+
+from vpncon.db import DataModel
+
+
+@dataclass(frozen=True)
+class Peer(DataModel):
+    """Модель пира WireGuard. Принадлежит пользователю `users.telegram_id`."""
+    public_key: str
+    telegram_id: int
+    address_v4: str | None
+    address_v6: str | None
+
+    @staticmethod
+    def from_raw(raw: tuple[Any, ...]) -> 'Peer':
+        """Создаёт экземпляр `Peer` из сырых данных, полученных из БД.
+
+        Args:
+            raw (tuple[Any, ...]): Сырые данные из БД.
+
+        Returns:
+            Peer: Экземпляр `Peer`.
+        Raises:
+            ValueError: Если поля не приводятся к нужным типам.
+        """
+        fields = Peer.get_model_fields()
+        data = dict(zip(fields, raw))
+        try:
+            public_key = str(data['public_key'])
+            telegram_id = int(data['telegram_id'])
+            address_v4 = None if data['address_v4'] is None else str(data['address_v4'])
+            address_v6 = None if data['address_v6'] is None else str(data['address_v6'])
+        except (ValueError, TypeError) as exc:
+            raise ValueError(
+                f"Invalid data for Peer: {data}"
+            ) from exc
+
+        return Peer(
+            public_key=public_key,
+            telegram_id=telegram_id,
+            address_v4=address_v4,
+            address_v6=address_v6
+        )
+
+
+@dataclass(frozen=True)
+class AddressPool(DataModel):
+    """Модель пула адресов. Только неизменяемые поля, пригодные для кэширования."""
+    pool_id: int
+    cidr: str
+    chunk_size: int
+
+    @staticmethod
+    def from_raw(raw: tuple[Any, ...]) -> 'AddressPool':
+        fields = AddressPool.get_model_fields()
+        data = dict(zip(fields, raw))
+        try:
+            return AddressPool(
+                pool_id=int(data['pool_id']),
+                cidr=str(data['cidr']),
+                chunk_size=int(data['chunk_size'])
+            )
+        except (ValueError, TypeError) as exc:
+            raise ValueError(
+                f"Invalid data for AddressPool: {data}"
+            ) from exc
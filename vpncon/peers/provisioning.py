@@ -0,0 +1,146 @@
+import logging
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+
+from vpncon.db import auto_transaction, get_db_executor, shard_for
+from vpncon.exceptions import EntityNotExistsException, EntityValidationFailedException
+from vpncon.config import Config
+from .crud import create_peers, delete_peers, get_missing_user_ids
+from .keys import generate_keypairs
+from .model import Peer
+from .render import render_client_config
+from .service import PeerServiceCRUD
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class ProvisionedPeer:
+    """Результат выдачи доступа: пир, его приватный ключ и готовый клиентский конфиг.
+    Приватный ключ в БД не хранится и отдаётся только здесь.
+    """
+    peer: Peer
+    private_key: str
+    config: str
+
+    def as_dict(self) -> dict[str, object]:
+        return {
+            'telegram_id': self.peer.telegram_id,
+            'public_key': self.peer.public_key,
+            'address_v4': self.peer.address_v4,
+            'address_v6': self.peer.address_v6,
+            'private_key': self.private_key,
+            'config': self.config,
+        }
+
+
+class ProvisioningService(ABC):
+
+    @abstractmethod
+    def provision_user(self, telegram_id: int) -> ProvisionedPeer:
+        pass
+
+    @abstractmethod
+    def provision_users(self, telegram_ids: list[int]) -> list[ProvisionedPeer]:
+        pass
+
+
+class ProvisioningServiceCRUD(ProvisioningService):
+    """Выдаёт доступ пачками:
+    ключи генерируются до транзакции в пуле процессов, адреса и пиры пишутся
+    несколькими set-based запросами в одной транзакции, конфиги рендерятся после неё.
+    При шардировании пачка делится по шардам пользователей, на каждый шард своя транзакция.
+    Пользователи всех шардов проверяются до первой записи, а если запись на шарде
+    всё же упала, пиры уже записанных шардов удаляются: их приватные ключи никто не получит
+    """
+    def __init__(self, peer_service: PeerServiceCRUD) -> None:
+        self.peer_service = peer_service
+
+    def provision_user(self, telegram_id: int) -> ProvisionedPeer:
+        return self.provision_users([telegram_id])[0]
+
+    def provision_users(self, telegram_ids: list[int]) -> list[ProvisionedPeer]:
+        if len(telegram_ids) > Config.PROVISION_MAX_BATCH:
+            raise EntityValidationFailedException(
+                f"Too many users in one batch, max is {Config.PROVISION_MAX_BATCH}"
+            )
+        if not telegram_ids:
+            return []
+
+        # CPU работа - до транзакции, чтобы не держать соединение
+        keypairs = generate_keypairs(len(telegram_ids))
+        by_shard: dict[int, list[int]] = {}
+        for i, telegram_id in enumerate(telegram_ids):
+            by_shard.setdefault(shard_for(telegram_id), []).append(i)
+
+        missing = [
+            telegram_id
+            for shard, indexes in by_shard.items()
+            for telegram_id in self._find_missing(shard, [telegram_ids[i] for i in indexes])
+        ]
+        if missing:
+            raise EntityNotExistsException(f"Users not found: {missing[:20]}")
+
+        peers: list[Peer] = [None] * len(telegram_ids)  # type: ignore[list-item]
+        stored_by_shard: dict[int, list[Peer]] = {}
+        try:
+            for shard, indexes in by_shard.items():
+                stored = self._store_peers(
+                    shard,
+                    [telegram_ids[i] for i in indexes],
+                    [keypairs[i][1] for i in indexes],
+                )
+                stored_by_shard[shard] = stored
+                for i, peer in zip(indexes, stored):
+                    peers[i] = peer
+        except Exception:
+            self._discard_peers(stored_by_shard)
+            raise
+        return [
+            ProvisionedPeer(peer, private, render_client_config(peer, private))
+            for peer, (private, _) in zip(peers, keypairs)
+        ]
+
+    @auto_transaction
+    def _find_missing(self, shard: int, telegram_ids: list[int]) -> list[int]:
+        get_db_executor().route_shard(shard)
+        return get_missing_user_ids(telegram_ids)
+
+    def _discard_peers(self, stored_by_shard: dict[int, list[Peer]]) -> None:
+        """Удаляет пиров шардов, записанных до ошибки на другом шарде."""
+        for shard, stored in stored_by_shard.items():
+            try:
+                self._delete_peers(shard, [peer.public_key for peer in stored])
+            except Exception:
+                logger.exception(
+                    "Cannot delete %d orphaned peers on shard %d", len(stored), shard
+                )
+
+    @auto_transaction(retries=3)
+    def _delete_peers(self, shard: int, public_keys: list[str]) -> None:
+        get_db_executor().route_shard(shard)
+        delete_peers(public_keys)
+
+    @auto_transaction(retries=3)
+    def _store_peers(
+        self, shard: int, telegram_ids: list[int], public_keys: list[str]
+    ) -> list[Peer]:
+        get_db_executor().route_shard(shard)
+        missing = get_missing_user_ids(telegram_ids)
+        if missing:
+            raise EntityNotExistsException(f"Users not found: {missing[:20]}")
+
+        count = len(telegram_ids)
+        allocator_v4 = self.peer_service.allocator_v4
+        allocator_v6 = self.peer_service.allocator_v6
+        addresses_v4 = allocator_v4.allocate_many(count, shard) if allocator_v4 else [None] * count
+        addresses_v6 = allocator_v6.allocate_many(count, shard) if allocator_v6 else [None] * count
+
+        peers = [
+            Peer(public_key, telegram_id, address_v4, address_v6)
+            for telegram_id, public_key, address_v4, address_v6
+            in zip(telegram_ids, public_keys, addresses_v4, addresses_v6)
+        ]
+        create_peers(peers)
+        return peers
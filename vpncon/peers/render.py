@@ -0,0 +1,50 @@
+"""Рендер клиентских конфигов WireGuard.
+
+Шаблон читается и компилируется один раз на процесс. Серверная часть конфига
+(ключ сервера, endpoint, DNS, ...) одинакова для всех клиентов и подставляется в шаблон
+сразу при компиляции, так что на каждого клиента остаётся подставить только его поля.
+Текст конфига одновременно служит полезной нагрузкой для QR кода.
+"""
+import os
+from functools import lru_cache
+from string import Template
+
+from vpncon.config import Config
+from .model import Peer
+
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(__file__), "templates")
+
+
+@lru_cache(maxsize=None)
+def get_template(name: str = "client.conf") -> Template:
+    """Возвращает шаблон с уже подставленной серверной частью."""
+    with open(os.path.join(TEMPLATES_DIR, name), "r", encoding="utf-8") as f:
+        raw = Template(f.read())
+    return Template(raw.safe_substitute(
+        server_public_key=Config.WG_SERVER_PUBLIC_KEY,
+        endpoint=Config.WG_ENDPOINT,
+        dns=Config.WG_DNS,
+        allowed_ips=Config.WG_ALLOWED_IPS,
+        persistent_keepalive=Config.WG_PERSISTENT_KEEPALIVE,
+    ))
+
+
+def render_client_config(peer: Peer, private_key: str, template: str = "client.conf") -> str:
+    """Рендерит клиентский конфиг пира.
+
+    Args:
+        peer (Peer): Пир с выданными адресами.
+        private_key (str): Приватный ключ пира в base64. В БД не хранится.
+    Returns:
+        str: Текст `.conf` файла.
+    """
+    addresses: list[str] = []
+    if peer.address_v4:
+        addresses.append(f"{peer.address_v4}/32")
+    if peer.address_v6:
+        addresses.append(f"{peer.address_v6}/128")
+    return get_template(template).substitute(
+        private_key=private_key,
+        address=", ".join(addresses),
+    )
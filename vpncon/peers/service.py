@@ -0,0 +1,66 @@
+from abc import ABC, abstractmethod
+
+from vpncon.config import Config
+from vpncon.db import auto_transaction, shard_for, UniqueConstraintError
+from vpncon.exceptions import EntityAlreadyExistsException, EntityNotExistsException
+from vpncon.users.crud import get_user
+from .allocator import AddressAllocator
+from .crud import create_peer, get_peer, get_user_peers, delete_peer
+from .model import Peer
+
+
+class PeerService(ABC):
+
+    @abstractmethod
+    def create_peer(self, telegram_id: int, public_key: str) -> Peer:
+        pass
+
+    @abstractmethod
+    def get_peer(self, public_key: str) -> Peer | None:
+        pass
+
+    @abstractmethod
+    def get_user_peers(self, telegram_id: int) -> list[Peer]:
+        pass
+
+    @abstractmethod
+    def delete_peer(self, public_key: str) -> None:
+        pass
+
+
+class PeerServiceCRUD(PeerService):
+    def __init__(self) -> None:
+        self.allocator_v4 = AddressAllocator(Config.PEER_SUBNET_V4) if Config.PEER_SUBNET_V4 else None
+        self.allocator_v6 = AddressAllocator(Config.PEER_SUBNET_V6) if Config.PEER_SUBNET_V6 else None
+
+    @auto_transaction(shard_by="telegram_id")
+    def create_peer(self, telegram_id: int, public_key: str) -> Peer:
+        if get_user(telegram_id) is None:
+            raise EntityNotExistsException(f"User with telegram_id={telegram_id} not found")
+        shard = shard_for(telegram_id)
+        peer = Peer(
+            public_key=public_key,
+            telegram_id=telegram_id,
+            address_v4=self.allocator_v4.allocate(shard) if self.allocator_v4 else None,
+            address_v6=self.allocator_v6.allocate(shard) if self.allocator_v6 else None,
+        )
+        try:
+            create_peer(peer)
+        except UniqueConstraintError as exc:
+            raise EntityAlreadyExistsException(
+                f"Peer with public_key={public_key} already exists"
+            ) from exc
+        return peer
+
+    def get_peer(self, public_key: str) -> Peer | None:
+        return get_peer(public_key)
+
+    def get_user_peers(self, telegram_id: int) -> list[Peer]:
+        return get_user_peers(telegram_id)
+
+    @auto_transaction
+    def delete_peer(self, public_key: str) -> None:
+        peer = get_peer(public_key)
+        if peer is None:
+            raise EntityNotExistsException(f"Peer with public_key={public_key} not found")
+        return delete_peer(peer)
@@ -0,0 +1,327 @@
+"""Ограничение частоты запросов к API.
+
+Token bucket на каждую пару (эндпоинт, идентичность). Идентичностей две:
+клиент (IP или, если задан `RATE_LIMIT_CLIENT_HEADER`, этот заголовок) и пользователь
+(`telegram_id` запроса). Заголовок клиента задаётся только за доверенным прокси,
+который его перезаписывает: иначе клиент обходит лимит, меняя значение в каждом запросе.
+Проверка выполняется в `before_request` блюпринта, то есть до `auto_transaction`,
+поэтому отклонённый запрос не занимает соединение из пула.
+Токен списывается из бакетов всех идентичностей, только если он есть в каждом из них:
+запрос, отклонённый по лимиту пользователя, не тратит лимит клиента, и наоборот.
+
+Режимы (`RATE_LIMIT_BACKEND`):
+- `local` - бакеты в памяти процесса, без обращений к БД
+- `postgres` - общие для всех воркеров бакеты в таблице `rate_limit_buckets`.
+  Бакеты, не менявшиеся дольше полного пополнения, раз в `RATE_LIMIT_PURGE_INTERVAL`
+  удаляются: такой бакет полон, и отсутствующий ему эквивалентен
+- `off` - выключено
+
+Лимиты задаются в `RATE_LIMITS` строкой вида
+`default=20:40,users_api.api_get_user=100:200`, где `rate:burst` -
+токенов в секунду и ёмкость бакета. Ключ - имя эндпоинта Flask.
+
+Пример подключения:
+```python
+users_bp.before_request(rate_limit_request)
+```
+"""
+import logging
+import math
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import LiteralString
+
+from flask import jsonify, request
+
+from vpncon import metrics
+from vpncon.config import Config
+from vpncon.db import auto_transaction, get_db_executor, PoolExhaustedError, Priority
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    """Параметры бакета: пополнение в токенах в секунду и ёмкость."""
+    rate: float
+    burst: float
+
+    @staticmethod
+    def parse(value: str) -> 'RateLimit':
+        rate, _, burst = value.partition(":")
+        limit = RateLimit(float(rate), float(burst or rate))
+        if limit.rate <= 0 or limit.burst < 1:
+            raise ValueError(f"Invalid rate limit: {value!r}")
+        return limit
+
+
+def parse_rate_limits(raw: str) -> dict[str, RateLimit]:
+    """Разбирает `RATE_LIMITS` в словарь эндпоинт -> лимит."""
+    limits: dict[str, RateLimit] = {}
+    for pair in raw.split(","):
+        if "=" in pair:
+            name, value = pair.split("=", 1)
+            limits[name.strip()] = RateLimit.parse(value.strip())
+    return limits
+
+
+class TokenBucket:
+    """Классический token bucket. Не потокобезопасный, синхронизацию обеспечивает владелец."""
+    __slots__ = ("tokens", "updated_at")
+
+    def __init__(self, burst: float, now: float) -> None:
+        self.tokens = burst
+        self.updated_at = now
+
+    def refill(self, limit: RateLimit, now: float) -> None:
+        """Начисляет токены, накопившиеся с прошлого обращения."""
+        self.tokens = min(limit.burst, self.tokens + (now - self.updated_at) * limit.rate)
+        self.updated_at = now
+
+    def wait_time(self, limit: RateLimit) -> float:
+        """Сколько секунд ждать следующего токена, 0 - если токен есть."""
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / limit.rate
+
+    def consume(self, limit: RateLimit, now: float) -> float:
+        """Пытается забрать токен.
+
+        Returns:
+            float: 0, если токен получен, иначе сколько секунд ждать следующего токена.
+        """
+        self.refill(limit, now)
+        retry_after = self.wait_time(limit)
+        if not retry_after:
+            self.tokens -= 1
+        return retry_after
+
+
+class RateLimiter(ABC):
+    """Хранилище бакетов."""
+    @abstractmethod
+    def consume(self, keys: list[str], limit: RateLimit) -> float:
+        """Забирает по токену из каждого бакета `keys`, только если токены есть во всех.
+        Если хоть в одном бакете токена нет, ни один бакет не списывается.
+
+        Returns:
+            float: 0, если запрос разрешён, иначе сколько секунд ждать.
+        """
+
+
+class LocalRateLimiter(RateLimiter):
+    """Бакеты в памяти процесса. Хранит не больше `max_keys` бакетов,
+    давно не использованные вытесняются (полный бакет и вытесненный эквивалентны)
+    """
+    def __init__(self, max_keys: int) -> None:
+        self.max_keys = max_keys
+        self._buckets: OrderedDict[str, TokenBucket] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _bucket(self, key: str, limit: RateLimit, now: float) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(limit.burst, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def consume(self, keys: list[str], limit: RateLimit) -> float:
+        now = time.monotonic()
+        with self._lock:
+            buckets = [self._bucket(key, limit, now) for key in keys]
+            for bucket in buckets:
+                bucket.refill(limit, now)
+            retry_after = max(bucket.wait_time(limit) for bucket in buckets)
+            if not retry_after:
+                for bucket in buckets:
+                    bucket.tokens -= 1
+            return retry_after
+
+
+# Пополнение бакетов запроса. Строки блокируются до конца транзакции в порядке ключей,
+# чтобы параллельные запросы с общими бакетами не взаимоблокировались
+REFILL_SHARED_SQL: LiteralString = """
+    INSERT INTO rate_limit_buckets AS b (key, tokens, updated_at)
+    SELECT key, %(burst)s, clock_timestamp()
+    FROM unnest(%(keys)s::VARCHAR[]) AS key
+    ORDER BY key
+    ON CONFLICT (key) DO UPDATE
+        SET tokens = LEAST(
+                %(burst)s,
+                b.tokens + EXTRACT(EPOCH FROM clock_timestamp() - b.updated_at) * %(rate)s
+            ),
+            updated_at = clock_timestamp()
+    RETURNING tokens
+"""
+
+# Списание выполняется, только если токены есть во всех бакетах запроса
+TAKE_SHARED_SQL: LiteralString = """
+    UPDATE rate_limit_buckets SET tokens = tokens - 1 WHERE key = ANY(%(keys)s)
+"""
+
+# Бакет, не менявшийся дольше полного пополнения, полон: удалённый ему эквивалентен.
+# Заблокированные бакеты сейчас используются и пропускаются
+PURGE_STALE_SQL: LiteralString = """
+    DELETE FROM rate_limit_buckets
+    WHERE key IN (
+        SELECT key FROM rate_limit_buckets
+        WHERE updated_at < clock_timestamp() - make_interval(secs => %(ttl)s)
+        LIMIT %(batch_size)s
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING key
+"""
+
+
+class PostgresRateLimiter(RateLimiter):
+    """Бакеты в таблице `rate_limit_buckets`, общие для всех воркеров и процессов.
+
+    Раз в `RATE_LIMIT_PURGE_INTERVAL` один из запросов воркера удаляет пачку бакетов,
+    не менявшихся дольше `ttl` секунд. Если пачка полная, остаток удалит следующий запрос.
+
+    Args:
+        ttl (float): Время полного пополнения самого большого бакета, секунд.
+    """
+    def __init__(self, ttl: float) -> None:
+        self.ttl = ttl
+        self._next_purge = 0.0
+        self._purge_lock = threading.Lock()
+
+    def consume(self, keys: list[str], limit: RateLimit) -> float:
+        try:
+            retry_after = _consume_shared(keys, limit)
+        except PoolExhaustedError:
+            # Запрос всё равно пройдёт допуск к пулу со своим приоритетом
+            metrics.inc("api.rate_limit_skipped")
+            logger.debug("Rate limit check skipped for %s: no free connections", keys)
+            return 0.0
+        self._purge_if_due()
+        return retry_after
+
+    def _purge_if_due(self) -> None:
+        now = time.monotonic()
+        with self._purge_lock:
+            if now < self._next_purge:
+                return
+            self._next_purge = now + Config.RATE_LIMIT_PURGE_INTERVAL
+        batch_size = Config.RATE_LIMIT_PURGE_BATCH_SIZE
+        try:
+            purged = _purge_stale(self.ttl, batch_size)
+        except PoolExhaustedError:
+            logger.debug("Rate limit buckets purge skipped: no free connections")
+            return
+        except Exception:
+            # Очистка не должна ронять запрос
+            logger.exception("Rate limit buckets purge failed")
+            return
+        if purged:
+            metrics.inc("api.rate_limit_purged", purged)
+            logger.debug("Purged %d stale rate limit buckets", purged)
+        if purged >= batch_size:
+            with self._purge_lock:
+                self._next_purge = now
+
+
+# Проверка бакета не должна занимать слоты, зарезервированные под дешёвые чтения
+@auto_transaction(priority=Priority.LOW)
+def _consume_shared(keys: list[str], limit: RateLimit) -> float:
+    executor = get_db_executor()
+    # Бакеты не относятся к пользователю и живут на первом шарде
+    executor.route_shard(0)
+    result = executor.execute(
+        REFILL_SHARED_SQL, keys=keys, rate=limit.rate, burst=limit.burst
+    )
+    tokens = min(float(row[0]) for row in result)
+    if tokens < 1:
+        return (1 - tokens) / limit.rate
+    executor.execute(TAKE_SHARED_SQL, keys=keys)
+    return 0.0
+
+
+@auto_transaction(priority=Priority.LOW)
+def _purge_stale(ttl: float, batch_size: int) -> int:
+    """Удаляет пачку бакетов, не менявшихся дольше `ttl` секунд.
+
+    Returns:
+        int: Количество удалённых бакетов.
+    """
+    executor = get_db_executor()
+    executor.route_shard(0)
+    return len(executor.execute(PURGE_STALE_SQL, ttl=ttl, batch_size=batch_size))
+
+
+_limiter: RateLimiter | None = None
+_limits: dict[str, RateLimit] | None = None
+_limiter_lock = threading.Lock()
+
+def get_rate_limiter() -> RateLimiter | None:
+    """Возвращает лимитер процесса согласно `RATE_LIMIT_BACKEND` или None, если выключено."""
+    global _limiter, _limits
+    if _limits is None:
+        with _limiter_lock:
+            if _limits is None:
+                backend = Config.RATE_LIMIT_BACKEND
+                limits = parse_rate_limits(Config.RATE_LIMITS)
+                if backend == "local":
+                    _limiter = LocalRateLimiter(Config.RATE_LIMIT_MAX_KEYS)
+                elif backend == "postgres":
+                    _limiter = PostgresRateLimiter(
+                        max((l.burst / l.rate for l in limits.values()), default=0.0)
+                    )
+                elif backend != "off":
+                    raise ValueError(f"Unknown RATE_LIMIT_BACKEND: {backend!r}")
+                _limits = limits
+    return _limiter
+
+
+def _get_limit(endpoint: str | None) -> RateLimit | None:
+    assert _limits is not None
+    return _limits.get(endpoint or "") or _limits.get("default")
+
+
+def _request_identities() -> list[str]:
+    """Идентичности, по которым ограничивается запрос."""
+    client = None
+    if Config.RATE_LIMIT_CLIENT_HEADER:
+        client = request.headers.get(Config.RATE_LIMIT_CLIENT_HEADER)
+    client = client or request.remote_addr or "-"
+    identities = [f"client:{client}"]
+    telegram_id = (request.view_args or {}).get("telegram_id")
+    if telegram_id is None and request.is_json:
+        body = request.get_json(silent=True)
+        if isinstance(body, dict):
+            telegram_id = body.get("telegram_id")
+    if telegram_id is not None:
+        identities.append(f"user:{telegram_id}")
+    return identities
+
+
+def rate_limit_request():
+    """`before_request` хук: отвечает 429, если у запроса закончились токены."""
+    limiter = get_rate_limiter()
+    if limiter is None:
+        return None
+    limit = _get_limit(request.endpoint)
+    if limit is None:
+        return None
+
+    identities = _request_identities()
+    retry_after = limiter.consume(
+        [f"{request.endpoint}|{identity}" for identity in identities], limit
+    )
+    if not retry_after:
+        return None
+
+    metrics.inc("api.rate_limited")
+    logger.debug("Rate limited %s for %s", request.endpoint, identities)
+    response = jsonify({'error': 'Too many requests'})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(math.ceil(retry_after))
+    return response
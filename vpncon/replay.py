@@ -0,0 +1,426 @@
+"""Запись и воспроизведение трафика API.
+
+Формат записи - JSONL, один запрос на строку:
+```json
+{"t": 1760000000.125, "method": "POST", "path": "/users/?x=1", "headers": {"Content-Type": "application/json"}, "body": "{\\"telegram_id\\": 1}"}
+```
+`t` - unix время получения запроса, `headers` и `body` необязательны.
+Запись включается переменной `APP_RECORD_REQUESTS` (путь к файлу), см. `RequestRecorder`.
+Заголовки пишутся только из `RECORDED_HEADERS`: токены и куки в запись не попадают.
+
+Воспроизведение на запущенном сервере или в процессе через тестовый клиент Flask:
+```sh
+python -m vpncon.replay traffic.jsonl --url http://localhost:8000 --concurrency 16 --speed 10
+python -m vpncon.replay traffic.jsonl --app --speed 0 --rate 500
+```
+- `--speed` - сжатие времени: интервалы между запросами делятся на `speed`, `0` - без пауз
+- `--rate` - не больше `rate` запросов в секунду
+- `--concurrency` - сколько запросов выполняется одновременно. Если все заняты,
+  следующий ждёт: задержка относительно расписания видна в отчёте как `lag`
+
+Отчёт: пропускная способность, перцентили задержки, ответы по статусам, доля ошибок
+(5xx и сбои соединения) и изменение метрик приложения за прогон (`vpncon/metrics.py`):
+ожидание пула и гейта, отказы, повторы транзакций. С `--url` метрики берутся
+из `GET /admin/metrics` (нужен `ADMIN_TOKEN`) одного воркера: для сравнения релизов
+сервер лучше запускать с `WEB_WORKERS=1`.
+"""
+import argparse
+import json
+import logging
+import math
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import IO, Any, Iterable, Iterator, Protocol
+
+from flask import Flask, request
+
+from vpncon import metrics
+from vpncon.config import Config, setup_logging
+
+
+logger = logging.getLogger(__name__)
+
+
+# Заголовки, влияющие на обработку запроса. Authorization и Cookie не записываются
+RECORDED_HEADERS = ("Content-Type", "Idempotency-Key", "X-Client-Id")
+# Блюпринты, запросы к которым не записываются: пробы и служебные эндпоинты
+NOT_RECORDED_BLUEPRINTS = {"health", "admin"}
+
+
+@dataclass(frozen=True)
+class RecordedRequest:
+    """Записанный запрос к API."""
+    t: float
+    method: str
+    path: str
+    headers: dict[str, str] = field(default_factory=dict)
+    body: str | None = None
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> 'RecordedRequest':
+        """Raises:
+            ValueError: В записи нет метода или пути.
+        """
+        method, path = data.get("method"), data.get("path")
+        if not isinstance(method, str) or not isinstance(path, str) or not path.startswith("/"):
+            raise ValueError("Recorded request must have 'method' and absolute 'path'")
+        return cls(
+            t=float(data.get("t") or 0.0),
+            method=method.upper(),
+            path=path,
+            headers={str(k): str(v) for k, v in (data.get("headers") or {}).items()},
+            body=data.get("body"),
+        )
+
+    def as_dict(self) -> dict[str, Any]:
+        data: dict[str, Any] = {"t": self.t, "method": self.method, "path": self.path}
+        if self.headers:
+            data["headers"] = self.headers
+        if self.body is not None:
+            data["body"] = self.body
+        return data
+
+
+def load_requests(lines: Iterable[str]) -> Iterator[RecordedRequest]:
+    """Разбирает записанные запросы. Пустые строки пропускаются.
+
+    Raises:
+        ValueError: Строка не является записью запроса, в сообщении - номер строки.
+    """
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield RecordedRequest.from_dict(json.loads(line))
+        except (ValueError, TypeError, AttributeError) as exc:
+            raise ValueError(f"Line {number}: {exc}") from exc
+
+
+class RequestRecorder:
+    """Хук `before_request`, дописывающий запросы в JSONL файл. Потокобезопасный.
+
+    Пример использования:
+    ```python
+    app.before_request(RequestRecorder(open("traffic.jsonl", "a", encoding="utf-8")))
+    ```
+    """
+    def __init__(self, stream: IO[str]) -> None:
+        self.stream = stream
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_path(cls, path: str) -> 'RequestRecorder':
+        return cls(open(path, "a", encoding="utf-8", buffering=1))
+
+    def __call__(self) -> None:
+        if request.blueprint in NOT_RECORDED_BLUEPRINTS:
+            return None
+        body = request.get_data(cache=True)
+        recorded = RecordedRequest(
+            t=time.time(),
+            method=request.method,
+            path=request.full_path.rstrip("?"),
+            headers={
+                name: request.headers[name] for name in RECORDED_HEADERS if name in request.headers
+            },
+            body=body.decode("utf-8", errors="replace") if body else None,
+        )
+        line = json.dumps(recorded.as_dict(), ensure_ascii=False)
+        with self._lock:
+            self.stream.write(line + "\n")
+        return None
+
+
+class ReplayTarget(Protocol):
+    """Куда отправляются запросы при воспроизведении."""
+    def send(self, recorded: RecordedRequest) -> int:
+        """Выполняет запрос.
+
+        Returns:
+            int: HTTP статус ответа.
+        """
+        ...
+
+    def metrics_snapshot(self) -> dict[str, Any] | None:
+        """Снимок метрик приложения (`metrics.snapshot()`) или None, если недоступен."""
+        ...
+
+
+class AppTarget:
+    """Воспроизведение в текущем процессе через тестовый клиент Flask.
+    Метрики общие с приложением, поэтому видны все воркеры-потоки
+    """
+    def __init__(self, app: Flask) -> None:
+        self.app = app
+        self._local = threading.local()
+
+    def send(self, recorded: RecordedRequest) -> int:
+        # У тестового клиента своё состояние (куки), по клиенту на поток
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.open(
+            recorded.path, method=recorded.method, headers=recorded.headers,
+            data=recorded.body.encode() if recorded.body is not None else None,
+        )
+        return response.status_code
+
+    def metrics_snapshot(self) -> dict[str, Any] | None:
+        return metrics.snapshot()
+
+
+class HttpTarget:
+    """Воспроизведение на запущенном сервере по HTTP."""
+    def __init__(self, base_url: str, admin_token: str = "", timeout: float = 30.0) -> None:
+        self.base_url = base_url.rstrip("/")
+        self.admin_token = admin_token
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _session(self) -> Any:
+        import requests
+
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def send(self, recorded: RecordedRequest) -> int:
+        response = self._session().request(
+            recorded.method, self.base_url + recorded.path, headers=recorded.headers,
+            data=recorded.body.encode() if recorded.body is not None else None,
+            timeout=self.timeout,
+        )
+        return response.status_code
+
+    def metrics_snapshot(self) -> dict[str, Any] | None:
+        if not self.admin_token:
+            return None
+        try:
+            response = self._session().get(
+                self.base_url + "/admin/metrics", timeout=self.timeout,
+                headers={"Authorization": f"Bearer {self.admin_token}"},
+            )
+        except Exception as exc:
+            logger.warning("Cannot fetch metrics: %s", exc)
+            return None
+        if response.status_code != 200:
+            logger.warning("Cannot fetch metrics: HTTP %d", response.status_code)
+            return None
+        return response.json()
+
+
+def diff_metrics(before: dict[str, Any], after: dict[str, Any]) -> dict[str, Any]:
+    """Изменение метрик между двумя снимками `metrics.snapshot()`.
+    Для сводок `max` - максимум за всё время процесса, а не за прогон.
+    """
+    counters_before = before.get("counters", {})
+    counters = {
+        name: value - counters_before.get(name, 0)
+        for name, value in after.get("counters", {}).items()
+        if value != counters_before.get(name, 0)
+    }
+    summaries_before = before.get("summaries", {})
+    summaries: dict[str, dict[str, float]] = {}
+    for name, summary in after.get("summaries", {}).items():
+        previous = summaries_before.get(name, {})
+        count = summary["count"] - previous.get("count", 0)
+        if not count:
+            continue
+        total = summary["sum"] - previous.get("sum", 0.0)
+        summaries[name] = {"count": count, "sum": total, "avg": total / count, "max": summary["max"]}
+    return {"counters": counters, "summaries": summaries}
+
+
+def percentile(values: list[float], p: float) -> float:
+    """Перцентиль `p` (0-100) по ближайшему рангу. `values` отсортирован."""
+    if not values:
+        return 0.0
+    rank = max(1, min(len(values), math.ceil(p / 100 * len(values))))
+    return values[rank - 1]
+
+
+@dataclass
+class ReplayReport:
+    """Итоги прогона."""
+    requests: int
+    duration: float
+    latencies: list[float]
+    statuses: dict[str, int]
+    failures: int
+    max_lag: float
+    metrics: dict[str, Any] | None = None
+
+    @property
+    def errors(self) -> int:
+        """Ответы 5xx и запросы без ответа."""
+        return self.failures + sum(
+            count for status, count in self.statuses.items() if status.startswith("5")
+        )
+
+    @property
+    def throughput(self) -> float:
+        return self.requests / self.duration if self.duration > 0 else 0.0
+
+    def as_dict(self) -> dict[str, Any]:
+        latencies = sorted(self.latencies)
+        return {
+            "requests": self.requests,
+            "duration": round(self.duration, 3),
+            "throughput": round(self.throughput, 2),
+            "latency_ms": {
+                name: round(percentile(latencies, p) * 1000, 3)
+                for name, p in (("p50", 50), ("p90", 90), ("p99", 99), ("max", 100))
+            },
+            "statuses": dict(sorted(self.statuses.items())),
+            "failures": self.failures,
+            "error_rate": round(self.errors / self.requests, 4) if self.requests else 0.0,
+            "max_lag_ms": round(self.max_lag * 1000, 3),
+            "metrics": self.metrics,
+        }
+
+    def format(self) -> str:
+        data = self.as_dict()
+        latency = data["latency_ms"]
+        lines = [
+            f"requests    {data['requests']} in {data['duration']:.3f} s,"
+            f" {data['throughput']:.2f} req/s",
+            "latency ms  " + " ".join(f"{name}={value:.1f}" for name, value in latency.items()),
+            "statuses    " + " ".join(f"{s}={n}" for s, n in data["statuses"].items()),
+            f"errors      {self.errors} ({data['error_rate'] * 100:.2f}%),"
+            f" failed requests {self.failures}",
+            f"max lag     {data['max_lag_ms']:.1f} ms",
+        ]
+        if self.metrics is None:
+            lines.append("metrics     unavailable")
+            return "\n".join(lines)
+        for name, value in sorted(self.metrics["counters"].items()):
+            lines.append(f"  counter {name:<32} {value}")
+        for name, summary in sorted(self.metrics["summaries"].items()):
+            lines.append(
+                f"  summary {name:<32} count={summary['count']}"
+                f" avg={summary['avg'] * 1000:.2f}ms max={summary['max'] * 1000:.2f}ms"
+            )
+        return "\n".join(lines)
+
+
+class Replayer:
+    """Воспроизводит записанные запросы на `target` с сохранением интервалов между ними.
+
+    Args:
+        concurrency (int): Сколько запросов выполняется одновременно.
+        speed (float): Во сколько раз сжимать интервалы между запросами, `0` - без пауз.
+        rate (float): Не больше `rate` запросов в секунду, `0` - без ограничения.
+    """
+    def __init__(
+        self, target: ReplayTarget, concurrency: int = 1, speed: float = 1.0, rate: float = 0.0,
+    ) -> None:
+        if concurrency < 1:
+            raise ValueError("concurrency must be positive")
+        if speed < 0 or rate < 0:
+            raise ValueError("speed and rate must not be negative")
+        self.target = target
+        self.concurrency = concurrency
+        self.speed = speed
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._latencies: list[float] = []
+        self._statuses: Counter[str] = Counter()
+        self._failures = 0
+        self._max_lag = 0.0
+
+    def _send(self, recorded: RecordedRequest, scheduled: float, slots: threading.Semaphore) -> None:
+        started = time.perf_counter()
+        status: str | None = None
+        try:
+            status = str(self.target.send(recorded))
+        except Exception as exc:
+            logger.debug("Request %s %s failed: %s", recorded.method, recorded.path, exc)
+        finally:
+            slots.release()
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._max_lag = max(self._max_lag, started - scheduled)
+            if status is None:
+                self._failures += 1
+            else:
+                self._latencies.append(elapsed)
+                self._statuses[status] += 1
+
+    def run(self, recorded: Iterable[RecordedRequest]) -> ReplayReport:
+        before = self.target.metrics_snapshot()
+        slots = threading.Semaphore(self.concurrency)
+        count = 0
+        first_t: float | None = None
+        with ThreadPoolExecutor(self.concurrency, thread_name_prefix="replay") as pool:
+            started = time.perf_counter()
+            for index, item in enumerate(recorded):
+                if first_t is None:
+                    first_t = item.t
+                scheduled = started
+                if self.speed:
+                    scheduled += max(0.0, item.t - first_t) / self.speed
+                if self.rate:
+                    scheduled = max(scheduled, started + index / self.rate)
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                # Все исполнители заняты - ждём; опоздание попадёт в lag
+                slots.acquire()
+                pool.submit(self._send, item, scheduled, slots)
+                count += 1
+        duration = time.perf_counter() - started
+        after = self.target.metrics_snapshot()
+        return ReplayReport(
+            requests=count,
+            duration=duration,
+            latencies=self._latencies,
+            statuses=dict(self._statuses),
+            failures=self._failures,
+            max_lag=self._max_lag,
+            metrics=diff_metrics(before, after) if before is not None and after is not None else None,
+        )
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m vpncon.replay",
+        description="Replay recorded API traffic and report latency, errors and pool waits",
+    )
+    parser.add_argument("file", help="recorded requests, JSONL (see APP_RECORD_REQUESTS)")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="base URL of a running instance")
+    target.add_argument("--app", action="store_true",
+                        help="replay in process with the Flask test client")
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="requests in flight (default: 8)")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="time compression factor, 0 - no pauses (default: 1)")
+    parser.add_argument("--rate", type=float, default=0.0,
+                        help="max requests per second, 0 - unlimited (default: 0)")
+    parser.add_argument("--admin-token", default=Config.ADMIN_TOKEN,
+                        help="token for GET /admin/metrics with --url (default: ADMIN_TOKEN)")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    setup_logging()
+    if args.app:
+        from vpncon.app import create_app
+        replay_target: ReplayTarget = AppTarget(create_app())
+    else:
+        replay_target = HttpTarget(args.url, args.admin_token)
+
+    with open(args.file, "r", encoding="utf-8") as f:
+        report = Replayer(replay_target, args.concurrency, args.speed, args.rate).run(
+            load_requests(f)
+        )
+    print(json.dumps(report.as_dict(), indent=2) if args.json else report.format())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,155 @@
+"""Корректная остановка процесса.
+
+`ShutdownCoordinator` останавливает процесс по шагам:
+1. `begin_drain()` (по SIGTERM): новые запросы получают `503` с `Connection: close`,
+   `/readyz` отвечает `503`, чтобы балансировщик перестал слать трафик
+2. `shutdown()` (после завершения запросов веб-сервером): останавливает фоновые компоненты
+   через зарегистрированные хуки (инициализация БД, планировщик истечения, пул генерации ключей)
+3. ждёт завершения открытых транзакций до дедлайна `SHUTDOWN_TIMEOUT` секунд от начала остановки
+4. оставшимся транзакциям отменяет запросы, даёт `SHUTDOWN_CANCEL_GRACE` секунд на откат
+   и закрывает их соединения: postgres откатит транзакцию сам
+5. закрывает пулы соединений
+
+Пример подключения хука компонента:
+```python
+get_coordinator().register("expiry_scheduler", scheduler.stop)
+```
+"""
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Callable
+
+from flask import jsonify, request
+
+from vpncon import metrics
+from vpncon.config import Config
+
+
+logger = logging.getLogger(__name__)
+
+
+# Хук остановки компонента. Принимает оставшееся до дедлайна время в секундах
+ShutdownHook = Callable[[float], None]
+
+
+class ShutdownCoordinator:
+    """Остановка процесса: отказ новым запросам, ожидание транзакций, закрытие пулов."""
+    def __init__(self) -> None:
+        self.draining = threading.Event()
+        self.drain_started: float | None = None
+        self._hooks: dict[str, ShutdownHook] = {}
+        self._lock = threading.Lock()
+        self._done = False
+
+    def register(self, name: str, hook: ShutdownHook) -> None:
+        """Регистрирует хук остановки. Хук с тем же именем заменяется.
+        Хуки вызываются в обратном порядке регистрации
+        """
+        with self._lock:
+            self._hooks.pop(name, None)
+            self._hooks[name] = hook
+
+    def unregister(self, name: str) -> None:
+        with self._lock:
+            self._hooks.pop(name, None)
+
+    def begin_drain(self) -> None:
+        """Начинает остановку: новые запросы отклоняются. Повторный вызов ничего не делает."""
+        with self._lock:
+            if self.draining.is_set():
+                return
+            self.drain_started = time.monotonic()
+            self.draining.set()
+        metrics.inc("app.shutdown.drains")
+        logger.info("Shutdown started, new requests are rejected")
+
+    def shutdown(self, timeout: float | None = None) -> bool:
+        """Останавливает компоненты, дожидается транзакций и закрывает пулы.
+        Выполняется один раз, повторные вызовы ничего не делают.
+
+        Args:
+            timeout (float | None): Секунд на остановку от `begin_drain()`.
+                По умолчанию `SHUTDOWN_TIMEOUT`.
+        Returns:
+            bool: True, если все транзакции завершились сами до дедлайна.
+        """
+        self.begin_drain()
+        with self._lock:
+            if self._done:
+                return True
+            self._done = True
+            hooks = list(reversed(self._hooks.items()))
+        timeout = Config.SHUTDOWN_TIMEOUT if timeout is None else timeout
+        deadline = (self.drain_started or time.monotonic()) + timeout
+
+        for name, hook in hooks:
+            logger.debug("Stopping %s", name)
+            try:
+                hook(max(deadline - time.monotonic(), 0.0))
+            except Exception:
+                logger.exception("Failed to stop %s", name)
+
+        drained = self._drain_transactions(deadline)
+
+        from vpncon.db import close_pool
+        close_pool()
+        elapsed = time.monotonic() - (self.drain_started or deadline - timeout)
+        metrics.observe("app.shutdown.seconds", elapsed)
+        logger.info("Shutdown finished in %.1fs, drained: %s", elapsed, drained)
+        return drained
+
+    def _drain_transactions(self, deadline: float) -> bool:
+        # Транзакций не было, если модуль БД даже не импортировался
+        if "vpncon.db" not in sys.modules:
+            return True
+        from vpncon.db.admission import admission_gates, wait_all_idle
+
+        if wait_all_idle(max(deadline - time.monotonic(), 0.0)):
+            return True
+
+        postgres_db = sys.modules.get("vpncon.db.postgres_db")
+        if postgres_db is None:
+            in_use = sum(gate.in_use for gate in admission_gates())
+            logger.warning("Shutdown deadline exceeded with %d open transactions", in_use)
+            return False
+        cancelled = postgres_db.cancel_active()
+        metrics.inc("app.shutdown.cancelled", cancelled)
+        logger.warning("Shutdown deadline exceeded, cancelled %d open transactions", cancelled)
+        if not wait_all_idle(Config.SHUTDOWN_CANCEL_GRACE):
+            closed = postgres_db.close_active()
+            metrics.inc("app.shutdown.closed", closed)
+            logger.warning("Closed %d connections with unfinished transactions", closed)
+        return False
+
+
+_coordinator = ShutdownCoordinator()
+
+def get_coordinator() -> ShutdownCoordinator:
+    """Возвращает координатор остановки процесса."""
+    return _coordinator
+
+
+def _reset_coordinator_after_fork() -> None:
+    # Хуки родителя останавливают компоненты родителя
+    global _coordinator
+    _coordinator = ShutdownCoordinator()
+
+os.register_at_fork(after_in_child=_reset_coordinator_after_fork)
+
+
+# Эндпоинты, которые отвечают и во время остановки
+NOT_DRAINED_BLUEPRINTS = frozenset({"health"})
+
+def reject_when_draining():
+    """`before_request` хук: во время остановки отвечает `503` и закрывает соединение."""
+    if not _coordinator.draining.is_set() or request.blueprint in NOT_DRAINED_BLUEPRINTS:
+        return None
+    metrics.inc("app.shutdown.rejected")
+    response = jsonify({'error': 'Service is shutting down, retry later'})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(Config.DB_RETRY_AFTER)
+    response.headers['Connection'] = 'close'
+    return response
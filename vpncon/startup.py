@@ -0,0 +1,131 @@
+"""Профиль холодного старта приложения.
+
+`create_app()` записывает в `StartupProfile` время каждой фазы сборки приложения
+и время первых импортов тяжёлых модулей, результат пишется в лог и доступен
+через `app.extensions["startup_profile"]`.
+
+Проверка холодного старта в отдельном процессе:
+```sh
+python -m vpncon.startup            # отчёт по фазам и импортам
+python -m vpncon.startup --check    # код возврата 1, если дольше APP_STARTUP_TARGET
+```
+"""
+import argparse
+import builtins
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+from vpncon import metrics
+
+
+# Импорты быстрее этого порога в отчёт не попадают
+HEAVY_IMPORT_THRESHOLD = 0.005
+
+
+class StartupProfile:
+    """Время фаз старта и первых импортов модулей."""
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.phases: dict[str, float] = {}
+        self.imports: dict[str, float] = {}
+        self._import_depth = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Замеряет фазу `name`. Повторные замеры одной фазы суммируются."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.phases[name] = self.phases.get(name, 0.0) + elapsed
+            metrics.observe(f"app.startup.{name}_seconds", elapsed)
+
+    @contextmanager
+    def track_imports(self) -> Iterator[None]:
+        """Замеряет импорты модулей, которые ещё не загружены, внутри блока.
+        Учитываются только импорты верхнего уровня, время вложенных входит в них
+        """
+        original_import = builtins.__import__
+
+        def timed_import(name: str, *args: Any, **kwargs: Any) -> Any:
+            level = args[3] if len(args) > 3 else kwargs.get("level", 0)
+            # Относительные импорты - часть загрузки своего пакета
+            if level or name in sys.modules or self._import_depth:
+                return original_import(name, *args, **kwargs)
+            self._import_depth += 1
+            started = time.perf_counter()
+            try:
+                return original_import(name, *args, **kwargs)
+            finally:
+                self._import_depth -= 1
+                with self._lock:
+                    self.imports[name] = (
+                        self.imports.get(name, 0.0) + time.perf_counter() - started
+                    )
+
+        builtins.__import__ = timed_import
+        try:
+            yield
+        finally:
+            builtins.__import__ = original_import
+
+    @property
+    def total(self) -> float:
+        """Секунд с создания профиля."""
+        return time.perf_counter() - self.started
+
+    def heavy_imports(self) -> list[tuple[str, float]]:
+        """Импорты дольше `HEAVY_IMPORT_THRESHOLD`, самые долгие первыми."""
+        heavy = [(n, t) for n, t in self.imports.items() if t >= HEAVY_IMPORT_THRESHOLD]
+        return sorted(heavy, key=lambda item: item[1], reverse=True)
+
+    def report(self) -> str:
+        lines = [f"Startup took {self.total * 1000:.1f} ms"]
+        lines.extend(
+            f"  phase  {name:<24} {elapsed * 1000:8.1f} ms"
+            for name, elapsed in self.phases.items()
+        )
+        lines.extend(
+            f"  import {name:<24} {elapsed * 1000:8.1f} ms"
+            for name, elapsed in self.heavy_imports()
+        )
+        return "\n".join(lines)
+
+
+def main(argv: list[str] | None = None) -> int:
+    # Замер начинается до импорта приложения: импорт Flask и драйвера БД - часть старта
+    profile = StartupProfile()
+    with profile.track_imports(), profile.phase("import"):
+        from vpncon.app import create_app
+        from vpncon.config import Config
+
+    parser = argparse.ArgumentParser(
+        prog="python -m vpncon.startup",
+        description="Measure the cold start of the application",
+    )
+    parser.add_argument(
+        "--check", action="store_true",
+        help="fail if the start takes longer than APP_STARTUP_TARGET seconds",
+    )
+    parser.add_argument(
+        "--target", type=float, default=Config.APP_STARTUP_TARGET,
+        help="target start time in seconds for --check",
+    )
+    args = parser.parse_args(argv)
+
+    create_app(profile=profile)
+    total = profile.total
+    print(profile.report())
+    if args.check and total > args.target:
+        print(f"FAIL: startup {total:.3f}s exceeds the target {args.target:.3f}s")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,183 @@
+"""Подсчёт трафика пользователей по снимкам `wg show dump`.
+
+Счётчики WireGuard накопительные, поэтому в БД пишутся только приращения:
+- `DeltaTracker` помнит последние счётчики каждого пира каждого шлюза и считает приращения,
+  учитывая сброс счётчиков (перезапуск интерфейса или шлюза)
+- `RollupBuffer` копит приращения в памяти, уже свёрнутые по минутам,
+  и сбрасывает их в БД одним запросом сразу во все таблицы: минутную, часовую и дневную
+
+Таким образом нагрузка на БД зависит от количества активных пиров за интервал сброса,
+а не от частоты снимков и количества шлюзов.
+
+При шардировании шард пира по публичному ключу неизвестен, поэтому пачка пишется
+на каждый шард в своей транзакции: каждый шард оставляет приращения только своих пиров.
+"""
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import Iterable
+
+from vpncon.db import auto_transaction, get_db_executor, shard_count
+from .dump import PeerSample
+
+
+logger = logging.getLogger(__name__)
+
+
+class DeltaTracker:
+    """Считает приращения счётчиков пиров между снимками одного шлюза."""
+    def __init__(self) -> None:
+        self._last: dict[tuple[str, str, str], tuple[int, int]] = {}
+
+    def update(
+        self, gateway: str, samples: Iterable[PeerSample]
+    ) -> list[tuple[str, int, int]]:
+        """Принимает очередной снимок шлюза и возвращает приращения.
+
+        Первый снимок пира служит точкой отсчёта и приращения не даёт.
+        Если счётчик уменьшился, значит он был сброшен, и приращением считается новое значение.
+
+        Returns:
+            list[tuple[str, int, int]]: Публичный ключ, приращение rx и tx.
+                Пиры без трафика не возвращаются.
+        """
+        deltas: list[tuple[str, int, int]] = []
+        for sample in samples:
+            key = (gateway, sample.interface, sample.public_key)
+            last = self._last.get(key)
+            self._last[key] = (sample.rx_bytes, sample.tx_bytes)
+            if last is None:
+                continue
+            last_rx, last_tx = last
+            rx = sample.rx_bytes - last_rx if sample.rx_bytes >= last_rx else sample.rx_bytes
+            tx = sample.tx_bytes - last_tx if sample.tx_bytes >= last_tx else sample.tx_bytes
+            if rx or tx:
+                deltas.append((sample.public_key, rx, tx))
+        return deltas
+
+
+def minute_bucket(at: datetime) -> datetime:
+    """Начало минуты, к которой относится момент `at`."""
+    return at.astimezone(timezone.utc).replace(second=0, microsecond=0)
+
+
+# Пишет одну пачку сразу во все три таблицы. Приращения по публичному ключу
+# переводятся в пользователей через `peers`, трафик неизвестных ключей отбрасывается.
+# Строки вставляются в порядке первичного ключа: параллельные сбросы с разных воркеров
+# блокируют общие строки в одном порядке и не взаимоблокируются.
+# Часы и дни отсчитываются в UTC, а не в часовом поясе сессии
+FLUSH_SQL = """
+    WITH deltas AS (
+        SELECT p.telegram_id, d.bucket, sum(d.rx_bytes) AS rx_bytes, sum(d.tx_bytes) AS tx_bytes
+        FROM unnest(
+            %(public_keys)s::VARCHAR[], %(buckets)s::TIMESTAMPTZ[],
+            %(rx)s::BIGINT[], %(tx)s::BIGINT[]
+        ) AS d(public_key, bucket, rx_bytes, tx_bytes)
+        JOIN peers p USING (public_key)
+        GROUP BY p.telegram_id, d.bucket
+    ), minute AS (
+        INSERT INTO traffic_minute AS t (telegram_id, bucket, rx_bytes, tx_bytes)
+        SELECT telegram_id, bucket, rx_bytes, tx_bytes FROM deltas
+        ORDER BY telegram_id, bucket
+        ON CONFLICT (telegram_id, bucket) DO UPDATE
+            SET rx_bytes = t.rx_bytes + EXCLUDED.rx_bytes,
+                tx_bytes = t.tx_bytes + EXCLUDED.tx_bytes
+    ), hour AS (
+        INSERT INTO traffic_hour AS t (telegram_id, bucket, rx_bytes, tx_bytes)
+        SELECT telegram_id, date_trunc('hour', bucket, 'UTC'), sum(rx_bytes), sum(tx_bytes)
+        FROM deltas GROUP BY 1, 2 ORDER BY 1, 2
+        ON CONFLICT (telegram_id, bucket) DO UPDATE
+            SET rx_bytes = t.rx_bytes + EXCLUDED.rx_bytes,
+                tx_bytes = t.tx_bytes + EXCLUDED.tx_bytes
+    )
+    INSERT INTO traffic_day AS t (telegram_id, bucket, rx_bytes, tx_bytes)
+    SELECT telegram_id, date_trunc('day', bucket, 'UTC'), sum(rx_bytes), sum(tx_bytes)
+    FROM deltas GROUP BY 1, 2 ORDER BY 1, 2
+    ON CONFLICT (telegram_id, bucket) DO UPDATE
+        SET rx_bytes = t.rx_bytes + EXCLUDED.rx_bytes,
+            tx_bytes = t.tx_bytes + EXCLUDED.tx_bytes
+"""
+
+
+class RollupBuffer:
+    """Буфер приращений, свёрнутых по (публичный ключ, минута).
+    Потокобезопасный: снимки разных шлюзов можно добавлять из разных потоков
+    """
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._rows: dict[tuple[str, datetime], list[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def add(self, at: datetime, deltas: Iterable[tuple[str, int, int]]) -> None:
+        bucket = minute_bucket(at)
+        with self._lock:
+            for public_key, rx, tx in deltas:
+                row = self._rows.get((public_key, bucket))
+                if row is None:
+                    self._rows[(public_key, bucket)] = [rx, tx]
+                else:
+                    row[0] += rx
+                    row[1] += tx
+
+    def drain(self) -> dict[tuple[str, datetime], list[int]]:
+        """Забирает накопленные строки и очищает буфер."""
+        with self._lock:
+            rows, self._rows = self._rows, {}
+        return rows
+
+    def flush(self) -> int:
+        """Записывает накопленное в БД. При ошибке записи строки возвращаются в буфер.
+
+        Returns:
+            int: Количество записанных строк буфера.
+        """
+        rows = self.drain()
+        if not rows:
+            return 0
+        # Строки, ещё не записанные ни на один шард
+        pending = rows
+        try:
+            for shard in range(shard_count()):
+                if not pending:
+                    break
+                written = write_rollups(pending, shard)
+                pending = {key: row for key, row in pending.items() if key[0] not in written}
+        except Exception:
+            # Записанное на предыдущие шарды уже закоммичено и в буфер не возвращается
+            with self._lock:
+                for (public_key, bucket), (rx, tx) in pending.items():
+                    row = self._rows.setdefault((public_key, bucket), [0, 0])
+                    row[0] += rx
+                    row[1] += tx
+            raise
+        logger.debug("Flushed %d traffic rows", len(rows))
+        return len(rows)
+
+
+@auto_transaction(retries=3)
+def write_rollups(rows: dict[tuple[str, datetime], list[int]], shard: int = 0) -> set[str]:
+    """Записывает приращения пиров шарда `shard` во все таблицы трафика одним запросом.
+
+    Returns:
+        set[str]: Публичные ключи из `rows`, чьи приращения записаны на этот шард.
+    """
+    executor = get_db_executor()
+    executor.route_shard(shard)
+    keys = list(rows)
+    public_keys = {k[0] for k in keys}
+    executor.execute(
+        FLUSH_SQL,
+        public_keys=[k[0] for k in keys],
+        buckets=[k[1] for k in keys],
+        rx=[rows[k][0] for k in keys],
+        tx=[rows[k][1] for k in keys],
+    )
+    if shard_count() == 1:
+        return public_keys
+    result = executor.execute(
+        "SELECT public_key FROM peers WHERE public_key = ANY(%(public_keys)s)",
+        public_keys=list(public_keys),
+    )
+    return {row[0] for row in result}
@@ -0,0 +1,77 @@
+"""Разбор вывода `wg show <iface> dump` и `wg show all dump`.
+
+Формат (поля разделены табуляцией):
+- строка интерфейса: `private-key public-key listen-port fwmark`
+- строка пира: `public-key preshared-key endpoint allowed-ips latest-handshake
+  transfer-rx transfer-tx persistent-keepalive`
+
+В `wg show all dump` перед каждой строкой добавлено имя интерфейса.
+Повторная строка уже встреченного интерфейса начинает новый снимок,
+поэтому несколько сохранённых подряд снимков одного шлюза читаются из одного файла.
+"""
+from dataclasses import dataclass
+from typing import Iterable, Iterator
+
+
+# Количество полей без имени интерфейса
+INTERFACE_FIELDS = 4
+PEER_FIELDS = 8
+
+
+@dataclass(frozen=True, slots=True)
+class PeerSample:
+    """Счётчики пира в одном снимке."""
+    interface: str
+    public_key: str
+    rx_bytes: int
+    tx_bytes: int
+
+
+def parse_dump(lines: Iterable[str], interface: str = "") -> Iterator[list[PeerSample]]:
+    """Потоково разбирает вывод `wg show dump` и возвращает снимки по одному.
+    Память ограничена размером одного снимка, а не всего файла.
+
+    Args:
+        lines (Iterable[str]): Строки вывода, например открытый файл или stdout процесса.
+        interface (str): Имя интерфейса для формата `wg show <iface> dump`.
+    Raises:
+        ValueError: Если строка не похожа ни на интерфейс, ни на пира.
+    """
+    snapshot: list[PeerSample] = []
+    started = False
+    seen_interfaces: set[str] = set()
+    for line_no, line in enumerate(lines, start=1):
+        line = line.rstrip("\n")
+        if not line or line.startswith("#"):
+            continue
+        fields = line.split("\t")
+        if len(fields) in (INTERFACE_FIELDS, INTERFACE_FIELDS + 1):
+            name = fields[0] if len(fields) > INTERFACE_FIELDS else interface
+            if name in seen_interfaces:
+                # Начало нового снимка: отдаём предыдущий
+                yield snapshot
+                snapshot = []
+                seen_interfaces.clear()
+            seen_interfaces.add(name)
+            started = True
+            continue
+
+        if len(fields) == PEER_FIELDS:
+            iface = interface
+        elif len(fields) == PEER_FIELDS + 1:
+            iface, fields = fields[0], fields[1:]
+        else:
+            raise ValueError(f"Unexpected wg dump line {line_no}: {line!r}")
+        try:
+            snapshot.append(PeerSample(
+                interface=iface,
+                public_key=fields[0],
+                rx_bytes=int(fields[5]),
+                tx_bytes=int(fields[6]),
+            ))
+        except ValueError as exc:
+            raise ValueError(f"Invalid counters in wg dump line {line_no}: {line!r}") from exc
+        started = True
+
+    if started:
+        yield snapshot
@@ -0,0 +1,109 @@
+"""Загрузка снимков `wg show dump` в таблицы трафика.
+
+Сохранённые снимки (например, для тестов и бенчмарков):
+```sh
+python -m vpncon.traffic.ingest --gateway gw1 --at 1760000000 --interval 5 gw1.dump
+```
+Живой сбор с локального интерфейса:
+```sh
+python -m vpncon.traffic.ingest --gateway gw1 --live wg0 --interval 5
+```
+"""
+import argparse
+import logging
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Iterable
+
+from vpncon.config import Config, setup_logging
+from .accounting import DeltaTracker, RollupBuffer
+from .dump import parse_dump
+
+
+logger = logging.getLogger(__name__)
+
+
+def ingest_snapshots(
+    gateway: str,
+    lines: Iterable[str],
+    start: datetime,
+    interval: float,
+    tracker: DeltaTracker,
+    buffer: RollupBuffer,
+    interface: str = "",
+) -> int:
+    """Разбирает снимки из `lines` и копит приращения в `buffer`.
+    Снимкам присваивается время `start`, `start + interval`, ...
+
+    Returns:
+        int: Количество разобранных снимков.
+    """
+    count = 0
+    for count, snapshot in enumerate(parse_dump(lines, interface), start=1):
+        at = start + timedelta(seconds=interval * (count - 1))
+        buffer.add(at, tracker.update(gateway, snapshot))
+        if len(buffer) >= Config.TRAFFIC_FLUSH_ROWS:
+            buffer.flush()
+    return count
+
+
+def _run_live(gateway: str, interface: str, interval: float) -> None:
+    tracker = DeltaTracker()
+    buffer = RollupBuffer()
+    last_flush = time.monotonic()
+    while True:
+        output = subprocess.run(
+            ["wg", "show", interface, "dump"], capture_output=True, text=True, check=True
+        ).stdout
+        ingest_snapshots(
+            gateway, output.splitlines(), datetime.now(timezone.utc), interval,
+            tracker, buffer, interface
+        )
+        if time.monotonic() - last_flush >= Config.TRAFFIC_FLUSH_INTERVAL:
+            buffer.flush()
+            last_flush = time.monotonic()
+        time.sleep(interval)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m vpncon.traffic.ingest",
+        description="Ingest `wg show dump` snapshots into traffic rollup tables",
+    )
+    parser.add_argument("files", nargs="*", help="saved dump files, one or more snapshots each")
+    parser.add_argument("--gateway", required=True, help="gateway name")
+    parser.add_argument("--interface", default="", help="interface name for `wg show <iface> dump`")
+    parser.add_argument("--live", metavar="IFACE", help="sample `wg show IFACE dump` periodically")
+    parser.add_argument("--at", type=float, default=None,
+                        help="unix time of the first saved snapshot (default: now)")
+    parser.add_argument("--interval", type=float, default=5.0,
+                        help="seconds between snapshots (default: 5)")
+    args = parser.parse_args(argv)
+
+    setup_logging()
+    if args.live:
+        _run_live(args.gateway, args.live, args.interval)
+        return 0
+
+    start = (
+        datetime.fromtimestamp(args.at, timezone.utc) if args.at is not None
+        else datetime.now(timezone.utc)
+    )
+    tracker = DeltaTracker()
+    buffer = RollupBuffer()
+    snapshots = 0
+    for path in args.files:
+        with open(path, "r", encoding="utf-8") as f:
+            at = start + timedelta(seconds=args.interval * snapshots)
+            snapshots += ingest_snapshots(
+                args.gateway, f, at, args.interval, tracker, buffer, args.interface
+            )
+    buffer.flush()
+    print(f"snapshots={snapshots}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
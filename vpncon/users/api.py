@@ -1,34 +1,110 @@
+from datetime import datetime
 from flask import jsonify, request
-from vpncon.db import auto_transaction
+from vpncon.config import Config
+from vpncon.db import auto_transaction, Priority
+from vpncon.encoding import encode_page, encode_response
+from vpncon.exceptions import EntityValidationFailedException
+from vpncon.idempotency import idempotent
+from vpncon.ratelimit import rate_limit_request
 from ..users import users_bp, user_service
 
 
+# Проверяется до открытия транзакции в эндпоинте
+users_bp.before_request(rate_limit_request)
+
+
+def _parse_datetime(value: str | None) -> datetime | None:
+    """ISO 8601 строка из запроса в datetime. Пустое значение - без срока"""
+    if not value:
+        return None
+    return datetime.fromisoformat(value)
+
+
 @users_bp.route('/<int:telegram_id>', methods=['GET'])
-@auto_transaction
+# Дешёвое чтение, должно проходить даже во время всплеска записей
+@auto_transaction(priority=Priority.HIGH)
 def api_get_user(telegram_id:int):
     user = user_service.get_user(telegram_id)
     if user:
-        return jsonify(user)
+        return encode_response(user)
     return jsonify({'error': 'User not found'}), 404
 
-@users_bp.route('/', methods=['POST'])
+@users_bp.route('/', methods=['GET'])
+@auto_transaction(priority=Priority.HIGH)
+def api_list_users():
+    after = request.args.get('after', type=int)
+    limit = request.args.get('limit', default=Config.USERS_PAGE_SIZE, type=int)
+    if not 0 < limit <= Config.USERS_PAGE_MAX_SIZE:
+        return jsonify(
+            {'error': f'limit must be between 1 and {Config.USERS_PAGE_MAX_SIZE}'}
+        ), 400
+    users = user_service.list_users(after, limit)
+    next_after = users[-1].telegram_id if len(users) == limit else None
+    return encode_page('users', users, next_after=next_after)
+
+@users_bp.route('/search', methods=['GET'])
 @auto_transaction
+def api_search_users():
+    nick = request.args.get('nick', default='').strip()
+    if not nick:
+        return jsonify({'error': 'nick must not be empty'}), 400
+    limit = request.args.get('limit', default=Config.USERS_SEARCH_LIMIT, type=int)
+    if not 0 < limit <= Config.USERS_SEARCH_MAX_LIMIT:
+        return jsonify(
+            {'error': f'limit must be between 1 and {Config.USERS_SEARCH_MAX_LIMIT}'}
+        ), 400
+    fuzzy = request.args.get('fuzzy', default='true') != 'false'
+    users = user_service.search_users(nick, limit, fuzzy)
+    return encode_page('users', users)
+
+@users_bp.route('/stats', methods=['GET'])
+@auto_transaction(priority=Priority.HIGH)
+def api_users_stats():
+    days = request.args.get('days', default=Config.USERS_STATS_DAYS, type=int)
+    if not 0 < days <= Config.USERS_STATS_MAX_DAYS:
+        return jsonify(
+            {'error': f'days must be between 1 and {Config.USERS_STATS_MAX_DAYS}'}
+        ), 400
+    return encode_response(user_service.get_stats(days))
+
+@users_bp.route('/', methods=['POST'])
+@auto_transaction(retries=3)
+@idempotent(shard_by="telegram_id")
 def api_create_user():
     data = request.json
     user_service.create_user(
-        data.get('telegram_id'), data.get('telegram_nick'), data.get('role')
+        data.get('telegram_id'), data.get('telegram_nick'), data.get('role'),
+        _parse_datetime(data.get('expires_at'))
     )
     return jsonify({'status': 'created'}), 201
 
 @users_bp.route('/', methods=['PUT'])
+@auto_transaction(retries=3)
+@idempotent(shard_by="telegram_id")
 def api_update_user():
     data = request.json
     user_service.update_user(
-        data.get('telegram_id'), data.get('telegram_nick'), data.get('role')
+        data.get('telegram_id'), data.get('telegram_nick'), data.get('role'),
+        _parse_datetime(data.get('expires_at'))
     )
     return jsonify({'status': 'updated'})
 
+@users_bp.route('/roles', methods=['PATCH'])
+def api_change_roles():
+    # Транзакции открывает сервис: по одной на шард
+    data = request.json
+    filter_ = data.get('filter')
+    try:
+        updated = user_service.change_roles(
+            data.get('role'), data.get('telegram_ids'),
+            filter_.get('role') if isinstance(filter_, dict) else None
+        )
+    except (EntityValidationFailedException, ValueError) as exc:
+        return jsonify({'error': str(exc)}), 400
+    return jsonify({'status': 'updated', 'updated': updated})
+
 @users_bp.route('/<int:telegram_id>', methods=['DELETE'])
+@auto_transaction(retries=3)
 def api_delete_user(telegram_id:int):
     user_service.delete_user(telegram_id)
     return jsonify({'status': 'deleted'})
@@ -4,7 +4,7 @@ from vpncon.db import auto_transaction, get_db_executor, UniqueConstraintError
 from .model import User
 
 
-@auto_transaction
+@auto_transaction(shard_by="telegram_id")
 def get_user(telegram_id:int) -> User | None:
     """Получает пользователя по его telegram_id.
     Args:
@@ -31,6 +31,101 @@ def get_user(telegram_id:int) -> User | None:
     return User.from_raw(result[0])
 
 @auto_transaction
+def list_users(after: int | None, limit: int) -> list[User]:
+    """Получает страницу пользователей, упорядоченных по telegram_id.
+    Постраничный проход по ключу: стоимость страницы не зависит от её номера.
+    При шардировании страница собирается из первых `limit` пользователей каждого шарда.
+
+    Args:
+        after (int | None): telegram_id последнего пользователя предыдущей страницы.
+        limit (int): Размер страницы.
+    Returns:
+        list[User]: Пользователи с telegram_id больше `after`.
+    """
+    executor = get_db_executor()
+    query = f"""
+        SELECT
+            {User.get_model_fields_joined()}
+        FROM users
+        WHERE telegram_id > %(after)s
+        ORDER BY telegram_id
+        LIMIT %(limit)s
+    """
+    # Без OR в условии, чтобы план всегда шёл по первичному ключу
+    params: dict[str, Any] = {
+        'after': after if after is not None else -2**63,
+        'limit': limit
+    }
+    result = executor.scatter(query, **params)
+    # Порядок и LIMIT повторяются над объединёнными ответами шардов
+    result.sort(key=lambda row: row[0])
+    return [User.from_raw(row) for row in result[:limit]]
+
+def _escape_like(value: str) -> str:
+    """Экранирует спецсимволы `LIKE`, чтобы строка сравнивалась буквально"""
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+@auto_transaction
+def search_users_by_prefix(nick: str, limit: int) -> list[User]:
+    """Ищет пользователей, ник которых начинается с `nick`, без учёта регистра.
+    Идёт по индексу `users_nick_prefix_idx`, см. миграцию `M_0007`:
+    в побайтовой сортировке `C` префикс - это диапазон индекса.
+
+    Args:
+        nick (str): Начало ника.
+        limit (int): Максимальное число пользователей.
+    Returns:
+        list[User]: Пользователи по возрастанию ника в нижнем регистре.
+    """
+    executor = get_db_executor()
+    query = f"""
+        SELECT
+            {User.get_model_fields_joined()}
+        FROM users
+        WHERE lower(telegram_nick) COLLATE "C" LIKE %(pattern)s ESCAPE '\\'
+        ORDER BY lower(telegram_nick) COLLATE "C", telegram_id
+        LIMIT %(limit)s
+    """
+    params: dict[str, Any] = {
+        'pattern': _escape_like(nick.lower()) + '%',
+        'limit': limit
+    }
+    result = executor.scatter(query, **params)
+    # Порядок строк python совпадает с побайтовым порядком UTF-8
+    result.sort(key=lambda row: (row[1].lower(), row[0]))
+    return [User.from_raw(row) for row in result[:limit]]
+
+@auto_transaction
+def search_users_fuzzy(nick: str, limit: int) -> list[User]:
+    """Ищет пользователей с похожим ником по триграммам `pg_trgm`, без учёта регистра.
+    Идёт по индексу `users_nick_trgm_idx`, см. миграцию `M_0007`.
+    Порог похожести - `pg_trgm.similarity_threshold` (по умолчанию 0.3).
+
+    Args:
+        nick (str): Искомый ник.
+        limit (int): Максимальное число пользователей.
+    Returns:
+        list[User]: Пользователи от самого похожего ника.
+    """
+    executor = get_db_executor()
+    query = f"""
+        SELECT
+            {User.get_model_fields_joined()},
+            lower(telegram_nick) <-> %(nick)s AS distance
+        FROM users
+        WHERE lower(telegram_nick) %% %(nick)s
+        ORDER BY distance, telegram_id
+        LIMIT %(limit)s
+    """
+    params: dict[str, Any] = {
+        'nick': nick.lower(),
+        'limit': limit
+    }
+    result = executor.scatter(query, **params)
+    result.sort(key=lambda row: (row[-1], row[0]))
+    return [User.from_raw(row[:-1]) for row in result[:limit]]
+
+@auto_transaction(shard_by="user.telegram_id")
 def create_user(user:User) -> None:
     """Создаёт нового пользователя.
     Если пользователь с таким telegram_id уже существует, бросает исключение.
@@ -41,12 +136,13 @@ def create_user(user:User) -> None:
     executor = get_db_executor()
     query = f"""
         INSERT INTO users ({User.get_model_fields_joined()})
-        VALUES (%(telegram_id)s, %(telegram_nick)s, %(role)s)
+        VALUES (%(telegram_id)s, %(telegram_nick)s, %(role)s, %(expires_at)s)
     """
     params: dict[str, Any] = {
         'telegram_id': user.telegram_id,
         'telegram_nick': user.telegram_nick,
-        'role': user.role
+        'role': user.role,
+        'expires_at': user.expires_at
     }
     try:
         executor.execute(query, **params)
@@ -56,7 +152,7 @@ def create_user(user:User) -> None:
             f"User with telegram_id={user.telegram_id} already exists"
         ) from exc
 
-@auto_transaction
+@auto_transaction(shard_by="user.telegram_id")
 def update_user(user:User) -> None:
     """Обновляет данные пользователя.
 
@@ -67,17 +163,61 @@ def update_user(user:User) -> None:
     query = f"""
         UPDATE users
         SET telegram_nick = %(telegram_nick)s,
-            role = %(role)s
+            role = %(role)s,
+            expires_at = %(expires_at)s
         WHERE telegram_id = %(telegram_id)s
     """
     params: dict[str, Any] = {
         'telegram_id': user.telegram_id,
         'telegram_nick': user.telegram_nick,
-        'role': user.role
+        'role': user.role,
+        'expires_at': user.expires_at
     }
     executor.execute(query, **params)
 
-@auto_transaction
+@auto_transaction(retries=3)
+def update_roles_by_ids(telegram_ids: list[int], role: str, shard: int = 0) -> list[int]:
+    """Меняет роль пользователям шарда `shard` из списка одним оператором.
+    История пишется триггером уровня оператора одним запросом на всю пачку.
+
+    Args:
+        telegram_ids (list[int]): Пользователи шарда `shard`.
+        role (str): Новая роль.
+    Returns:
+        list[int]: telegram_id пользователей, у которых роль изменилась.
+    """
+    executor = get_db_executor()
+    executor.route_shard(shard)
+    # Пользователи с той же ролью не трогаются: не пишут историю и не берут блокировки
+    query = """
+        UPDATE users
+        SET role = %(role)s
+        WHERE telegram_id = ANY(%(telegram_ids)s) AND role <> %(role)s
+        RETURNING telegram_id
+    """
+    result = executor.execute(query, telegram_ids=telegram_ids, role=role)
+    return [row[0] for row in result]
+
+@auto_transaction(retries=3)
+def update_roles_by_role(current_role: str, role: str, shard: int = 0) -> list[int]:
+    """Меняет роль `current_role` на `role` всем пользователям шарда `shard` одним оператором.
+
+    Returns:
+        list[int]: telegram_id пользователей, у которых роль изменилась.
+    """
+    executor = get_db_executor()
+    executor.route_shard(shard)
+    # Как и в `update_roles_by_ids`: смена роли на ту же не пишет историю и не берёт блокировки
+    query = """
+        UPDATE users
+        SET role = %(role)s
+        WHERE role = %(current_role)s AND role <> %(role)s
+        RETURNING telegram_id
+    """
+    result = executor.execute(query, current_role=current_role, role=role)
+    return [row[0] for row in result]
+
+@auto_transaction(shard_by="telegram_id")
 def delete_user(telegram_id: int) -> None:
     """Удаляет пользователя по его telegram_id.
 
@@ -0,0 +1,211 @@
+"""Планировщик истечения подписок.
+
+Переводит пользователей с истёкшим `expires_at` в `DEACTIVATED_USER`.
+- Не опрашивает таблицу: после прохода спит до ближайшего истечения
+  (поиск по частичному индексу `users_expires_at_idx`), но не дольше `EXPIRY_MAX_SLEEP`
+- Просыпается раньше по уведомлению `users_expiry`, которое триггеры шлют, только если
+  ближайшее истечение могло стать раньше: срок активного пользователя изменился или он стал активным
+- Деактивирует пачками по `EXPIRY_BATCH_SIZE` одним `UPDATE ... RETURNING` на пачку
+- Безопасен при запуске в нескольких воркерах: пачки разбираются через `FOR UPDATE SKIP LOCKED`
+- При шардировании проходит шарды по очереди и слушает уведомления только без шардирования,
+  иначе просыпается по таймеру
+
+Запуск отдельным процессом:
+```sh
+python -m vpncon.users.expiry          # работать постоянно
+python -m vpncon.users.expiry --once   # один проход
+```
+"""
+import argparse
+import logging
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import LiteralString
+
+import psycopg
+
+from vpncon.config import Config, setup_logging
+from vpncon.db import auto_transaction, get_db_executor, shard_count
+
+
+logger = logging.getLogger(__name__)
+
+
+NOTIFY_CHANNEL = "users_expiry"
+
+# Предикат по ролям записан литералом, чтобы планировщик мог использовать частичный индекс.
+# Должен совпадать с `EXPIRING_ROLES`, индексом из M_0005_add_users_expiry
+# и триггерами уведомлений из M_0011_narrow_users_expiry_notify
+EXPIRING_ROLES_SQL: LiteralString = "role IN ('ACTIVATED_USER', 'ACTIVATED_CLOSE_USER')"
+
+DEACTIVATE_DUE_SQL: LiteralString = f"""
+    WITH due AS (
+        SELECT telegram_id
+        FROM users
+        WHERE expires_at IS NOT NULL AND expires_at <= now() AND {EXPIRING_ROLES_SQL}
+        ORDER BY expires_at
+        LIMIT %(batch_size)s
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE users u
+    SET role = 'DEACTIVATED_USER'
+    FROM due
+    WHERE u.telegram_id = due.telegram_id
+    RETURNING u.telegram_id
+"""
+
+NEXT_DUE_SQL: LiteralString = f"""
+    SELECT min(expires_at)
+    FROM users
+    WHERE expires_at IS NOT NULL AND {EXPIRING_ROLES_SQL}
+"""
+
+
+@auto_transaction(retries=3)
+def deactivate_due_batch(batch_size: int, shard: int = 0) -> list[int]:
+    """Деактивирует одну пачку пользователей шарда `shard` с истёкшей подпиской.
+
+    Returns:
+        list[int]: telegram_id деактивированных пользователей.
+    """
+    executor = get_db_executor()
+    executor.route_shard(shard)
+    result = executor.execute(DEACTIVATE_DUE_SQL, batch_size=batch_size)
+    return [row[0] for row in result]
+
+
+@auto_transaction
+def get_next_due() -> datetime | None:
+    """Возвращает ближайший срок истечения среди активных пользователей всех шардов."""
+    result = get_db_executor().scatter(NEXT_DUE_SQL)
+    return min((row[0] for row in result if row[0] is not None), default=None)
+
+
+class ExpiryScheduler:
+    """Фоновый поток, деактивирующий пользователей по истечении подписки."""
+    def __init__(
+        self,
+        batch_size: int | None = None,
+        max_sleep: float | None = None,
+    ) -> None:
+        self.batch_size = batch_size or Config.EXPIRY_BATCH_SIZE
+        self.max_sleep = max_sleep or Config.EXPIRY_MAX_SLEEP
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._listener: psycopg.Connection | None = None
+
+    def run_pass(self) -> int:
+        """Деактивирует всех пользователей с истёкшей подпиской.
+
+        Returns:
+            int: Количество деактивированных пользователей.
+        """
+        total = 0
+        for shard in range(shard_count()):
+            while not self._stop.is_set():
+                deactivated = deactivate_due_batch(self.batch_size, shard)
+                total += len(deactivated)
+                if len(deactivated) < self.batch_size:
+                    break
+        if total:
+            logger.info("Deactivated %d users with expired subscription", total)
+        return total
+
+    def _seconds_until_next_due(self) -> float:
+        next_due = get_next_due()
+        if next_due is None:
+            return self.max_sleep
+        delay = (next_due - datetime.now(timezone.utc)).total_seconds()
+        return min(max(delay, 0.0), self.max_sleep)
+
+    def _open_listener(self) -> None:
+        """Открывает отдельное соединение для LISTEN. Без него планировщик просто спит."""
+        if shard_count() > 1:
+            # Уведомления шлёт каждый шард в своей базе
+            logger.info("Sharded DB, expiry scheduler uses timed wakeups")
+            return
+        try:
+            self._listener = psycopg.connect(Config.DB_URI, autocommit=True, connect_timeout=20)
+            self._listener.execute(f"LISTEN {NOTIFY_CHANNEL}")
+        except psycopg.Error:
+            logger.warning("Cannot LISTEN %s, falling back to timed wakeups", NOTIFY_CHANNEL)
+            self._listener = None
+
+    def _close_listener(self) -> None:
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
+
+    def _sleep(self, seconds: float) -> None:
+        """Спит `seconds` секунд или до уведомления об изменении сроков."""
+        deadline = time.monotonic() + seconds
+        # Ждём кусками, чтобы вовремя заметить остановку
+        while not self._stop.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            step = min(remaining, 1.0)
+            if self._listener is None:
+                self._stop.wait(step)
+                continue
+            for _ in self._listener.notifies(timeout=step, stop_after=1):
+                return
+
+    def run_forever(self) -> None:
+        """Основной цикл: проход, затем сон до ближайшего истечения."""
+        self._open_listener()
+        try:
+            while not self._stop.is_set():
+                try:
+                    self.run_pass()
+                    delay = self._seconds_until_next_due()
+                except Exception:
+                    logger.exception("Expiry pass failed")
+                    delay = self.max_sleep
+                logger.debug("Expiry scheduler sleeps for %.1fs", delay)
+                self._sleep(delay)
+        finally:
+            self._close_listener()
+
+    def start(self) -> None:
+        """Запускает планировщик в фоновом потоке."""
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self.run_forever, name="expiry-scheduler", daemon=True
+        )
+        self._thread.start()
+        from vpncon.shutdown import get_coordinator
+        get_coordinator().register("expiry_scheduler", self.stop)
+
+    def stop(self, timeout: float | None = None) -> None:
+        """Останавливает планировщик и закрывает соединение LISTEN."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m vpncon.users.expiry",
+        description="Deactivate users whose subscription has expired",
+    )
+    parser.add_argument("--once", action="store_true", help="run a single pass and exit")
+    args = parser.parse_args(argv)
+
+    setup_logging()
+    scheduler = ExpiryScheduler()
+    if args.once:
+        print(f"deactivated={scheduler.run_pass()}")
+        return 0
+    try:
+        scheduler.run_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
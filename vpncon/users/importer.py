@@ -0,0 +1,439 @@
+"""Массовый импорт пользователей из CSV/NDJSON.
+
+Предназначен для миграции больших объёмов пользователей (миллионы строк) из внешних систем.
+Вместо построчного `crud.create_user` файл потоково заливается через `COPY FROM STDIN`
+во временную staging таблицу, роли валидируются одним SQL запросом,
+а затем данные сливаются в `users` через `INSERT ... ON CONFLICT`.
+Весь импорт выполняется в одной транзакции: либо применится весь файл, либо ничего.
+
+Строки разбираются в python: нераспарсенные отбраковываются и попадают в отчёт, а не ломают COPY.
+При шардировании строки раскладываются по COPY в staging таблицы шардов,
+слияние выполняется на каждом шарде в своей транзакции. Коммиты идут только после
+успешного слияния на всех шардах, но атомарность гарантируется лишь в пределах шарда:
+сбой посреди коммитов оставит часть шардов с новыми данными.
+
+ВНИМАНИЕ: режимы истории `batch` (по умолчанию) и `off` отключают триггеры истории через
+`ALTER TABLE users DISABLE TRIGGER` внутри транзакции импорта. Это берёт на `users`
+блокировку SHARE ROW EXCLUSIVE до коммита: все INSERT/UPDATE/DELETE пользователей
+(API, планировщик истечений, смена ролей) ждут окончания импорта, а сам ALTER ждёт
+завершения уже идущих транзакций с записью в `users`. Под нагрузкой импортируйте
+с `--history row`: история пишется штатными триггерами уровня оператора без блокировки таблицы.
+
+Пример запуска:
+```sh
+python -m vpncon.users.importer users.csv
+python -m vpncon.users.importer users.ndjson --history batch
+```
+
+CSV должен содержать заголовок с колонками `telegram_id`, `telegram_nick`, `role` в любом порядке.
+NDJSON - по одному json объекту с теми же ключами на строку.
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+from contextlib import ExitStack
+from dataclasses import dataclass
+from enum import StrEnum
+from typing import IO, Any, Iterator, LiteralString
+
+import psycopg
+
+from vpncon.config import Config, setup_logging
+from vpncon.db import shard_count, shard_for
+from .model import Role
+
+
+logger = logging.getLogger(__name__)
+
+
+# Колонки, которые импортируются в users
+IMPORT_COLUMNS = ("telegram_id", "telegram_nick", "role")
+
+# Строка для COPY в порядке IMPORT_COLUMNS
+ImportRow = tuple[str | None, str | None, str | None]
+
+
+class ImportFormat(StrEnum):
+    """Формат входного файла."""
+    CSV = "csv"
+    NDJSON = "ndjson"
+
+
+class HistoryMode(StrEnum):
+    """Режим записи истории в `users_history` во время импорта.
+
+    - ROW: история пишется штатными триггерами уровня оператора (см. миграцию `M_0010`)
+    - BATCH: триггеры отключаются на время импорта, история пишется двумя set-based запросами
+    - OFF: триггеры отключаются, история не пишется
+
+    BATCH и OFF держат блокировку SHARE ROW EXCLUSIVE на `users` до коммита импорта
+    и блокируют любую запись пользователей (см. docstring модуля)
+    """
+    ROW = "row"
+    BATCH = "batch"
+    OFF = "off"
+
+
+@dataclass(frozen=True)
+class ImportReport:
+    """Итог импорта."""
+    total: int
+    inserted: int
+    updated: int
+    unchanged: int
+    rejected: int
+
+    def __str__(self) -> str:
+        return (
+            f"total={self.total} inserted={self.inserted} updated={self.updated}"
+            f" unchanged={self.unchanged} rejected={self.rejected}"
+        )
+
+
+# ===============================================
+# SQL
+# ===============================================
+# Staging таблица целиком текстовая, чтобы кривая строка не ломала весь COPY,
+# а отбраковывалась на этапе валидации
+CREATE_STAGING_SQL: LiteralString = """
+    CREATE TEMP TABLE users_import (
+        line_no BIGSERIAL,
+        telegram_id TEXT,
+        telegram_nick TEXT,
+        role TEXT
+    ) ON COMMIT DROP
+"""
+
+REJECT_INVALID_SQL: LiteralString = """
+    WITH rejected AS (
+        DELETE FROM users_import
+        WHERE telegram_id IS NULL
+           OR telegram_id !~ '^-?[0-9]{1,18}$'
+           OR telegram_nick IS NULL
+           OR length(telegram_nick) > 255
+           OR role IS NULL
+           OR role <> ALL(%(roles)s)
+        RETURNING 1
+    )
+    SELECT count(*) FROM rejected
+"""
+
+# Если id встречается в файле несколько раз - побеждает последняя строка
+CREATE_MERGED_SQL: LiteralString = """
+    CREATE TEMP TABLE users_import_merged ON COMMIT DROP AS
+    SELECT DISTINCT ON (telegram_id::BIGINT)
+        telegram_id::BIGINT AS telegram_id,
+        telegram_nick,
+        role
+    FROM users_import
+    ORDER BY telegram_id::BIGINT, line_no DESC
+"""
+
+# Пишет историю так же, как это делают триггеры `log_table_history_statement`:
+# для новых строк - новое значение с action = 'I', для изменённых - старое значение с 'U'.
+# Должен выполняться до слияния, пока в users лежат старые значения
+BATCH_HISTORY_SQL: list[LiteralString] = [
+    """
+    INSERT INTO users_history (telegram_id, telegram_nick, role, expires_at, action)
+    SELECT u.telegram_id, u.telegram_nick, u.role, u.expires_at, 'U'
+    FROM users u
+    JOIN users_import_merged m USING (telegram_id)
+    WHERE (u.telegram_nick, u.role) IS DISTINCT FROM (m.telegram_nick, m.role)
+    """,
+    """
+    INSERT INTO users_history (telegram_id, telegram_nick, role, action)
+    SELECT m.telegram_id, m.telegram_nick, m.role, 'I'
+    FROM users_import_merged m
+    WHERE NOT EXISTS (SELECT 1 FROM users u WHERE u.telegram_id = m.telegram_id)
+    """,
+]
+
+# xmax = 0 у только что вставленной строки, у обновлённой - id текущей транзакции
+MERGE_SQL: LiteralString = """
+    WITH merged AS (
+        INSERT INTO users (telegram_id, telegram_nick, role)
+        SELECT telegram_id, telegram_nick, role FROM users_import_merged
+        ON CONFLICT (telegram_id) DO UPDATE
+            SET telegram_nick = EXCLUDED.telegram_nick,
+                role = EXCLUDED.role
+            WHERE (users.telegram_nick, users.role)
+                IS DISTINCT FROM (EXCLUDED.telegram_nick, EXCLUDED.role)
+        RETURNING (xmax = 0) AS inserted
+    )
+    SELECT
+        count(*) FILTER (WHERE inserted),
+        count(*) FILTER (WHERE NOT inserted)
+    FROM merged
+"""
+
+# Слияние - INSERT ... ON CONFLICT DO UPDATE, срабатывают триггеры вставки и изменения
+DISABLE_HISTORY_TRIGGER_SQL: LiteralString = (
+    "ALTER TABLE users DISABLE TRIGGER users_history_insert_trigger,"
+    " DISABLE TRIGGER users_history_update_trigger"
+)
+ENABLE_HISTORY_TRIGGER_SQL: LiteralString = (
+    "ALTER TABLE users ENABLE TRIGGER users_history_insert_trigger,"
+    " ENABLE TRIGGER users_history_update_trigger"
+)
+
+
+# ===============================================
+# Загрузка в staging
+# ===============================================
+def _iter_ndjson(stream: IO[str]) -> Iterator[ImportRow | None]:
+    """Построчно разбирает NDJSON. Вместо нераспарсенных строк возвращает None."""
+    for line_no, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            raw = json.loads(line)
+            row = tuple(
+                None if raw.get(c) is None else str(raw.get(c)) for c in IMPORT_COLUMNS
+            )
+        except (ValueError, AttributeError):
+            logger.debug("Rejected NDJSON line %d: %r", line_no, line)
+            yield None
+            continue
+        yield row  # type: ignore[misc]
+
+
+def _iter_csv(stream: IO[str]) -> Iterator[ImportRow | None]:
+    """Разбирает CSV в python, приводя колонки к порядку `IMPORT_COLUMNS`.
+    Пустые значения, как и в COPY, считаются NULL. Вместо строк с неверным числом колонок
+    или испорченным CSV (например, NUL байт) возвращает None
+    """
+    reader = csv.reader(stream)
+    header = next(reader, [])
+    columns = [c.strip() for c in header]
+    if sorted(columns) != sorted(IMPORT_COLUMNS):
+        raise ValueError(
+            f"Invalid CSV header: {','.join(header)!r}. Expected columns: {IMPORT_COLUMNS}"
+        )
+    order = [columns.index(c) for c in IMPORT_COLUMNS]
+    while True:
+        try:
+            values = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as exc:
+            # Читатель продолжает со следующей строки
+            logger.debug("Rejected CSV line %d: %s", reader.line_num, exc)
+            yield None
+            continue
+        if len(values) != len(columns):
+            logger.debug("Rejected CSV line %d: %r", reader.line_num, values)
+            yield None
+            continue
+        yield tuple(values[i] or None for i in order)  # type: ignore[misc]
+
+
+def _iter_rows(stream: IO[str], fmt: ImportFormat) -> Iterator[ImportRow | None]:
+    """Строки файла в порядке `IMPORT_COLUMNS`, None вместо нераспарсенных.
+    Строки с NUL отбраковываются здесь же: postgres не хранит его в TEXT, и COPY упал бы целиком
+    """
+    rows = _iter_csv(stream) if fmt == ImportFormat.CSV else _iter_ndjson(stream)
+    for row in rows:
+        if row is not None and any(value is not None and "\0" in value for value in row):
+            row = None
+        yield row
+
+
+def _row_shard(telegram_id: str | None) -> int:
+    """Шард строки импорта. Строки с некорректным id отбракуются на первом шарде"""
+    try:
+        return shard_for(int(telegram_id))  # type: ignore[arg-type]
+    except (TypeError, ValueError):
+        return 0
+
+
+def _copy_rows(
+    cursors: list[psycopg.Cursor[Any]], stream: IO[str], fmt: ImportFormat
+) -> int:
+    """Раскладывает строки потока по staging таблицам шардов, по курсору на шард.
+
+    Returns:
+        int: Количество строк, отбракованных при разборе.
+    """
+    rows = _iter_rows(stream, fmt)
+    rejected = 0
+    with ExitStack() as stack:
+        copies = [
+            stack.enter_context(
+                cur.copy("COPY users_import (telegram_id, telegram_nick, role) FROM STDIN")
+            )
+            for cur in cursors
+        ]
+        for row in rows:
+            if row is None:
+                rejected += 1
+                continue
+            copies[_row_shard(row[0]) if len(copies) > 1 else 0].write_row(row)
+    return rejected
+
+
+def detect_format(path: str) -> ImportFormat:
+    """Определяет формат по расширению файла."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext in (".ndjson", ".jsonl"):
+        return ImportFormat.NDJSON
+    return ImportFormat.CSV
+
+
+# ===============================================
+# Импорт
+# ===============================================
+def _merge_staging(cur: psycopg.Cursor[Any], history: HistoryMode) -> tuple[int, int, int, int]:
+    """Валидирует загруженную staging таблицу и сливает её в `users`.
+
+    Returns:
+        tuple[int, int, int, int]: Загружено строк, отбраковано при валидации,
+            вставлено и обновлено пользователей.
+    """
+    cur.execute("SELECT count(*) FROM users_import")
+    loaded: int = cur.fetchone()[0]  # type: ignore[index]
+    logger.info("Loaded %d rows into staging table", loaded)
+
+    cur.execute(REJECT_INVALID_SQL, {"roles": [r.value for r in Role]})
+    rejected: int = cur.fetchone()[0]  # type: ignore[index]
+
+    cur.execute(CREATE_MERGED_SQL)
+    cur.execute("ANALYZE users_import_merged")
+
+    if history != HistoryMode.ROW:
+        # ALTER TABLE транзакционный: при откате триггер останется включённым.
+        # Он берёт SHARE ROW EXCLUSIVE на users до коммита: запись пользователей
+        # блокируется на весь импорт, зато история и слияние консистентны
+        logger.info("Suspending users history triggers")
+        cur.execute(DISABLE_HISTORY_TRIGGER_SQL)
+    if history == HistoryMode.BATCH:
+        logger.info("Writing users history in batch")
+        for query in BATCH_HISTORY_SQL:
+            cur.execute(query)
+
+    logger.info("Merging staging table into users")
+    cur.execute(MERGE_SQL)
+    inserted, updated = cur.fetchone()  # type: ignore[misc]
+
+    if history != HistoryMode.ROW:
+        cur.execute(ENABLE_HISTORY_TRIGGER_SQL)
+    return loaded, rejected, inserted, updated
+
+
+def _import_sharded(
+    stream: IO[str], fmt: ImportFormat, history: HistoryMode
+) -> tuple[int, int, int, int, int]:
+    """Импорт по всем шардам. Транзакции шардов коммитятся после слияния на всех шардах."""
+    with ExitStack() as stack:
+        # Соединения закрываются в обратном порядке: при ошибке все транзакции откатываются
+        connections = [
+            stack.enter_context(psycopg.connect(uri, connect_timeout=20))
+            for uri in Config.DB_SHARD_URIS
+        ]
+        cursors = [stack.enter_context(conn.cursor()) for conn in connections]
+        for cur in cursors:
+            cur.execute(CREATE_STAGING_SQL)
+
+        logger.info("Loading %s into staging tables of %d shards", fmt, len(cursors))
+        parse_rejected = _copy_rows(cursors, stream, fmt)
+        totals = [_merge_staging(cur, history) for cur in cursors]
+
+    loaded, rejected, inserted, updated = (sum(column) for column in zip(*totals))
+    return parse_rejected, loaded, rejected, inserted, updated
+
+
+def import_users(
+    stream: IO[str],
+    fmt: ImportFormat,
+    history: HistoryMode = HistoryMode.BATCH,
+) -> ImportReport:
+    """Импортирует пользователей из потока в одной транзакции.
+
+    Args:
+        stream (IO[str]): Текстовый поток с данными.
+        fmt (ImportFormat): Формат данных.
+        history (HistoryMode): Режим записи истории. BATCH и OFF блокируют запись
+            в `users` до конца импорта, ROW - нет.
+    Returns:
+        ImportReport: Количество вставленных, обновлённых и отбракованных строк.
+    """
+    if shard_count() > 1:
+        parse_rejected, loaded, rejected, inserted, updated = _import_sharded(
+            stream, fmt, history
+        )
+    else:
+        with psycopg.connect(Config.DB_URI, connect_timeout=20) as conn:
+            with conn.cursor() as cur:
+                cur.execute(CREATE_STAGING_SQL)
+
+                logger.info("Loading %s into staging table", fmt)
+                parse_rejected = _copy_rows([cur], stream, fmt)
+                loaded, rejected, inserted, updated = _merge_staging(cur, history)
+
+    report = build_report(parse_rejected, loaded, rejected, inserted, updated)
+    logger.info("Import finished: %s", report)
+    return report
+
+
+def build_report(
+    parse_rejected: int, loaded: int, rejected: int, inserted: int, updated: int
+) -> ImportReport:
+    """Собирает итог импорта.
+
+    Args:
+        parse_rejected (int): Строк отбраковано при разборе файла.
+        loaded (int): Строк загружено в staging таблицы.
+        rejected (int): Строк отбраковано при валидации staging таблиц.
+        inserted (int): Вставлено пользователей.
+        updated (int): Обновлено пользователей.
+    """
+    total = loaded + parse_rejected
+    rejected += parse_rejected
+    return ImportReport(
+        total=total,
+        inserted=inserted,
+        updated=updated,
+        # Сюда же попадают дубликаты id внутри файла
+        unchanged=total - rejected - inserted - updated,
+        rejected=rejected,
+    )
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m vpncon.users.importer",
+        description="Bulk import of users from CSV/NDJSON file",
+    )
+    parser.add_argument("path", help="path to the file, '-' for stdin")
+    parser.add_argument(
+        "--format", choices=[f.value for f in ImportFormat], default=None,
+        help="input format, detected by file extension by default",
+    )
+    parser.add_argument(
+        "--history", choices=[h.value for h in HistoryMode], default=HistoryMode.BATCH.value,
+        help=(
+            "how to write users_history during the import (default: batch)."
+            " batch and off disable history triggers and block all writes to users"
+            " until the import commits; use row on a live system"
+        ),
+    )
+    args = parser.parse_args(argv)
+
+    setup_logging()
+    fmt = ImportFormat(args.format) if args.format else detect_format(args.path)
+    history = HistoryMode(args.history)
+
+    if args.path == "-":
+        report = import_users(sys.stdin, fmt, history)
+    else:
+        with open(args.path, "r", encoding="utf-8", newline="") as f:
+            report = import_users(f, fmt, history)
+
+    print(report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
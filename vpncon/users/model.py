@@ -1,5 +1,6 @@
 from typing import Any
 from dataclasses import dataclass
+from datetime import date, datetime
 from enum import StrEnum
 
 from vpncon.db import DataModel
@@ -13,12 +14,17 @@ class Role(StrEnum):
     ACTIVATED_CLOSE_USER = "ACTIVATED_CLOSE_USER"
 
 
+# Роли, которые переводятся в DEACTIVATED_USER по истечении `expires_at`
+EXPIRING_ROLES = (Role.ACTIVATED_USER, Role.ACTIVATED_CLOSE_USER)
+
+
 @dataclass(frozen=True)
 class User(DataModel):
     """Модель пользователя."""
     telegram_id: int
     telegram_nick: str
     role: Role
+    expires_at: datetime | None = None
 
     @staticmethod
     def from_raw(raw: tuple[Any, ...]) -> 'User':
@@ -38,6 +44,9 @@ class User(DataModel):
             telegram_id = int(data['telegram_id'])
             telegram_nick = str(data['telegram_nick'])
             role = Role(data['role'])
+            expires_at = data.get('expires_at')
+            if expires_at is not None and not isinstance(expires_at, datetime):
+                raise TypeError("expires_at must be a datetime")
         except (ValueError, TypeError) as exc:
             raise ValueError(
                 f"Invalid data for User: {data}"
@@ -46,5 +55,22 @@ class User(DataModel):
         return User(
             telegram_id=telegram_id,
             telegram_nick=telegram_nick,
-            role=role
+            role=role,
+            expires_at=expires_at
         )
+
+
+@dataclass(frozen=True)
+class DailyStats(DataModel):
+    """Регистрации и отток пользователей за день (UTC)."""
+    day: date
+    signups: int
+    churned: int
+
+
+@dataclass(frozen=True)
+class UserStats(DataModel):
+    """Статистика пользователей для дашбордов."""
+    roles: dict[str, int]
+    total: int
+    daily: list[DailyStats]
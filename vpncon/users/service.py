@@ -1,11 +1,21 @@
 
 from abc import ABC, abstractmethod
+from collections import defaultdict
+from datetime import datetime
 
+from vpncon.db import shard_count, shard_for
 from vpncon.db.db import UniqueConstraintError
 
-from .crud import create_user, get_user, update_user, delete_user
-from vpncon.exceptions import EntityAlreadyExistsException, EntityNotExistsException
-from .model import User, Role
+from .crud import (
+    create_user, get_user, list_users, update_user, delete_user,
+    search_users_by_prefix, search_users_fuzzy, update_roles_by_ids, update_roles_by_role
+)
+from .stats import get_user_stats
+from vpncon.config import Config
+from vpncon.exceptions import (
+    EntityAlreadyExistsException, EntityNotExistsException, EntityValidationFailedException
+)
+from .model import User, Role, UserStats
 
 
 
@@ -14,7 +24,10 @@ from .model import User, Role
 class UserService(ABC):
 
     @abstractmethod
-    def create_user(self, telegram_id: int, telegram_nick: str, role: str) -> None:
+    def create_user(
+        self, telegram_id: int, telegram_nick: str, role: str,
+        expires_at: datetime | None = None
+    ) -> None:
         pass
 
     @abstractmethod
@@ -22,7 +35,28 @@ class UserService(ABC):
         pass
 
     @abstractmethod
-    def update_user(self, telegram_id: int, telegram_nick: str, role: str) -> None:
+    def list_users(self, after: int | None, limit: int) -> list[User]:
+        pass
+
+    @abstractmethod
+    def search_users(self, nick: str, limit: int, fuzzy: bool = True) -> list[User]:
+        pass
+
+    @abstractmethod
+    def get_stats(self, days: int) -> UserStats:
+        pass
+
+    @abstractmethod
+    def update_user(
+        self, telegram_id: int, telegram_nick: str, role: str,
+        expires_at: datetime | None = None
+    ) -> None:
+        pass
+
+    @abstractmethod
+    def change_roles(
+        self, role: str, telegram_ids: list[int] | None = None, current_role: str | None = None
+    ) -> int:
         pass
 
     @abstractmethod
@@ -31,9 +65,12 @@ class UserService(ABC):
 
 
 class UserServiceCRUD(UserService):
-    def create_user(self, telegram_id: int, telegram_nick: str, role: str):
+    def create_user(
+        self, telegram_id: int, telegram_nick: str, role: str,
+        expires_at: datetime | None = None
+    ):
         role = Role(role)
-        user = User(telegram_id, telegram_nick, role)
+        user = User(telegram_id, telegram_nick, role, expires_at)
         try:
             create_user(user)
         except UniqueConstraintError as exc:
@@ -44,13 +81,69 @@ class UserServiceCRUD(UserService):
     def get_user(self, telegram_id: int) -> User | None:
         return get_user(telegram_id)
 
-    def update_user(self, telegram_id: int, telegram_nick: str, role: str) -> None:
+    def list_users(self, after: int | None, limit: int) -> list[User]:
+        return list_users(after, limit)
+
+    def search_users(self, nick: str, limit: int, fuzzy: bool = True) -> list[User]:
+        """Сначала пользователи с ником, начинающимся с `nick`, затем,
+        если места в ответе остались, - с похожим ником
+        """
+        users = search_users_by_prefix(nick, limit)
+        if not fuzzy or len(users) >= limit or len(nick) < Config.USERS_SEARCH_FUZZY_MIN_LENGTH:
+            return users
+        found = {user.telegram_id for user in users}
+        # Совпавшие по префиксу обычно похожи и сами, поэтому запрашиваем с запасом
+        for user in search_users_fuzzy(nick, limit + len(users)):
+            if user.telegram_id not in found and len(users) < limit:
+                users.append(user)
+        return users
+
+    def get_stats(self, days: int) -> UserStats:
+        return get_user_stats(days)
+
+    def update_user(
+        self, telegram_id: int, telegram_nick: str, role: str,
+        expires_at: datetime | None = None
+    ) -> None:
         if get_user(telegram_id) is None:
             raise EntityNotExistsException(f"User with telegram_id={telegram_id} not found")
         role = Role(role)
-        user = User(telegram_id, telegram_nick, role)
+        user = User(telegram_id, telegram_nick, role, expires_at)
         return update_user(user)
 
+    def change_roles(
+        self, role: str, telegram_ids: list[int] | None = None, current_role: str | None = None
+    ) -> int:
+        """Меняет роль пользователям из `telegram_ids` или всем с ролью `current_role`.
+        На каждом шарде - одна транзакция с одним `UPDATE`.
+
+        Returns:
+            int: Сколько пользователей сменили роль.
+        """
+        role = Role(role)
+        if (telegram_ids is None) == (current_role is None):
+            raise EntityValidationFailedException("Exactly one of telegram_ids and filter is required")
+        if current_role is not None:
+            current_role = Role(current_role)
+            if current_role == role:
+                return 0
+            return sum(
+                len(update_roles_by_role(current_role, role, shard))
+                for shard in range(shard_count())
+            )
+
+        assert telegram_ids is not None
+        if len(telegram_ids) > Config.USERS_BULK_MAX_IDS:
+            raise EntityValidationFailedException(
+                f"At most {Config.USERS_BULK_MAX_IDS} telegram_ids are allowed"
+            )
+        by_shard: dict[int, list[int]] = defaultdict(list)
+        for telegram_id in sorted(set(telegram_ids)):
+            by_shard[shard_for(telegram_id)].append(telegram_id)
+        return sum(
+            len(update_roles_by_ids(ids, role, shard)) for shard, ids in sorted(by_shard.items())
+        )
+
     def delete_user(self, telegram_id: int):
         if get_user(telegram_id) is None:
             raise EntityNotExistsException(f"User with telegram_id={telegram_id} not found")
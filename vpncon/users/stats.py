@@ -0,0 +1,282 @@
+"""Статистика пользователей для дашбордов.
+
+`GET /users/stats` не сканирует `users`: стоимость ответа не зависит от числа пользователей.
+- число пользователей по ролям - сумма слотов счётчиков `users_role_counts`,
+  которые триггеры уровня оператора меняют вместе с `users` (см. миграцию `M_0008`)
+- регистрации и отток по дням - из `users_daily_stats`, которую `UserStatsJob` собирает
+  из `users_history` за последние `USERS_STATS_ROLLUP_DAYS` дней раз в `USERS_STATS_ROLLUP_INTERVAL`.
+  Регистрация - вставка пользователя, отток - переход в `DEACTIVATED_USER` или удаление
+  не деактивированного пользователя
+- раз в `USERS_STATS_RECONCILE_INTERVAL` `UserStatsJob` пересчитывает счётчики ролей по `users`
+  и исправляет расхождение (например, после ручных правок с отключёнными триггерами).
+  Сверка не блокирует изменения пользователей, см. `reconcile_role_counts`
+
+Безопасна при запуске в нескольких воркерах: проход по шарду выполняет тот,
+кто взял advisory lock, остальные его пропускают.
+
+Запуск отдельным процессом:
+```sh
+python -m vpncon.users.stats          # работать постоянно
+python -m vpncon.users.stats --once   # сбор дневной статистики и сверка счётчиков
+```
+"""
+import argparse
+import logging
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+from typing import LiteralString
+
+from vpncon import metrics
+from vpncon.config import Config, setup_logging
+from vpncon.db import auto_transaction, get_db_executor, IsolationLevel, Priority, shard_count
+from .model import DailyStats, UserStats
+
+
+logger = logging.getLogger(__name__)
+
+
+STATS_LOCK_KEY = 0x7670_6E73
+
+ROLE_COUNTS_SQL: LiteralString = """
+    SELECT role, CAST(sum(count) AS BIGINT)
+    FROM users_role_counts
+    GROUP BY role
+"""
+
+DAILY_STATS_SQL: LiteralString = """
+    SELECT day, signups, churned
+    FROM users_daily_stats
+    WHERE day >= %(since)s
+    ORDER BY day
+"""
+
+# Состояние после изменения из строки истории 'U' - следующая строка истории пользователя
+# (история хранит старые значения) или текущая строка `users`
+ROLLUP_DAILY_SQL: LiteralString = """
+    INSERT INTO users_daily_stats AS s (day, signups, churned)
+    SELECT
+        day,
+        count(*) FILTER (WHERE signup),
+        count(*) FILTER (WHERE churn)
+    FROM (
+        SELECT
+            (h.valid_to AT TIME ZONE 'UTC')::DATE AS day,
+            h.action = 'I' AS signup,
+            h.role <> 'DEACTIVATED_USER' AND (
+                h.action = 'D'
+                OR h.action = 'U' AND COALESCE(
+                    (
+                        SELECT n.role FROM users_history n
+                        WHERE n.telegram_id = h.telegram_id AND n.valid_to > h.valid_to
+                        ORDER BY n.valid_to
+                        LIMIT 1
+                    ),
+                    (SELECT u.role FROM users u WHERE u.telegram_id = h.telegram_id)
+                ) = 'DEACTIVATED_USER'
+            ) AS churn
+        FROM users_history h
+        WHERE h.valid_to >= %(since)s::DATE::TIMESTAMP AT TIME ZONE 'UTC'
+    ) AS events
+    GROUP BY day
+    ON CONFLICT (day) DO UPDATE
+        SET signups = EXCLUDED.signups, churned = EXCLUDED.churned
+        WHERE (s.signups, s.churned) IS DISTINCT FROM (EXCLUDED.signups, EXCLUDED.churned)
+"""
+
+ACTUAL_ROLE_COUNTS_SQL: LiteralString = """
+    SELECT role, count(*)
+    FROM users
+    GROUP BY role
+"""
+
+# Слот сверки. Триггеры пишут в слоты `pg_backend_pid() % 16` и с ним не пересекаются
+RECONCILE_SLOT = 16
+
+APPLY_DRIFT_SQL: LiteralString = """
+    INSERT INTO users_role_counts AS c (role, slot, count)
+    SELECT role, %(slot)s, delta
+    FROM unnest(%(roles)s::VARCHAR[], %(deltas)s::BIGINT[]) AS d(role, delta)
+    ORDER BY role
+    ON CONFLICT (role, slot) DO UPDATE SET count = c.count + EXCLUDED.count
+"""
+
+
+@auto_transaction(priority=Priority.HIGH)
+def get_user_stats(days: int) -> UserStats:
+    """Статистика пользователей всех шардов.
+
+    Args:
+        days (int): За сколько последних дней, включая сегодняшний, вернуть дневную статистику.
+    Returns:
+        UserStats: Число пользователей по ролям и регистрации и отток по дням.
+    """
+    executor = get_db_executor()
+    roles: dict[str, int] = defaultdict(int)
+    for role, count in executor.scatter(ROLE_COUNTS_SQL):
+        roles[role] += count
+
+    since = datetime.now(timezone.utc).date() - timedelta(days=days - 1)
+    daily: dict[date, list[int]] = defaultdict(lambda: [0, 0])
+    for day, signups, churned in executor.scatter(DAILY_STATS_SQL, since=since):
+        daily[day][0] += signups
+        daily[day][1] += churned
+
+    # Слоты удалённых ролей остаются с нулём
+    roles = {role: count for role, count in sorted(roles.items()) if count}
+    return UserStats(
+        roles=roles,
+        total=sum(roles.values()),
+        daily=[DailyStats(day, *daily[day]) for day in sorted(daily)],
+    )
+
+
+def _try_lock() -> bool:
+    result = get_db_executor().execute(
+        "SELECT pg_try_advisory_xact_lock(%(key)s)", key=STATS_LOCK_KEY
+    )
+    return bool(result[0][0])
+
+
+@auto_transaction(retries=3)
+def rollup_daily_stats(since: date, shard: int = 0) -> bool:
+    """Пересобирает дневную статистику шарда `shard` начиная с `since` из `users_history`.
+
+    Returns:
+        bool: False, если шард сейчас обрабатывает другой процесс.
+    """
+    executor = get_db_executor()
+    executor.route_shard(shard)
+    if not _try_lock():
+        return False
+    executor.execute(ROLLUP_DAILY_SQL, since=since)
+    return True
+
+
+# Счётчики и `users` читаются в одном снимке: изменения, закоммиченные после него,
+# есть и в `users`, и в слотах триггеров, и в расхождение не попадают
+@auto_transaction(retries=3, isolation_level=IsolationLevel.REPEATABLE_READ)
+def reconcile_role_counts(shard: int = 0) -> dict[str, int] | None:
+    """Пересчитывает число пользователей по ролям на шарде `shard` и исправляет счётчики.
+
+    Таблицы не блокируются: расхождение считается в снимке транзакции и прибавляется
+    к отдельному слоту `RECONCILE_SLOT`, который пишет только сверка. Если другая сверка
+    успела изменить этот слот после снимка, запись упадёт с ошибкой сериализации,
+    и транзакция повторится на свежем снимке.
+
+    Returns:
+        dict[str, int] | None: Исправленное расхождение по ролям (фактическое минус счётчик)
+            или None, если шард сейчас обрабатывает другой процесс.
+    """
+    executor = get_db_executor()
+    executor.route_shard(shard)
+    if not _try_lock():
+        return None
+    counted = dict(executor.execute(ROLE_COUNTS_SQL))
+    actual = dict(executor.execute(ACTUAL_ROLE_COUNTS_SQL))
+    drift = {
+        role: actual.get(role, 0) - counted.get(role, 0)
+        for role in sorted(counted.keys() | actual.keys())
+        if actual.get(role, 0) != counted.get(role, 0)
+    }
+    if drift:
+        executor.execute(
+            APPLY_DRIFT_SQL, slot=RECONCILE_SLOT, roles=list(drift), deltas=list(drift.values())
+        )
+    return drift
+
+
+class UserStatsJob:
+    """Фоновый поток, собирающий дневную статистику и сверяющий счётчики ролей."""
+    def __init__(
+        self,
+        rollup_interval: float | None = None,
+        reconcile_interval: float | None = None,
+    ) -> None:
+        self.rollup_interval = rollup_interval or Config.USERS_STATS_ROLLUP_INTERVAL
+        self.reconcile_interval = reconcile_interval or Config.USERS_STATS_RECONCILE_INTERVAL
+        self._next_reconcile = 0.0
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def rollup(self) -> None:
+        """Пересобирает дневную статистику за последние `USERS_STATS_ROLLUP_DAYS` дней."""
+        # Захватываем вчерашний день: транзакции, закоммиченные после полуночи
+        since = datetime.now(timezone.utc).date() - timedelta(days=Config.USERS_STATS_ROLLUP_DAYS - 1)
+        for shard in range(shard_count()):
+            if not rollup_daily_stats(since, shard):
+                logger.debug("Daily stats of shard %d are being collected elsewhere", shard)
+
+    def reconcile(self) -> dict[str, int]:
+        """Сверяет счётчики ролей всех шардов.
+
+        Returns:
+            dict[str, int]: Суммарное исправленное расхождение по ролям.
+        """
+        total: dict[str, int] = defaultdict(int)
+        for shard in range(shard_count()):
+            drift = reconcile_role_counts(shard)
+            for role, delta in (drift or {}).items():
+                total[role] += delta
+        if total:
+            metrics.inc("users.stats.drift", sum(abs(delta) for delta in total.values()))
+            logger.warning("Fixed users role counters drift: %s", dict(total))
+        return dict(total)
+
+    def run_pass(self) -> None:
+        """Сбор дневной статистики и, если подошло время, сверка счётчиков."""
+        self.rollup()
+        if time.monotonic() >= self._next_reconcile:
+            self.reconcile()
+            self._next_reconcile = time.monotonic() + self.reconcile_interval
+
+    def run_forever(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.run_pass()
+            except Exception:
+                logger.exception("Users stats pass failed")
+            self._stop.wait(self.rollup_interval)
+
+    def start(self) -> None:
+        """Запускает сверку в фоновом потоке."""
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self.run_forever, name="users-stats", daemon=True
+        )
+        self._thread.start()
+        from vpncon.shutdown import get_coordinator
+        get_coordinator().register("users_stats_job", self.stop)
+
+    def stop(self, timeout: float | None = None) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m vpncon.users.stats",
+        description="Collect daily users stats and reconcile role counters",
+    )
+    parser.add_argument("--once", action="store_true", help="run a single pass and exit")
+    args = parser.parse_args(argv)
+
+    setup_logging()
+    job = UserStatsJob()
+    if args.once:
+        job.rollup()
+        print(f"drift={job.reconcile()}")
+        return 0
+    try:
+        job.run_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
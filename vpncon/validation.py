@@ -0,0 +1,281 @@
+"""Проверка запросов по схемам из `openapi.yml`.
+
+Схемы компилируются один раз при создании приложения в цепочки простых проверок,
+поэтому на запрос не приходится ни разбора YAML, ни обхода схемы.
+Проверка выполняется в `before_request` приложения, то есть до `auto_transaction`:
+некорректный запрос получает `400` и не занимает соединение из пула.
+
+Проверяются path и query параметры и JSON тело запроса. Поддерживается подмножество
+OpenAPI 3.0, которое используется в `openapi.yml`: `type`, `nullable`, `enum`,
+`required`, `properties`, `items`, `minimum`/`maximum`, `minLength`/`maxLength`,
+`format: date-time` и `$ref` на `components`. Остальные ключевые слова игнорируются.
+
+Пример подключения:
+```python
+app.before_request(RequestValidator.from_file('openapi.yml'))
+```
+"""
+import logging
+import re
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable
+
+import yaml
+from flask import jsonify, request
+
+from vpncon import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+# Проверка значения: возвращает текст ошибки или None
+Check = Callable[[Any], str | None]
+
+HTTP_METHODS = ("get", "post", "put", "patch", "delete")
+
+# `<int:telegram_id>` -> `{telegram_id}`
+_FLASK_PARAM_RE = re.compile(r"<(?:[^:<>]+:)?([^<>]+)>")
+
+
+class SchemaCompiler:
+    """Компилирует схемы OpenAPI в функции проверки."""
+    def __init__(self, spec: dict[str, Any]) -> None:
+        self.spec = spec
+        self._refs: dict[str, Check] = {}
+
+    def _resolve_ref(self, ref: str) -> Check:
+        check = self._refs.get(ref)
+        if check is None:
+            # Откладываем компиляцию до первого вызова, чтобы переживать рекурсивные ссылки
+            compiled: list[Check] = []
+
+            def check(value: Any) -> str | None:
+                if not compiled:
+                    node: Any = self.spec
+                    for part in ref.removeprefix("#/").split("/"):
+                        node = node[part]
+                    compiled.append(self.compile(node))
+                return compiled[0](value)
+
+            self._refs[ref] = check
+        return check
+
+    def compile(self, schema: dict[str, Any]) -> Check:
+        """Собирает функцию проверки значения по схеме."""
+        if "$ref" in schema:
+            return self._resolve_ref(schema["$ref"])
+
+        checks: list[Check] = []
+        schema_type = schema.get("type")
+        if schema_type is not None:
+            checks.append(_type_check(schema_type))
+        if "enum" in schema:
+            allowed = frozenset(schema["enum"])
+            checks.append(
+                lambda v: None if v in allowed else f"must be one of {sorted(allowed)}"
+            )
+        if "minimum" in schema:
+            minimum = schema["minimum"]
+            checks.append(lambda v: None if v >= minimum else f"must be >= {minimum}")
+        if "maximum" in schema:
+            maximum = schema["maximum"]
+            checks.append(lambda v: None if v <= maximum else f"must be <= {maximum}")
+        if "minLength" in schema:
+            min_length = schema["minLength"]
+            checks.append(
+                lambda v: None if len(v) >= min_length else f"must be at least {min_length} chars"
+            )
+        if "maxLength" in schema:
+            max_length = schema["maxLength"]
+            checks.append(
+                lambda v: None if len(v) <= max_length else f"must be at most {max_length} chars"
+            )
+        if schema.get("format") == "date-time":
+            checks.append(_date_time_check)
+        if schema_type == "object":
+            checks.append(self._compile_object(schema))
+        if schema_type == "array" and "items" in schema:
+            checks.append(self._compile_array(schema["items"]))
+
+        nullable = bool(schema.get("nullable"))
+
+        def check(value: Any) -> str | None:
+            if value is None:
+                return None if nullable else "must not be null"
+            # Проверки по порядку: следующие рассчитывают на успешную проверку типа
+            for item_check in checks:
+                error = item_check(value)
+                if error is not None:
+                    return error
+            return None
+
+        return check
+
+    def _compile_object(self, schema: dict[str, Any]) -> Check:
+        required = tuple(schema.get("required", ()))
+        properties = tuple(
+            (name, self.compile(prop)) for name, prop in schema.get("properties", {}).items()
+        )
+
+        def check(value: dict[str, Any]) -> str | None:
+            for name in required:
+                if name not in value:
+                    return f"{name}: is required"
+            for name, prop_check in properties:
+                if name in value:
+                    error = prop_check(value[name])
+                    if error is not None:
+                        return f"{name}: {error}"
+            return None
+
+        return check
+
+    def _compile_array(self, items: dict[str, Any]) -> Check:
+        item_check = self.compile(items)
+
+        def check(value: list[Any]) -> str | None:
+            for i, item in enumerate(value):
+                error = item_check(item)
+                if error is not None:
+                    return f"[{i}]: {error}"
+            return None
+
+        return check
+
+
+def _type_check(schema_type: str) -> Check:
+    if schema_type == "integer":
+        # bool в python - подкласс int, но в JSON это разные типы
+        return lambda v: (
+            None if isinstance(v, int) and not isinstance(v, bool) else "must be an integer"
+        )
+    if schema_type == "number":
+        return lambda v: (
+            None if isinstance(v, (int, float)) and not isinstance(v, bool) else "must be a number"
+        )
+    types: dict[str, type | tuple[type, ...]] = {
+        "string": str, "boolean": bool, "object": dict, "array": list,
+    }
+    expected = types[schema_type]
+    message = f"must be of type {schema_type}"
+    return lambda v: None if isinstance(v, expected) else message
+
+
+def _date_time_check(value: str) -> str | None:
+    try:
+        datetime.fromisoformat(value)
+    except ValueError:
+        return "must be an ISO 8601 date-time"
+    return None
+
+
+def _parse_query_value(value: str, schema: dict[str, Any]) -> Any:
+    """Приводит строковый query параметр к типу из схемы. Непригодное значение остаётся строкой"""
+    try:
+        if schema.get("type") == "integer":
+            return int(value)
+        if schema.get("type") == "number":
+            return float(value)
+    except ValueError:
+        pass
+    if schema.get("type") == "boolean" and value in ("true", "false"):
+        return value == "true"
+    return value
+
+
+class OperationValidator:
+    """Проверка одной операции (путь + метод) из `openapi.yml`."""
+    def __init__(self, compiler: SchemaCompiler, operation: dict[str, Any]) -> None:
+        self.path_params: list[tuple[str, Check]] = []
+        self.query_params: list[tuple[str, dict[str, Any], bool, Check]] = []
+        for param in operation.get("parameters", []):
+            schema = param.get("schema", {})
+            check = compiler.compile(schema)
+            if param["in"] == "path":
+                self.path_params.append((param["name"], check))
+            elif param["in"] == "query":
+                self.query_params.append(
+                    (param["name"], schema, bool(param.get("required")), check)
+                )
+
+        body = operation.get("requestBody")
+        self.body_required = bool(body and body.get("required"))
+        self.body: Check | None = None
+        if body:
+            schema = body.get("content", {}).get("application/json", {}).get("schema")
+            if schema is not None:
+                self.body = compiler.compile(schema)
+
+    def validate(self) -> str | None:
+        """Проверяет текущий запрос Flask. Возвращает текст первой ошибки или None."""
+        view_args = request.view_args or {}
+        for name, check in self.path_params:
+            if name in view_args:
+                error = check(view_args[name])
+                if error is not None:
+                    return f"{name}: {error}"
+
+        for name, schema, required, check in self.query_params:
+            raw = request.args.get(name)
+            if raw is None:
+                if required:
+                    return f"{name}: is required"
+                continue
+            error = check(_parse_query_value(raw, schema))
+            if error is not None:
+                return f"{name}: {error}"
+
+        if self.body is not None:
+            data = request.get_json(silent=True)
+            if data is None:
+                if self.body_required:
+                    return "request body must be JSON"
+                return None
+            return self.body(data)
+        return None
+
+
+class RequestValidator:
+    """`before_request` хук, проверяющий запросы по скомпилированным операциям.
+    Запросы к маршрутам, которых нет в спецификации, пропускаются
+    """
+    def __init__(self, spec: dict[str, Any]) -> None:
+        compiler = SchemaCompiler(spec)
+        self.operations: dict[tuple[str, str], OperationValidator] = {}
+        for path, item in spec.get("paths", {}).items():
+            shared = item.get("parameters", [])
+            for method in HTTP_METHODS:
+                operation = item.get(method)
+                if operation is None:
+                    continue
+                if shared:
+                    operation = {
+                        **operation, "parameters": shared + operation.get("parameters", [])
+                    }
+                self.operations[(path, method.upper())] = OperationValidator(compiler, operation)
+        logger.debug("Compiled %d request validators", len(self.operations))
+
+    @staticmethod
+    def from_file(path: str | Path) -> 'RequestValidator':
+        # Загрузчик на libyaml в разы быстрее, если PyYAML собран с ним
+        loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+        with open(path, encoding="utf-8") as f:
+            return RequestValidator(yaml.load(f, Loader=loader))
+
+    def __call__(self):
+        if request.url_rule is None:
+            return None
+        path = _FLASK_PARAM_RE.sub(r"{\1}", request.url_rule.rule)
+        operation = self.operations.get((path, request.method))
+        if operation is None:
+            return None
+        error = operation.validate()
+        if error is None:
+            return None
+
+        metrics.inc("api.validation_failed")
+        metrics.inc(f"api.validation_failed.{request.endpoint}")
+        logger.debug("Invalid request to %s: %s", request.endpoint, error)
+        return jsonify({'error': error}), 400